@@ -0,0 +1,858 @@
+"""
+Front end HTTP asincrono (aiohttp) per Vineinventory Viewer.
+
+Espone le stesse route di server.Handler ma gestisce tutte le richieste su
+un unico event loop: le chiamate al database non bloccano thread e il pool
+connessioni di viewer_db vive nel loop dell'applicazione.
+
+Selezionabile all'avvio con SERVER_BACKEND=aiohttp (vedi server.py).
+"""
+import os
+import json
+import logging
+from contextlib import aclosing
+from typing import Optional, Dict, Any
+
+from aiohttp import web
+
+from compression import maybe_compress, is_compressible, stream_compressor
+from viewer_common import (
+    encode_csv_rows, csv_export_filename,
+    make_etag, http_date, is_not_modified, page_params_from_query, get_index_page
+)
+from static_assets import get_static_store, build_static_response, cache_control_for, INDEX_CACHE_CONTROL
+from serializers import dumps, iter_json_document, wants_columnar, JSON_STREAM_MIN_ROWS
+from cache_stats import CacheStatsLogger
+
+logger = logging.getLogger(__name__)
+
+# Secondi concessi alle richieste in corso durante lo shutdown
+SERVER_SHUTDOWN_TIMEOUT = float(os.getenv("SERVER_SHUTDOWN_TIMEOUT", 10))
+# Secondi di attesa della richiesta successiva su una connessione keep-alive
+SERVER_KEEPALIVE_TIMEOUT = float(os.getenv("SERVER_KEEPALIVE_TIMEOUT", 5))
+
+
+def _json_response(data: Any, status: int = 200) -> web.Response:
+    """Risposta JSON con lo stesso formato di server.Handler"""
+    return web.Response(
+        status=status,
+        body=dumps(data),
+        content_type='application/json'
+    )
+
+
+async def _stream_response(
+    request: web.Request,
+    chunks,
+    content_type: str,
+    headers: Optional[Dict[str, str]] = None
+) -> web.StreamResponse:
+    """Invia una risposta generata a blocchi (chunked), compressa se il client lo supporta"""
+    compressor = stream_compressor(request.headers.get('Accept-Encoding'), content_type)
+    response = web.StreamResponse(headers={'Content-Type': content_type, 'Vary': 'Accept-Encoding', **(headers or {})})
+    if compressor:
+        response.headers['Content-Encoding'] = compressor.encoding
+    response.enable_chunked_encoding()
+    
+    await response.prepare(request)
+    try:
+        for chunk in chunks:
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                await response.write(chunk)
+        if compressor:
+            await response.write(compressor.finish())
+        await response.write_eof()
+    except ConnectionError:
+        logger.warning("[SERVER] Risposta in streaming interrotta: connessione chiusa dal client")
+    except Exception as e:
+        # Header già inviati: si può solo troncare la risposta
+        logger.error(f"[SERVER] Errore durante la risposta in streaming: {e}", exc_info=True)
+    return response
+
+
+def _text_response(text: str, status: int) -> web.Response:
+    return web.Response(status=status, text=text, content_type='text/plain', charset='utf-8')
+
+
+def _validator_headers(etag: str, last_modified) -> Dict[str, str]:
+    """Header per richieste condizionali: il client deve sempre rivalidare"""
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+
+def _validate_token(token: str) -> Optional[Dict[str, Any]]:
+    from viewer_db import validate_viewer_token
+    return validate_viewer_token(token)
+
+
+async def _add_common_headers(request: web.Request, response: web.StreamResponse) -> None:
+    """Headers CORS e cache applicati a tutte le risposte (come Handler.end_headers)"""
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers.setdefault('Cache-Control', cache_control_for(request.path, response.status))
+
+
+@web.middleware
+async def view_id_middleware(request: web.Request, handler):
+    """Serve HTML dalla cache per qualsiasi path GET con ?view_id= (come Handler.do_GET)"""
+    if request.method == 'GET' and not request.path.startswith('/api/'):
+        view_id = request.query.get('view_id')
+        if view_id:
+            return await serve_html_from_cache(view_id)
+    return await handler(request)
+
+
+@web.middleware
+async def compression_middleware(request: web.Request, handler):
+    """Comprime le risposte testuali complete (JSON, CSV, HTML) secondo Accept-Encoding"""
+    response = await handler(request)
+    
+    if type(response) is not web.Response or response.status in (206, 304, 416):
+        return response
+    if 'Content-Encoding' in response.headers or not is_compressible(response.content_type):
+        return response
+    
+    # Lo snapshot varia anche per Accept (formato colonnare): Vary impostato dall'handler resta
+    response.headers.setdefault('Vary', 'Accept-Encoding')
+    body = response.body
+    if isinstance(body, bytes):
+        compressed, encoding = maybe_compress(body, request.headers.get('Accept-Encoding'), response.content_type)
+        if encoding:
+            response.body = compressed
+            response.headers['Content-Encoding'] = encoding
+    return response
+
+
+async def handle_options(request: web.Request) -> web.Response:
+    """Gestisci preflight requests per CORS"""
+    return web.Response(status=200)
+
+
+async def serve_index_with_config(request: web.Request) -> web.Response:
+    """Serve index.html con configurazione API iniettata (precalcolato in memoria)"""
+    try:
+        page = get_index_page()
+        if page is None:
+            return _text_response("File not found", 404)
+        
+        body, encoding, etag = page.variant(request.headers.get('Accept-Encoding'))
+        headers = {'ETag': etag, 'Cache-Control': INDEX_CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+        if page.last_modified is not None:
+            headers['Last-Modified'] = http_date(page.last_modified)
+        
+        if is_not_modified(
+            request.headers.get('If-None-Match'),
+            request.headers.get('If-Modified-Since'),
+            etag,
+            page.last_modified
+        ):
+            return web.Response(status=304, headers=headers)
+        
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        headers['Content-Type'] = 'text/html; charset=utf-8'
+        return web.Response(body=body, headers=headers)
+    except Exception as e:
+        logger.error(f"[SERVER] Errore servendo index.html: {e}", exc_info=True)
+        return _text_response(f"Internal server error: {e}", 500)
+
+
+async def serve_html_from_cache(view_id: str) -> web.Response:
+    """Serve HTML dalla cache"""
+    try:
+        from api_generate import get_viewer_html_from_cache
+        
+        html, found = get_viewer_html_from_cache(view_id)
+        
+        if not found:
+            logger.warning(f"[VIEWER_CACHE] View ID {view_id} non trovato")
+            return _text_response("View non trovata o scaduta", 404)
+        
+        logger.info(f"[VIEWER_CACHE] HTML servito per view_id={view_id}, length={len(html)}")
+        # La pagina contiene i dati dell'inventario: niente cache condivise
+        response = web.Response(text=html, content_type='text/html', charset='utf-8')
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_CACHE] Errore servendo HTML: {e}", exc_info=True)
+        return _text_response(f"Internal server error: {e}", 500)
+
+
+async def handle_generate_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint POST /api/generate"""
+    try:
+        body = await request.read()
+        if not body:
+            return _text_response("Body vuoto", 400)
+        
+        data = json.loads(body.decode('utf-8'))
+        
+        telegram_id = data.get('telegram_id')
+        business_name = data.get('business_name')
+        correlation_id = data.get('correlation_id')
+        
+        if not telegram_id or not business_name:
+            return _text_response("telegram_id e business_name richiesti", 400)
+        
+        logger.info(
+            f"[VIEWER_API] Richiesta generazione per telegram_id={telegram_id}, "
+            f"business_name={business_name}, correlation_id={correlation_id}"
+        )
+        
+        from api_generate import generate_viewer_html
+        
+        result = await generate_viewer_html(telegram_id, business_name, correlation_id)
+        
+        logger.info(
+            f"[VIEWER_API] Generazione completata: view_id={result.get('view_id')}, "
+            f"telegram_id={telegram_id}, correlation_id={correlation_id}"
+        )
+        return _json_response(result)
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore generazione: {e}", exc_info=True)
+        return _text_response(f"Internal server error: {e}", 500)
+
+
+async def handle_snapshot_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint GET /api/inventory/snapshot"""
+    try:
+        token = request.query.get('token')
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        logger.info(f"[VIEWER_API] Richiesta snapshot ricevuta, token_length={len(token)}")
+        
+        # Formato colonnare opzionale: ?format=columnar oppure Accept
+        try:
+            columnar = wants_columnar(request.query.get('format'), request.headers.get('Accept'))
+        except ValueError as e:
+            return _json_response({"detail": str(e)}, 400)
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        logger.info(
+            f"[VIEWER_API] Snapshot richiesto per telegram_id={telegram_id}, "
+            f"business_name={business_name}"
+        )
+        
+        from viewer_db import get_inventory_snapshot, get_inventory_snapshot_columnar, get_inventory_version
+        
+        # Versione inventario con query aggregata: se il client ha già questa versione risponde 304
+        version_info = await get_inventory_version(telegram_id, business_name)
+        # Ogni formato ha il proprio ETag
+        etag_suffix = ":columnar" if columnar else ""
+        etag = make_etag(version_info["version"] + etag_suffix)
+        last_modified = version_info["last_updated_at"]
+        
+        if is_not_modified(
+            request.headers.get('If-None-Match'),
+            request.headers.get('If-Modified-Since'),
+            etag,
+            last_modified
+        ):
+            logger.info(f"[VIEWER_API] Snapshot non modificato (304): telegram_id={telegram_id}")
+            headers = _validator_headers(etag, last_modified)
+            headers['Vary'] = 'Accept, Accept-Encoding'
+            return web.Response(status=304, headers=headers)
+        
+        fetch_snapshot = get_inventory_snapshot_columnar if columnar else get_inventory_snapshot
+        snapshot_data = await fetch_snapshot(telegram_id, business_name, version=version_info["version"])
+        if snapshot_data["meta"]["version"] != version_info["version"]:
+            # Inventario cambiato tra le due query: il body è più recente di last_modified
+            etag = make_etag(snapshot_data["meta"]["version"] + etag_suffix)
+            last_modified = None
+        
+        logger.info(
+            f"[VIEWER_API] Snapshot restituito con successo: rows={snapshot_data.get('meta', {}).get('total_rows', 0)}, "
+            f"format={'columnar' if columnar else 'json'}"
+        )
+        headers = _validator_headers(etag, last_modified)
+        headers['Vary'] = 'Accept, Accept-Encoding'
+        if not columnar and len(snapshot_data["rows"]) >= JSON_STREAM_MIN_ROWS:
+            # Inventario grande: righe serializzate e inviate a blocchi
+            return await _stream_response(
+                request,
+                iter_json_document(snapshot_data, "rows"),
+                'application/json',
+                headers
+            )
+        response = _json_response(snapshot_data)
+        response.headers.update(headers)
+        return response
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore snapshot: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_facets_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint GET /api/inventory/facets"""
+    try:
+        token = request.query.get('token')
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        from viewer_db import get_inventory_facets, get_inventory_version
+        
+        version_info = await get_inventory_version(telegram_id, business_name)
+        etag = make_etag(version_info["version"])
+        last_modified = version_info["last_updated_at"]
+        
+        if is_not_modified(
+            request.headers.get('If-None-Match'),
+            request.headers.get('If-Modified-Since'),
+            etag,
+            last_modified
+        ):
+            return web.Response(status=304, headers=_validator_headers(etag, last_modified))
+        
+        facets_data = await get_inventory_facets(telegram_id, business_name, version=version_info["version"])
+        if facets_data["meta"]["version"] != version_info["version"]:
+            etag = make_etag(facets_data["meta"]["version"])
+            last_modified = None
+        
+        response = _json_response(facets_data)
+        response.headers.update(_validator_headers(etag, last_modified))
+        return response
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore facets: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_movements_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint GET /api/inventory/movements"""
+    try:
+        token = request.query.get('token')
+        wine_name = request.query.get('wine_name')
+        # Serie aggregata (day/week/month) e intervallo date opzionali
+        bucket = request.query.get('bucket')
+        date_from = request.query.get('from')
+        date_to = request.query.get('to')
+        
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        if not wine_name:
+            return _text_response("wine_name mancante", 400)
+        
+        logger.info(f"[VIEWER_API] Richiesta movimenti per vino '{wine_name}', token_length={len(token)}")
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        logger.info(
+            f"[VIEWER_API] Movimenti richiesti per vino '{wine_name}', "
+            f"telegram_id={telegram_id}, business_name={business_name}"
+        )
+        
+        from viewer_db import get_wine_movements, get_wine_movement_series
+        try:
+            if bucket:
+                # Serie aggregata in SQL invece delle righe grezze
+                series = await get_wine_movement_series(
+                    telegram_id, business_name, wine_name, bucket, date_from, date_to
+                )
+                payload = {"bucket": bucket, "series": series}
+                count = len(series)
+            else:
+                movements = await get_wine_movements(telegram_id, business_name, wine_name, date_from, date_to)
+                payload = {"movements": movements}
+                count = len(movements)
+        except ValueError as e:
+            logger.warning(f"[VIEWER_API] Parametri movimenti non validi: {e}")
+            return _json_response({"detail": str(e)}, 400)
+        
+        logger.info(
+            f"[VIEWER_API] Movimenti restituiti con successo: count={count}"
+        )
+        return _json_response(payload)
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore movimenti: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_movements_batch_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint GET /api/inventory/movements/batch"""
+    try:
+        token = request.query.get('token')
+        wine_names = request.query.getall('wine_name', [])
+        all_wines = request.query.get('all', '').lower() in ('1', 'true')
+        
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        if not wine_names and not all_wines:
+            return _text_response("wine_name o all=1 richiesto", 400)
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        from viewer_db import get_wines_movements
+        try:
+            movements = await get_wines_movements(
+                telegram_id, business_name, None if all_wines else wine_names
+            )
+        except ValueError as e:
+            logger.warning(f"[VIEWER_API] Parametri movimenti non validi: {e}")
+            return _json_response({"detail": str(e)}, 400)
+        
+        logger.info(f"[VIEWER_API] Movimenti in blocco restituiti: wines={len(movements)}")
+        return _json_response({"movements": movements})
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore movimenti in blocco: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_delta_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint GET /api/inventory/delta"""
+    try:
+        token = request.query.get('token')
+        since = request.query.get('since')
+        
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        if not since:
+            return _text_response("since mancante", 400)
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        from viewer_db import get_inventory_delta
+        try:
+            delta_data = await get_inventory_delta(
+                telegram_id, business_name, since, request.query.get('version')
+            )
+        except ValueError as e:
+            logger.warning(f"[VIEWER_API] Parametri delta non validi: {e}")
+            return _json_response({"detail": str(e)}, 400)
+        
+        logger.info(
+            f"[VIEWER_API] Delta inventario restituito: rows={len(delta_data['rows'])}, "
+            f"deleted={len(delta_data['deleted_ids'])}, resync={delta_data['meta']['resync']}"
+        )
+        response = _json_response(delta_data)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore delta inventario: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_events_endpoint(request: web.Request) -> web.StreamResponse:
+    """Gestisci endpoint GET /api/inventory/events (Server-Sent Events)"""
+    token = request.query.get('token')
+    if not token:
+        return _text_response("Token mancante", 400)
+    
+    token_data = _validate_token(token)
+    if not token_data:
+        logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto per stream eventi")
+        return _json_response({"detail": "Token scaduto o non valido"}, 401)
+    
+    from inventory_events import get_event_hub, format_sse, TooManySubscribersError
+    hub = get_event_hub()
+    
+    async with aclosing(hub.subscribe(
+        token_data["telegram_id"], token_data["business_name"], token_data.get("exp")
+    )) as events:
+        try:
+            ready = await events.__anext__()
+        except TooManySubscribersError as e:
+            response = _json_response({"detail": str(e)}, 503)
+            response.headers['Retry-After'] = '30'
+            return response
+        except ValueError as e:
+            return _json_response({"detail": str(e)}, 404)
+        
+        response = web.StreamResponse(headers={
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        })
+        await response.prepare(request)
+        
+        logger.info(
+            f"[VIEWER_API] Stream eventi aperto: telegram_id={token_data['telegram_id']}, "
+            f"business_name={token_data['business_name']}, subscribers={hub.subscriber_count}"
+        )
+        
+        try:
+            await response.write(b"retry: 5000\n" + format_sse(ready))
+            async for event in events:
+                await response.write(format_sse(event))
+        except (ConnectionResetError, ConnectionError):
+            logger.debug("[VIEWER_API] Stream eventi chiuso dal client")
+        except Exception as e:
+            # Header già inviati: si chiude lo stream, il client si riconnette
+            logger.error(f"[VIEWER_API] Errore durante lo stream eventi: {e}", exc_info=True)
+        
+        return response
+
+
+async def handle_page_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint GET /api/inventory/page"""
+    try:
+        token = request.query.get('token')
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        from viewer_db import get_inventory_page
+        try:
+            page_data = await get_inventory_page(
+                telegram_id, business_name, **page_params_from_query(request.query)
+            )
+        except ValueError as e:
+            # Parametri non validi (sort, limit, cursore, ...)
+            logger.warning(f"[VIEWER_API] Parametri pagina non validi: {e}")
+            return _json_response({"detail": str(e)}, 400)
+        
+        logger.info(
+            f"[VIEWER_API] Pagina inventario restituita: rows={len(page_data['rows'])}, "
+            f"filtered_rows={page_data['meta']['filtered_rows']}"
+        )
+        response = _json_response(page_data)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore pagina inventario: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_csv_export_endpoint(request: web.Request) -> web.StreamResponse:
+    """Gestisci endpoint GET /api/inventory/export.csv"""
+    try:
+        token = request.query.get('token')
+        if not token:
+            return _text_response("Token mancante", 400)
+        
+        logger.info(f"[VIEWER_API] Richiesta export CSV ricevuta, token_length={len(token)}")
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto per export CSV")
+            return _text_response("Token scaduto o non valido", 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        logger.info(
+            f"[VIEWER_API] Export CSV richiesto per telegram_id={telegram_id}, "
+            f"business_name={business_name}"
+        )
+        
+        from viewer_db import iter_inventory_csv_rows
+        batches = iter_inventory_csv_rows(telegram_id, business_name)
+        try:
+            # Primo blocco prima degli header: un errore della query produce ancora un 500
+            first_batch = await batches.__anext__()
+        except StopAsyncIteration:
+            first_batch = []
+        except Exception:
+            await batches.aclose()
+            raise
+    
+    except Exception as e:
+        logger.error(f"[VIEWER_API] Errore export CSV: {e}", exc_info=True)
+        return _text_response(f"Errore interno: {str(e)}", 500)
+    
+    filename = csv_export_filename(business_name)
+    content_type = 'text/csv; charset=utf-8'
+    compressor = stream_compressor(request.headers.get('Accept-Encoding'), content_type)
+    
+    # Risposta chunked: ogni blocco letto dal cursore viene inviato subito
+    response = web.StreamResponse(headers={
+        'Content-Type': content_type,
+        'Content-Disposition': f'attachment; filename="{filename}"',
+        'Vary': 'Accept-Encoding'
+    })
+    if compressor:
+        response.headers['Content-Encoding'] = compressor.encoding
+    response.enable_chunked_encoding()
+    
+    try:
+        await response.prepare(request)
+        
+        total_rows = len(first_batch)
+        await _write_csv_chunk(response, encode_csv_rows(first_batch, include_headers=True), compressor)
+        async for batch in batches:
+            total_rows += len(batch)
+            await _write_csv_chunk(response, encode_csv_rows(batch), compressor)
+        if compressor:
+            await response.write(compressor.finish())
+        await response.write_eof()
+    except ConnectionError:
+        logger.warning("[VIEWER_API] Export CSV interrotto: connessione chiusa dal client")
+        return response
+    except Exception as e:
+        # Header già inviati: si può solo troncare la risposta
+        logger.error(f"[VIEWER_API] Errore durante lo streaming CSV: {e}", exc_info=True)
+        return response
+    finally:
+        await batches.aclose()
+    
+    logger.info(
+        f"[VIEWER_API] CSV esportato con successo: rows={total_rows}, "
+        f"filename={filename}"
+    )
+    return response
+
+
+async def _write_csv_chunk(response: web.StreamResponse, chunk: bytes, compressor) -> None:
+    """Scrive un blocco dell'export CSV (compresso se negoziato)"""
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        await response.write(chunk)
+
+
+async def handle_update_field_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint POST /api/inventory/update-field"""
+    try:
+        body = await request.read()
+        if not body:
+            return _text_response("Body vuoto", 400)
+        
+        data = json.loads(body.decode('utf-8'))
+        
+        token = data.get('token')
+        wine_id = data.get('wine_id')
+        field = data.get('field')
+        value = data.get('value')
+        # Versione della riga vista dal client (controllo di concorrenza, opzionale)
+        expected_updated_at = data.get('expected_updated_at')
+        
+        if not all([token, wine_id, field, value is not None]):
+            return _text_response("Parametri mancanti: token, wine_id, field, value richiesti", 400)
+        
+        logger.info(f"[UPDATE_FIELD] Richiesta update campo: wine_id={wine_id}, field={field}, value={value}")
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[UPDATE_FIELD] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        logger.info(
+            f"[UPDATE_FIELD] Update richiesto per wine_id={wine_id}, field={field}, "
+            f"telegram_id={telegram_id}, business_name={business_name}"
+        )
+        
+        from viewer_db import update_wine_field, StaleWriteError
+        
+        try:
+            result = await update_wine_field(
+                telegram_id=telegram_id,
+                business_name=business_name,
+                wine_id=wine_id,
+                field=field,
+                value=str(value) if value is not None else '',
+                expected_updated_at=expected_updated_at
+            )
+            logger.info(f"[UPDATE_FIELD] Campo aggiornato con successo: {result}")
+            return _json_response(result)
+        except StaleWriteError as e:
+            # Il vino è stato modificato dopo la versione vista dal client
+            logger.warning(f"[UPDATE_FIELD] Conflitto di versione: {e}")
+            current = e.current_updated_at.isoformat() if e.current_updated_at else None
+            return _json_response({"detail": str(e), "current_updated_at": current}, 409)
+        except ValueError as e:
+            # Errore di validazione (campo non supportato, valore non valido, etc.)
+            error_msg = str(e)
+            logger.warning(f"[UPDATE_FIELD] Errore validazione: {error_msg}")
+            return _json_response({"detail": error_msg}, 400)
+        except Exception as e:
+            error_msg = str(e)
+            logger.error(f"[UPDATE_FIELD] Errore aggiornamento database: {error_msg}", exc_info=True)
+            return _json_response({"detail": f"Errore durante l'aggiornamento: {error_msg}"}, 500)
+    
+    except json.JSONDecodeError as e:
+        logger.error(f"[UPDATE_FIELD] Errore parsing JSON: {e}")
+        return _text_response("JSON non valido", 400)
+    except Exception as e:
+        logger.error(f"[UPDATE_FIELD] Errore generico: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore interno: {str(e)}"}, 500)
+
+
+async def handle_update_fields_endpoint(request: web.Request) -> web.Response:
+    """Gestisci endpoint POST /api/inventory/update-fields (modifiche in blocco)"""
+    try:
+        body = await request.read()
+        if not body:
+            return _text_response("Body vuoto", 400)
+        
+        data = json.loads(body.decode('utf-8'))
+        token = data.get('token')
+        changes = data.get('changes')
+        
+        if not token or not changes:
+            return _text_response("Parametri mancanti: token e changes richiesti", 400)
+        
+        token_data = _validate_token(token)
+        if not token_data:
+            logger.warning(f"[UPDATE_FIELDS] Token JWT non valido o scaduto")
+            return _json_response({"detail": "Token scaduto o non valido"}, 401)
+        
+        telegram_id = token_data["telegram_id"]
+        business_name = token_data["business_name"]
+        
+        logger.info(
+            f"[UPDATE_FIELDS] Update in blocco richiesto: changes={len(changes) if isinstance(changes, list) else '?'}, "
+            f"telegram_id={telegram_id}, business_name={business_name}"
+        )
+        
+        from viewer_db import update_wine_fields
+        try:
+            result = await update_wine_fields(telegram_id, business_name, changes)
+        except ValueError as e:
+            logger.warning(f"[UPDATE_FIELDS] Errore validazione: {e}")
+            return _json_response({"detail": str(e)}, 400)
+        
+        response = _json_response(result)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    
+    except json.JSONDecodeError as e:
+        logger.error(f"[UPDATE_FIELDS] Errore parsing JSON: {e}")
+        return _text_response("JSON non valido", 400)
+    except Exception as e:
+        logger.error(f"[UPDATE_FIELDS] Errore aggiornamento in blocco: {e}", exc_info=True)
+        return _json_response({"detail": f"Errore durante l'aggiornamento: {str(e)}"}, 500)
+
+
+async def serve_static_file(request: web.Request) -> web.StreamResponse:
+    """Serve file statici dalla directory del viewer (dalla memoria: ETag, 304, Range, varianti compresse)"""
+    store = get_static_store()
+    # resolve blocca anche il path traversal fuori dalla directory del viewer
+    file_path = store.resolve(request.match_info.get('path', ''))
+    if file_path is None:
+        return _text_response("File not found", 404)
+    
+    asset = store.get(file_path)
+    if asset is None:
+        # File troppo grande per la memoria: da disco
+        return web.FileResponse(file_path)
+    
+    status, headers, body = build_static_response(asset, request.headers, request.query.get('v'))
+    return web.Response(status=status, body=body if status != 304 else None, headers=headers)
+
+
+async def _close_event_streams(app: web.Application) -> None:
+    # Gli stream SSE non terminano da soli: vanno chiusi prima di attendere gli handler
+    from inventory_events import get_event_hub
+    await get_event_hub().close()
+
+
+async def _close_db_pool(app: web.Application) -> None:
+    from viewer_db import close_pool
+    await close_pool()
+
+
+async def _start_cache_stats(app: web.Application) -> None:
+    # Hit rate delle cache nei log, periodicamente e allo shutdown
+    app['cache_stats'] = CacheStatsLogger()
+    app['cache_stats'].start()
+
+
+async def _stop_cache_stats(app: web.Application) -> None:
+    # Prima della chiusura della view cache: le statistiche finali la leggono
+    app['cache_stats'].stop()
+
+
+async def _close_view_cache(app: web.Application) -> None:
+    from view_cache import get_view_cache
+    get_view_cache().close()
+
+
+def create_app() -> web.Application:
+    """Crea l'applicazione aiohttp con le stesse route di server.Handler"""
+    app = web.Application(middlewares=[compression_middleware, view_id_middleware])
+    
+    app.router.add_get('/api/inventory/snapshot', handle_snapshot_endpoint)
+    app.router.add_get('/api/inventory/page', handle_page_endpoint)
+    app.router.add_get('/api/inventory/facets', handle_facets_endpoint)
+    app.router.add_get('/api/inventory/delta', handle_delta_endpoint)
+    app.router.add_get('/api/inventory/events', handle_events_endpoint)
+    app.router.add_get('/api/inventory/export.csv', handle_csv_export_endpoint)
+    app.router.add_get('/api/inventory/movements', handle_movements_endpoint)
+    app.router.add_get('/api/inventory/movements/batch', handle_movements_batch_endpoint)
+    app.router.add_post('/api/inventory/update-field', handle_update_field_endpoint)
+    app.router.add_post('/api/inventory/update-fields', handle_update_fields_endpoint)
+    app.router.add_route('*', '/api/generate', handle_generate_endpoint)
+    app.router.add_get('/', serve_index_with_config)
+    app.router.add_get('/index.html', serve_index_with_config)
+    app.router.add_route('OPTIONS', '/{path:.*}', handle_options)
+    app.router.add_get('/{path:.*}', serve_static_file)
+    
+    app.on_response_prepare.append(_add_common_headers)
+    app.on_startup.append(_start_cache_stats)
+    app.on_shutdown.append(_close_event_streams)
+    app.on_cleanup.append(_stop_cache_stats)
+    app.on_cleanup.append(_close_db_pool)
+    app.on_cleanup.append(_close_view_cache)
+    
+    return app
+
+
+def run(port: int) -> None:
+    """Avvia il server aiohttp (blocca fino a SIGTERM/SIGINT)"""
+    logger.info("[SERVER] Backend aiohttp: tutte le richieste su un unico event loop")
+    web.run_app(
+        create_app(),
+        host="0.0.0.0",
+        port=port,
+        shutdown_timeout=SERVER_SHUTDOWN_TIMEOUT,
+        keepalive_timeout=SERVER_KEEPALIVE_TIMEOUT,
+        access_log=None,
+        print=None
+    )
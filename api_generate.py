@@ -0,0 +1,73 @@
+"""
+Generazione delle pagine viewer richieste dal bot (POST /api/generate).
+
+Ogni pagina contiene lo snapshot dell'inventario al momento della
+generazione ed è raggiungibile tramite ?view_id= finché non scade
+(VIEW_CACHE_TTL). Le pagine sono conservate in view_cache: in memoria e,
+se VIEW_CACHE_DB_PATH è configurato, su disco.
+"""
+import secrets
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+import viewer_db
+from serializers import to_columnar
+from viewer_common import get_index_page, inject_snapshot_data
+from view_cache import get_view_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def generate_viewer_html(
+    telegram_id: int,
+    business_name: str,
+    correlation_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Genera la pagina viewer di un inventario e la salva in cache.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        correlation_id: ID di correlazione del bot (solo per i log)
+    
+    Returns:
+        Dict con view_id, url relativo e scadenza della pagina
+    """
+    telegram_id = int(telegram_id)
+    snapshot = await viewer_db.get_inventory_snapshot(telegram_id, business_name)
+    
+    page = get_index_page()
+    if page is None:
+        raise RuntimeError("index.html non trovato")
+    # Snapshot incluso nel formato colonnare (pagina più leggera), decodificato da app.js
+    html = inject_snapshot_data(page.html, to_columnar(snapshot))
+    
+    view_id = secrets.token_urlsafe(16)
+    expires_at = get_view_cache().put(view_id, html)
+    
+    logger.info(
+        f"[VIEWER_API] Pagina generata: view_id={view_id}, rows={snapshot['meta']['total_rows']}, "
+        f"bytes={len(html)}, correlation_id={correlation_id}"
+    )
+    
+    return {
+        "status": "success",
+        "view_id": view_id,
+        "url": f"/?view_id={view_id}",
+        "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat(),
+        "rows": snapshot['meta']['total_rows'],
+        "correlation_id": correlation_id
+    }
+
+
+def get_viewer_html_from_cache(view_id: str) -> Tuple[Optional[str], bool]:
+    """
+    Recupera una pagina generata.
+    
+    Returns:
+        (html, found): found è False se il view_id è sconosciuto o scaduto
+    """
+    html = get_view_cache().get(view_id)
+    return html, html is not None
@@ -3,9 +3,16 @@
 let CONFIG = {
     apiBase: "",  // Vuoto = stesso dominio del viewer (endpoint locale)
     endpointSnapshot: "/api/inventory/snapshot",
+    // Snapshot in formato colonnare (più compatto), decodificato da decodeColumnarSnapshot
+    snapshotFormat: "columnar",
     endpointCsv: "/api/inventory/export.csv",
     endpointMovements: "/api/inventory/movements",
-    pageSize: 50
+    endpointMovementsBatch: "/api/inventory/movements/batch",
+    endpointDelta: "/api/inventory/delta",
+    endpointEvents: "/api/inventory/events",
+    pageSize: 50,
+    // Aggiornamento periodico incrementale (solo righe modificate), 0 = disattivato
+    refreshIntervalMs: 60000
 };
 
 // Chart instance
@@ -76,10 +83,43 @@ function formatRelativeTime(isoString) {
     return `${diffDays} giorni fa`;
 }
 
+// Snapshot colonnare ({format: "columnar", columns, dictionaries, values, ...}) -> {rows, facets, meta}
+// Gli altri formati vengono restituiti invariati
+function decodeColumnarSnapshot(data) {
+    if (!data || data.format !== "columnar") return data;
+
+    const columns = data.columns || [];
+    const dictionaries = data.dictionaries || {};
+    const count = columns.length > 0 ? data.values[0].length : 0;
+
+    // Indici del dizionario sostituiti dai valori (null resta null)
+    const columnValues = columns.map((column, index) => {
+        const values = data.values[index];
+        const dictionary = dictionaries[column];
+        if (!dictionary) return values;
+        return values.map(value => value === null ? null : dictionary[value]);
+    });
+
+    const rows = new Array(count);
+    for (let i = 0; i < count; i++) {
+        const row = {};
+        for (let c = 0; c < columns.length; c++) {
+            row[columns[c]] = columnValues[c][i];
+        }
+        rows[i] = row;
+    }
+
+    const { format, columns: _columns, dictionaries: _dictionaries, values: _values, ...rest } = data;
+    return { rows, ...rest };
+}
+
 // Fetch snapshot from API
 async function fetchSnapshot(token) {
     const baseUrl = CONFIG.apiBase || window.location.origin;
-    const url = `${baseUrl}${CONFIG.endpointSnapshot}?token=${encodeURIComponent(token)}`;
+    let url = `${baseUrl}${CONFIG.endpointSnapshot}?token=${encodeURIComponent(token)}`;
+    if (CONFIG.snapshotFormat) {
+        url += `&format=${encodeURIComponent(CONFIG.snapshotFormat)}`;
+    }
 
     console.log("[VIEWER] ===== DEBUG INFO =====");
     console.log("[VIEWER] CONFIG.apiBase:", CONFIG.apiBase);
@@ -114,7 +154,7 @@ async function fetchSnapshot(token) {
             throw new Error(`HTTP ${response.status}: ${errorText.substring(0, 200)}`);
         }
 
-        const data = await response.json();
+        const data = decodeColumnarSnapshot(await response.json());
         console.log("[VIEWER] Data received successfully:", {
             rows: data.rows ? data.rows.length : 0,
             facets: data.facets ? Object.keys(data.facets).length : 0,
@@ -144,15 +184,18 @@ async function fetchSnapshot(token) {
 async function loadData() {
     const token = getTokenFromURL();
     
-    if (!token) {
+    if (!token && !window.VIEWER_SNAPSHOT) {
         showError("Token mancante nell'URL");
         return;
     }
 
     let data;
 
-    // Se token è FAKE, usa mock data
-    if (token === "FAKE" || token === "fake") {
+    // Pagina generata (?view_id=): i dati sono già inclusi nell'HTML
+    if (!token) {
+        data = decodeColumnarSnapshot(window.VIEWER_SNAPSHOT);
+    } else if (token === "FAKE" || token === "fake") {
+        // Se token è FAKE, usa mock data
         data = MOCK_DATA;
         // Simula delay
         await new Promise(resolve => setTimeout(resolve, 500));
@@ -203,6 +246,158 @@ async function loadData() {
     setupCsvDownload(token);
 }
 
+// Ordine dello snapshot (ORDER BY name, vintage): usato per inserire le righe nuove
+function compareSnapshotRows(a, b) {
+    const nameA = a.name || '';
+    const nameB = b.name || '';
+    if (nameA !== nameB) return nameA < nameB ? -1 : 1;
+    const vintageA = a.vintage ?? Infinity;
+    const vintageB = b.vintage ?? Infinity;
+    return vintageA === vintageB ? 0 : (vintageA < vintageB ? -1 : 1);
+}
+
+// Aggiorna allData con le sole modifiche dall'ultimo caricamento (delta).
+// Ricade sullo snapshot completo se il server chiede un resync o in caso di errore.
+async function refreshData() {
+    const token = getTokenFromURL();
+    // Pagina generata: snapshot statico, niente da aggiornare
+    if (!token) return;
+    if (token === "FAKE" || token === "fake" || !allData.meta.version || !allData.meta.last_update) {
+        return loadData();
+    }
+    
+    let delta;
+    try {
+        const baseUrl = CONFIG.apiBase || window.location.origin;
+        const params = new URLSearchParams({
+            token: token,
+            since: allData.meta.last_update,
+            version: allData.meta.version
+        });
+        const response = await fetch(`${baseUrl}${CONFIG.endpointDelta}?${params.toString()}`);
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
+        }
+        delta = await response.json();
+    } catch (error) {
+        console.warn('[REFRESH] Delta non disponibile, ricarico lo snapshot:', error);
+        return loadData();
+    }
+    
+    if (delta.meta.resync) {
+        return loadData();
+    }
+    
+    if (delta.meta.version === allData.meta.version) {
+        return;
+    }
+    
+    const deleted = new Set(delta.deleted_ids || []);
+    const changed = new Map((delta.rows || []).map(row => [row.id, row]));
+    
+    const rows = [];
+    for (const row of allData.rows) {
+        if (deleted.has(row.id)) continue;
+        if (changed.has(row.id)) {
+            rows.push(changed.get(row.id));
+            changed.delete(row.id);
+        } else {
+            rows.push(row);
+        }
+    }
+    if (changed.size > 0) {
+        // Righe nuove: inserite rispettando l'ordine dello snapshot
+        rows.push(...changed.values());
+        rows.sort(compareSnapshotRows);
+    }
+    
+    allData = {
+        rows: rows,
+        facets: delta.facets || allData.facets,
+        meta: {
+            total_rows: delta.meta.total_rows,
+            last_update: delta.meta.last_update,
+            version: delta.meta.version
+        }
+    };
+    console.log('[REFRESH] Delta applicato:', {
+        changed: (delta.rows || []).length,
+        deleted: deleted.size,
+        total: rows.length
+    });
+    
+    // Riapplica filtri e ricerca restando sulla pagina corrente se esiste ancora
+    const page = currentPage;
+    applyFilters();
+    currentPage = Math.max(1, Math.min(page, Math.ceil(filteredData.length / CONFIG.pageSize)));
+    renderFilters();
+    renderTable();
+    updatePagination();
+}
+
+// ===== AGGIORNAMENTI IN TEMPO REALE (SSE) =====
+
+let liveUpdatesActive = false;
+let refreshRunning = false;
+let refreshPending = false;
+let refreshTimer = null;
+
+// Raggruppa le notifiche ravvicinate in un solo delta; mai due refresh in parallelo
+function scheduleRefresh(delayMs = 300) {
+    if (refreshTimer) return;
+    refreshTimer = setTimeout(async () => {
+        refreshTimer = null;
+        if (refreshRunning) {
+            refreshPending = true;
+            return;
+        }
+        refreshRunning = true;
+        try {
+            await refreshData();
+        } catch (error) {
+            console.warn('[LIVE] Errore aggiornamento:', error);
+        } finally {
+            refreshRunning = false;
+            if (refreshPending) {
+                refreshPending = false;
+                scheduleRefresh(0);
+            }
+        }
+    }, delayMs);
+}
+
+// Stream delle modifiche all'inventario: ogni evento scarica solo il delta.
+// Finché lo stream è attivo il polling periodico viene sospeso.
+function startLiveUpdates() {
+    const token = getTokenFromURL();
+    if (!token || token === "FAKE" || token === "fake" || typeof EventSource === 'undefined') {
+        return;
+    }
+    
+    const baseUrl = CONFIG.apiBase || window.location.origin;
+    const source = new EventSource(`${baseUrl}${CONFIG.endpointEvents}?token=${encodeURIComponent(token)}`);
+    
+    let connectedBefore = false;
+    source.addEventListener('ready', () => {
+        console.log('[LIVE] Stream modifiche attivo');
+        if (connectedBefore) {
+            // Recupera quanto modificato mentre lo stream era scollegato
+            scheduleRefresh(0);
+        }
+        connectedBefore = true;
+        liveUpdatesActive = true;
+    });
+    source.addEventListener('change', () => scheduleRefresh());
+    source.addEventListener('resync', () => scheduleRefresh(0));
+    source.onerror = () => {
+        // EventSource si riconnette da solo; intanto riprende il polling
+        liveUpdatesActive = false;
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('[LIVE] Stream modifiche chiuso, uso il polling periodico');
+        }
+    };
+}
+
 // Show error banner
 function showError(message) {
     const banner = document.getElementById('error-banner');
@@ -638,8 +833,8 @@ function setupCsvDownload(token) {
     
     const downloadBtn = document.getElementById('download-csv');
     
-    // Per token FAKE, genera CSV mock dal frontend
-    if (token === "FAKE" || token === "fake") {
+    // Per token FAKE e pagine generate (senza token), genera CSV dal frontend
+    if (!token || token === "FAKE" || token === "fake") {
         downloadBtn.addEventListener('click', (e) => {
             e.preventDefault();
             // Generate mock CSV dai dati caricati
@@ -710,6 +905,26 @@ function closeMovementsModal() {
     modal.classList.add('hidden');
 }
 
+// Movimenti di più vini con una sola richiesta: { nome vino: [movimenti] }
+// wineNames = null -> tutti i vini con movimenti
+async function fetchMovements(token, wineNames) {
+    const baseUrl = CONFIG.apiBase || window.location.origin;
+    const params = new URLSearchParams({ token: token });
+    if (wineNames === null) {
+        params.set('all', '1');
+    } else {
+        wineNames.forEach(name => params.append('wine_name', name));
+    }
+    
+    const response = await fetch(`${baseUrl}${CONFIG.endpointMovementsBatch}?${params.toString()}`);
+    if (!response.ok) {
+        throw new Error(`HTTP ${response.status}: ${response.statusText}`);
+    }
+    
+    const data = await response.json();
+    return data.movements || {};
+}
+
 // Show movements chart modal
 async function showMovementsChart(wineName) {
     const token = getTokenFromURL();
@@ -729,16 +944,8 @@ async function showMovementsChart(wineName) {
     chartContainer.innerHTML = '<div class="loading">Caricamento movimenti...</div>';
     
     try {
-        const baseUrl = CONFIG.apiBase || window.location.origin;
-        const url = `${baseUrl}${CONFIG.endpointMovements}?token=${encodeURIComponent(token)}&wine_name=${encodeURIComponent(wineName)}`;
-        
-        const response = await fetch(url);
-        if (!response.ok) {
-            throw new Error(`HTTP ${response.status}: ${response.statusText}`);
-        }
-        
-        const data = await response.json();
-        const movements = data.movements || [];
+        const movementsByWine = await fetchMovements(token, [wineName]);
+        const movements = movementsByWine[wineName] || [];
         
         if (movements.length === 0) {
             // Mostra grafico vuoto anche senza movimenti
@@ -1338,8 +1545,17 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
     
-    // Load data
-    loadData();
+    // Load data, poi modifiche in tempo reale
+    loadData().then(startLiveUpdates);
+    
+    // Aggiornamento periodico incrementale (solo con la pagina visibile e senza stream SSE)
+    if (CONFIG.refreshIntervalMs > 0) {
+        setInterval(() => {
+            if (document.visibilityState === 'visible' && !liveUpdatesActive) {
+                scheduleRefresh(0);
+            }
+        }, CONFIG.refreshIntervalMs);
+    }
     
     // Setup edit modal
     const editModal = document.getElementById('edit-wine-modal');
@@ -1461,8 +1677,13 @@ async function saveWineChanges(e) {
     submitBtn.disabled = true;
     submitBtn.textContent = 'Salvataggio...';
     
+    // Versione del vino mostrata nel form: il server rifiuta la modifica
+    // se nel frattempo il vino è stato modificato da un altro dispositivo
+    const editedWine = findWineById(wineId);
+    const expectedUpdatedAt = editedWine ? (editedWine.updated_at || null) : null;
+    
     try {
-        // Invia modifiche campo per campo
+        // Raccogli le modifiche: vengono inviate tutte insieme in una sola richiesta
         const updates = [];
         for (const [field, value] of Object.entries(fields)) {
             // Mappa field name dal form al nome campo database
@@ -1518,11 +1739,11 @@ async function saveWineChanges(e) {
             if (field === 'selling_price' || field === 'vintage') {
                 // Campi numerici - invia solo se non vuoto
                 if (value !== '' && value !== null) {
-                    updates.push(updateWineField(token, wineId, dbField, value));
+                    updates.push({ wine_id: wineId, field: dbField, value: value, expected_updated_at: expectedUpdatedAt });
                 }
             } else {
                 // Campi opzionali - invia anche se vuoto per pulire campo
-                updates.push(updateWineField(token, wineId, dbField, value || null));
+                updates.push({ wine_id: wineId, field: dbField, value: value || null, expected_updated_at: expectedUpdatedAt });
             }
         }
         
@@ -1533,10 +1754,22 @@ async function saveWineChanges(e) {
             return;
         }
         
-        await Promise.all(updates);
+        // Un'unica transazione lato server per tutti i campi
+        const result = await updateWineFields(token, updates);
+        if ((result.results || []).some(item => item.status === 'conflict')) {
+            // Dati superati: ricarica e lascia che l'utente riapplichi le modifiche
+            await refreshData();
+            closeEditModal();
+            showNotification('Il vino è stato modificato da un altro dispositivo: dati ricaricati, riprova la modifica', 'error');
+            return;
+        }
+        const failed = (result.results || []).filter(item => item.status === 'error');
+        if (failed.length > 0) {
+            throw new Error(failed.map(item => `${item.field}: ${item.detail}`).join('; '));
+        }
         
         // Ricarica dati
-        await loadData();
+        await refreshData();
         
         // Chiudi modal
         closeEditModal();
@@ -1553,10 +1786,10 @@ async function saveWineChanges(e) {
     }
 }
 
-// Chiamata API per aggiornare campo vino
-async function updateWineField(token, wineId, field, value) {
+// Chiamata API per aggiornare più campi/vini in una sola richiesta
+async function updateWineFields(token, changes) {
     const baseUrl = CONFIG.apiBase || window.location.origin;
-    const url = `${baseUrl}/api/inventory/update-field`;
+    const url = `${baseUrl}/api/inventory/update-fields`;
     
     const response = await fetch(url, {
         method: 'POST',
@@ -1565,15 +1798,13 @@ async function updateWineField(token, wineId, field, value) {
         },
         body: JSON.stringify({
             token: token,
-            wine_id: wineId,
-            field: field,
-            value: value
+            changes: changes
         })
     });
     
     if (!response.ok) {
         const errorData = await response.json().catch(() => ({ detail: `HTTP ${response.status}` }));
-        throw new Error(errorData.detail || 'Errore aggiornamento campo');
+        throw new Error(errorData.detail || 'Errore aggiornamento campi');
     }
     
     return await response.json();
@@ -0,0 +1,155 @@
+"""
+Event loop asyncio persistente per il server HTTP sincrono.
+
+Gli handler di http.server girano in thread worker: invece di creare un
+event loop nuovo per ogni richiesta, sottomettono le coroutine a un unico
+loop che vive in un thread dedicato per tutta la durata del processo.
+In questo modo le risorse async (pool connessioni, cache) sopravvivono
+tra una richiesta e l'altra.
+"""
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, AsyncIterator, Awaitable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Timeout (secondi) di default per una coroutine sottomessa dagli handler
+ASYNC_CALL_TIMEOUT = float(os.getenv("ASYNC_CALL_TIMEOUT", 60))
+
+
+class AsyncRunner:
+    """Event loop in esecuzione permanente su un thread dedicato"""
+    
+    def __init__(self, name: str = "viewer-async-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+    
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """Restituisce il loop, avviandolo alla prima chiamata"""
+        if self._loop is None or self._loop.is_closed():
+            self.start()
+        return self._loop
+    
+    def start(self) -> None:
+        """Avvia il thread del loop (idempotente)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            
+            self._started.clear()
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name=self.name, daemon=True)
+            self._thread.start()
+            self._started.wait()
+            logger.info(f"[ASYNC_RUNNER] Event loop persistente avviato (thread={self.name})")
+    
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.call_soon(self._started.set)
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+    
+    def run(self, coro: Awaitable[Any], timeout: Optional[float] = ASYNC_CALL_TIMEOUT) -> Any:
+        """
+        Esegue una coroutine sul loop persistente e ne attende il risultato.
+        
+        Args:
+            coro: Coroutine da eseguire
+            timeout: Secondi massimi di attesa (None = nessun limite)
+        
+        Returns:
+            Risultato della coroutine (le eccezioni vengono propagate)
+        
+        Raises:
+            concurrent.futures.TimeoutError: Se la coroutine non termina entro timeout
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+    
+    def iterate(self, agen: AsyncIterator[Any], timeout: Optional[float] = ASYNC_CALL_TIMEOUT) -> Iterator[Any]:
+        """
+        Consuma un generatore async dal thread chiamante, un elemento alla volta.
+        
+        Ogni elemento viene richiesto al loop solo quando il chiamante lo
+        consuma, così chi scrive sul socket applica backpressure alla query.
+        Il generatore viene chiuso (aclose) anche se l'iterazione si interrompe.
+        
+        Args:
+            agen: Generatore async da consumare
+            timeout: Secondi massimi di attesa per ogni singolo elemento
+        """
+        done = object()
+        
+        async def _next():
+            try:
+                return await agen.__anext__()
+            except StopAsyncIteration:
+                return done
+        
+        try:
+            while True:
+                item = self.run(_next(), timeout)
+                if item is done:
+                    return
+                yield item
+        finally:
+            try:
+                self.run(agen.aclose(), timeout)
+            except Exception as e:
+                logger.warning(f"[ASYNC_RUNNER] Errore chiudendo generatore async: {e}")
+    
+    def stop(self, timeout: float = 5) -> None:
+        """Ferma il loop cancellando i task ancora pendenti"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or thread is None or not thread.is_alive():
+                return
+            
+            async def _cancel_pending():
+                current = asyncio.current_task()
+                tasks = [t for t in asyncio.all_tasks() if t is not current]
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+            
+            try:
+                asyncio.run_coroutine_threadsafe(_cancel_pending(), loop).result(timeout)
+            except Exception as e:
+                logger.warning(f"[ASYNC_RUNNER] Errore cancellando task pendenti: {e}")
+            
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join(timeout)
+            self._thread = None
+            logger.info("[ASYNC_RUNNER] Event loop persistente arrestato")
+
+
+# Runner condiviso dal processo
+_runner = AsyncRunner()
+
+
+def run_async(coro: Awaitable[Any], timeout: Optional[float] = ASYNC_CALL_TIMEOUT) -> Any:
+    """Esegue una coroutine sul loop condiviso e ne restituisce il risultato"""
+    return _runner.run(coro, timeout)
+
+
+def iterate_async(agen: AsyncIterator[Any], timeout: Optional[float] = ASYNC_CALL_TIMEOUT) -> Iterator[Any]:
+    """Consuma un generatore async sul loop condiviso (vedi AsyncRunner.iterate)"""
+    return _runner.iterate(agen, timeout)
+
+
+def shutdown_runner(timeout: float = 5) -> None:
+    """Arresta il loop condiviso (da chiamare allo shutdown del server)"""
+    _runner.stop(timeout)
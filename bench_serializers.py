@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Benchmark della serializzazione JSON dello snapshot inventario.
+
+Confronta, su inventari sintetici, il vecchio percorso (json.dumps + encode),
+i backend di serializers (orjson / msgspec se installati, stdlib) e lo
+streaming a blocchi di iter_json_document: tempo, dimensione e picco di
+memoria allocata durante la serializzazione.
+
+Uso:
+    python bench_serializers.py                 # 10k e 50k righe
+    python bench_serializers.py --rows 200000 --repeat 3
+"""
+import gc
+import json
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List
+
+import serializers
+
+WINE_TYPES = ["Rosso", "Bianco", "Rosato", "Spumante", "Passito", "Altro"]
+REGIONS = ["Piemonte", "Toscana", "Veneto", "Sicilia", "Friuli-Venezia Giulia", "Puglia"]
+GRAPES = ["Nebbiolo", "Sangiovese", "Corvina", "Nero d'Avola", "Ribolla Gialla", "Primitivo"]
+
+
+def build_snapshot(rows: int, seed: int = 42) -> Dict[str, Any]:
+    """Snapshot sintetico con lo stesso formato di viewer_db.get_inventory_snapshot"""
+    rnd = random.Random(seed)
+    base = datetime(2024, 1, 1)
+    data = []
+    for i in range(rows):
+        qty = rnd.randint(0, 60)
+        min_qty = rnd.choice([None, 3, 6, 12])
+        data.append({
+            "id": i + 1,
+            "name": f"Vino {rnd.choice(GRAPES)} {i}",
+            "winery": f"Cantina {rnd.randint(1, 800)}",
+            "supplier": f"Fornitore {rnd.randint(1, 120)}",
+            "vintage": rnd.choice([None] + list(range(1990, 2024))),
+            "qty": qty,
+            "price": round(rnd.uniform(8, 400), 2),
+            "cost_price": round(rnd.uniform(4, 200), 2) if rnd.random() < 0.7 else None,
+            "type": rnd.choice(WINE_TYPES),
+            "grape_variety": rnd.choice(GRAPES),
+            "region": rnd.choice(REGIONS),
+            "country": "Italia",
+            "classification": rnd.choice([None, "DOC", "DOCG", "IGT"]),
+            "alcohol_content": round(rnd.uniform(11, 15.5), 1),
+            "description": "Note di frutti rossi, tannino elegante, finale lungo." if rnd.random() < 0.4 else None,
+            "notes": None,
+            "min_quantity": min_qty,
+            "updated_at": (base + timedelta(minutes=i)).isoformat(),
+            "critical": min_qty is not None and qty <= min_qty
+        })
+    
+    facets: Dict[str, Dict[Any, int]] = {"type": {}, "vintage": {}, "winery": {}, "supplier": {}}
+    for row in data:
+        for facet in facets:
+            if row[facet] is not None:
+                facets[facet][row[facet]] = facets[facet].get(row[facet], 0) + 1
+    # Chiavi dei facets come in viewer_db (stringhe)
+    facets = {name: {str(key): count for key, count in values.items()} for name, values in facets.items()}
+    
+    return {
+        "rows": data,
+        "facets": facets,
+        "meta": {"total_rows": rows, "last_update": base.isoformat(), "version": f"{rows}:bench"}
+    }
+
+
+def _legacy_dumps(obj: Any) -> bytes:
+    # Percorso precedente degli handler
+    return json.dumps(obj).encode('utf-8')
+
+
+def _measure(func: Callable[[], int], repeat: int) -> Dict[str, float]:
+    """Tempo mediano (ms), byte prodotti e picco di memoria allocata (MB) di func"""
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        size = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {"ms": statistics.median(timings), "bytes": size, "peak_mb": peak / (1024 * 1024)}
+
+
+def run(rows_list: List[int], repeat: int, chunk_rows: int) -> None:
+    backends = serializers.available_backends()
+    print(f"Backend disponibili: {', '.join(backends)} (in uso: {serializers.BACKEND})")
+    
+    for rows in rows_list:
+        snapshot = build_snapshot(rows)
+        print(f"\n=== {rows} righe ===")
+        print(f"{'serializzatore':<26} {'tempo (ms)':>11} {'dimensione (KB)':>16} {'picco mem (MB)':>15}")
+        
+        cases: List[tuple] = [("json.dumps + encode", lambda: len(_legacy_dumps(snapshot)))]
+        for name, dumps in backends.items():
+            cases.append((name, lambda dumps=dumps: len(dumps(snapshot))))
+        
+        # Streaming: i blocchi vengono consumati uno alla volta, come dall'handler
+        def _streamed() -> int:
+            return sum(len(chunk) for chunk in serializers.iter_json_document(snapshot, "rows", chunk_rows))
+        cases.append((f"{serializers.BACKEND} streaming ({chunk_rows})", _streamed))
+        
+        for name, func in cases:
+            result = _measure(func, repeat)
+            print(f"{name:<26} {result['ms']:>11.1f} {result['bytes'] / 1024:>16.0f} {result['peak_mb']:>15.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark serializzazione JSON dello snapshot")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000], help="Righe degli inventari sintetici")
+    parser.add_argument("--repeat", type=int, default=5, help="Ripetizioni per misura (si usa la mediana)")
+    parser.add_argument("--chunk-rows", type=int, default=serializers.JSON_STREAM_CHUNK_ROWS, help="Righe per blocco in streaming")
+    args = parser.parse_args()
+    run(args.rows, args.repeat, args.chunk_rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Statistiche delle cache del viewer nei log.
+
+Ogni CACHE_STATS_LOG_INTERVAL secondi (e allo shutdown) viene scritta una
+riga per componente: pagine generate ([VIEW_CACHE]), cache di viewer_db
+([VIEWER_DB]), file statici ([STATIC]) e stream SSE ([EVENTS]).
+"""
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Secondi tra due righe di statistiche nei log (0 = solo allo shutdown)
+CACHE_STATS_LOG_INTERVAL = float(os.getenv("CACHE_STATS_LOG_INTERVAL", 300))
+
+
+def collect_cache_stats() -> Dict[str, Any]:
+    """Statistiche di tutte le cache del processo"""
+    from viewer_db import get_cache_stats
+    from view_cache import get_view_cache
+    from static_assets import get_static_store
+    from inventory_events import get_event_hub
+    
+    return {
+        "view_cache": get_view_cache().stats(),
+        "viewer_db": get_cache_stats(),
+        "static": get_static_store().stats(),
+        "events": get_event_hub().stats()
+    }
+
+
+def _hit_rate(stats: Dict[str, Any]) -> str:
+    return f"{stats['hit_rate']:.1%} ({stats['hits']}/{stats['hits'] + stats['misses']})"
+
+
+def log_cache_stats() -> None:
+    """Scrive le statistiche delle cache nei log (hit rate, dimensioni, eviction)"""
+    try:
+        stats = collect_cache_stats()
+    except Exception as e:
+        logger.warning(f"[CACHE_STATS] Statistiche non disponibili: {e}")
+        return
+    
+    views = stats["view_cache"]
+    memory = views["memory"]
+    line = (
+        f"[VIEW_CACHE] Statistiche: hit_rate={_hit_rate(memory)}, pagine={memory['entries']}, "
+        f"bytes={memory['weight']}, eviction={memory['evictions']}"
+    )
+    if views["disk_enabled"]:
+        line += (
+            f", disco: hits={views['disk_hits']}, misses={views['disk_misses']}, "
+            f"pagine={views.get('disk_entries', '?')}, bytes={views.get('disk_bytes', '?')}"
+        )
+    logger.info(line)
+    
+    caches = ", ".join(
+        f"{name}={_hit_rate(cache)} entries={cache['entries']} eviction={cache['evictions']}"
+        for name, cache in stats["viewer_db"].items()
+    )
+    logger.info(f"[VIEWER_DB] Statistiche cache: {caches}")
+    
+    static = stats["static"]
+    logger.info(
+        f"[STATIC] Statistiche: file={static['files']}, bytes={static['bytes']}, "
+        f"hits={static['hits']}, ricaricati={static['reloads']}"
+    )
+    
+    events = stats["events"]
+    logger.info(
+        f"[EVENTS] Statistiche: subscriber={events['subscribers']}, inventari={events['inventories']}, "
+        f"notifiche={events['notifications']}, resync={events['resyncs']}"
+    )
+
+
+class CacheStatsLogger:
+    """Thread che scrive periodicamente le statistiche (e un'ultima volta allo stop)"""
+    
+    def __init__(self, interval: float = CACHE_STATS_LOG_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+    
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="viewer-cache-stats", daemon=True)
+        self._thread.start()
+    
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            log_cache_stats()
+    
+    def stop(self) -> None:
+        """Ferma il thread e scrive le statistiche finali"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+        log_cache_stats()
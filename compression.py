@@ -0,0 +1,163 @@
+"""
+Compressione delle risposte HTTP (gzip e, se installato, brotli).
+
+La codifica viene negoziata con Accept-Encoding; le risposte sotto
+COMPRESSION_MIN_SIZE byte o con content type non testuale vengono inviate
+invariate. Le varianti compresse dei file statici sono calcolate una sola
+volta (al massimo livello) da static_assets.
+"""
+import os
+import gzip
+import zlib
+import logging
+from typing import Optional, Tuple, Dict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli
+except ImportError:  # brotli è opzionale
+    brotli = None
+
+# Dimensione minima (byte) sotto la quale non conviene comprimere
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+# Livelli per le risposte dinamiche (compromesso velocità/dimensione)
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", 5))
+
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+
+def is_compressible(content_type: Optional[str]) -> bool:
+    """True se il content type beneficia della compressione"""
+    if not content_type:
+        return False
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def supported_encodings() -> Tuple[str, ...]:
+    """Codifiche disponibili in ordine di preferenza"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Sceglie la codifica migliore accettata dal client.
+    
+    Args:
+        accept_encoding: Valore dell'header Accept-Encoding
+    
+    Returns:
+        'br', 'gzip' oppure None (nessuna compressione)
+    """
+    if not accept_encoding:
+        return None
+    
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        pieces = part.strip().split(';')
+        coding = pieces[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in pieces[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    
+    best = None
+    best_q = 0.0
+    for coding in supported_encodings():
+        q = accepted.get(coding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress(body: bytes, encoding: str, best: bool = False) -> bytes:
+    """Comprime body con la codifica indicata (best=True: livello massimo, per asset statici)"""
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+    if encoding == 'br' and brotli is not None:
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    raise ValueError(f"Codifica non supportata: {encoding}")
+
+
+def maybe_compress(
+    body: bytes,
+    accept_encoding: Optional[str],
+    content_type: Optional[str]
+) -> Tuple[bytes, Optional[str]]:
+    """
+    Comprime la risposta se conviene.
+    
+    Returns:
+        (body eventualmente compresso, codifica usata o None)
+    """
+    if len(body) < COMPRESSION_MIN_SIZE or not is_compressible(content_type):
+        return body, None
+    
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return body, None
+    
+    compressed = compress(body, encoding)
+    if len(compressed) >= len(body):
+        return body, None
+    return compressed, encoding
+
+
+class StreamCompressor:
+    """
+    Compressore incrementale per risposte inviate a blocchi (streaming).
+    
+    compress() restituisce i byte compressi disponibili per il blocco
+    (può essere vuoto), finish() chiude lo stream.
+    """
+    
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == 'gzip':
+            # wbits=31: formato gzip (header + trailer CRC32)
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        elif encoding == 'br' and brotli is not None:
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            raise ValueError(f"Codifica non supportata: {encoding}")
+    
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == 'gzip':
+            return self._compressor.compress(chunk)
+        return self._compressor.process(chunk)
+    
+    def flush(self) -> bytes:
+        """Svuota il buffer interno così il client riceve subito i dati già prodotti"""
+        if self.encoding == 'gzip':
+            return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return self._compressor.flush()
+    
+    def finish(self) -> bytes:
+        if self.encoding == 'gzip':
+            return self._compressor.flush(zlib.Z_FINISH)
+        return self._compressor.finish()
+
+
+def stream_compressor(accept_encoding: Optional[str], content_type: Optional[str]) -> Optional[StreamCompressor]:
+    """Compressore per una risposta in streaming, None se non comprimibile o non accettata"""
+    if not is_compressible(content_type):
+        return None
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return None
+    return StreamCompressor(encoding)
@@ -0,0 +1,233 @@
+"""
+Notifiche in tempo reale delle modifiche all'inventario (Server-Sent Events).
+
+Un'unica connessione Postgres in LISTEN sul canale INVENTORY_NOTIFY_CHANNEL
+riceve le notifiche di tutti gli inventari e le smista ai client iscritti
+(una coda per client, raggruppate per inventario). Le notifiche arrivano
+dalle modifiche fatte dal viewer (pg_notify in viewer_db) e, se installato,
+dal trigger descritto nel README per le scritture del bot.
+
+La connessione viene aperta al primo iscritto, chiusa quando non ne resta
+nessuno e riaperta automaticamente se cade.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+import asyncpg
+
+import viewer_db
+
+logger = logging.getLogger(__name__)
+
+# Secondi tra due heartbeat (commento SSE) se non arrivano modifiche
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+# Client SSE contemporanei massimi (su tutti gli inventari)
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", 200))
+# Eventi in attesa per client: oltre, il client riceve un resync
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", 100))
+# Attesa (secondi) prima di riaprire la connessione LISTEN dopo un errore
+SSE_LISTENER_RETRY_SECONDS = float(os.getenv("SSE_LISTENER_RETRY_SECONDS", 5))
+
+# Evento interno: chiude lo stream del client (shutdown del server)
+_CLOSE = object()
+
+
+class TooManySubscribersError(Exception):
+    """Raggiunto il numero massimo di client SSE"""
+
+
+class InventoryEventHub:
+    """Smista le notifiche Postgres ai client SSE iscritti a ciascun inventario"""
+    
+    def __init__(self, channel: str):
+        self.channel = channel
+        self._subscribers: Dict[tuple, Set[asyncio.Queue]] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._closed = False
+        self.notifications = 0
+        self.resyncs = 0
+    
+    @property
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+    
+    async def subscribe(
+        self,
+        telegram_id: int,
+        business_name: str,
+        expires_at: Optional[float] = None
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Stream degli eventi di un inventario.
+        
+        Il primo elemento è sempre {"type": "ready"}; seguono {"type": "change"}
+        per ogni modifica, {"type": "resync"} se il client può aver perso
+        eventi, e None come heartbeat ogni SSE_HEARTBEAT_SECONDS.
+        
+        Args:
+            telegram_id: Telegram ID dell'utente
+            business_name: Nome del business
+            expires_at: Timestamp (exp del token) oltre il quale lo stream termina
+        
+        Raises:
+            TooManySubscribersError: Se ci sono già SSE_MAX_SUBSCRIBERS client
+            ValueError: Se le notifiche sono disattivate
+        """
+        if not self.channel:
+            raise ValueError("Notifiche inventario disattivate (INVENTORY_NOTIFY_CHANNEL vuoto)")
+        if self.subscriber_count >= SSE_MAX_SUBSCRIBERS:
+            raise TooManySubscribersError(f"Troppi client collegati (max {SSE_MAX_SUBSCRIBERS})")
+        
+        key = viewer_db._inventory_cache_key(telegram_id, business_name)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_SIZE)
+        self._subscribers.setdefault(key, set()).add(queue)
+        self._closed = False
+        self._ensure_listener()
+        
+        try:
+            yield {"type": "ready"}
+            
+            while True:
+                timeout = SSE_HEARTBEAT_SECONDS
+                if expires_at is not None:
+                    remaining = expires_at - time.time()
+                    if remaining <= 0:
+                        # Token scaduto: il client riconnettendosi riceverà 401
+                        return
+                    timeout = min(timeout, remaining)
+                
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                
+                if event is _CLOSE:
+                    return
+                yield event
+        finally:
+            queues = self._subscribers.get(key)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[key]
+            if not self._subscribers and self._wakeup is not None:
+                # Nessun iscritto: il listener chiude la connessione
+                self._wakeup.set()
+    
+    def _ensure_listener(self) -> None:
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._run_listener())
+    
+    async def _run_listener(self) -> None:
+        """Mantiene la connessione LISTEN finché ci sono iscritti"""
+        reconnecting = False
+        while self._subscribers and not self._closed:
+            conn = None
+            try:
+                conn = await asyncpg.connect(viewer_db.DATABASE_URL)
+                self._wakeup = asyncio.Event()
+                conn.add_termination_listener(lambda _conn: self._wakeup.set())
+                await conn.add_listener(self.channel, self._on_notification)
+                logger.info(f"[EVENTS] Listener attivo sul canale '{self.channel}'")
+                
+                if reconnecting:
+                    # Le notifiche arrivate mentre la connessione era giù sono perse
+                    self._broadcast_all({"type": "resync"})
+                reconnecting = True
+                
+                while self._subscribers and not self._closed and not conn.is_closed():
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[EVENTS] Errore connessione listener: {e}")
+                reconnecting = True
+                await asyncio.sleep(SSE_LISTENER_RETRY_SECONDS)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    try:
+                        await conn.close(timeout=5)
+                    except Exception:
+                        conn.terminate()
+        
+        logger.info(f"[EVENTS] Listener sul canale '{self.channel}' chiuso (nessun iscritto)")
+    
+    def _on_notification(self, conn, pid: int, channel: str, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+            telegram_id = data["telegram_id"]
+            business_name = data["business_name"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning(f"[EVENTS] Notifica ignorata, payload non valido: {payload[:200]}")
+            return
+        
+        self.notifications += 1
+        # Scrittura fatta da un altro processo (bot o altra istanza): cache non più valida
+        viewer_db.invalidate_inventory_cache(telegram_id, business_name)
+        
+        key = viewer_db._inventory_cache_key(telegram_id, business_name)
+        event = {"type": "change", "ids": data.get("ids")}
+        for queue in list(self._subscribers.get(key, ())):
+            self._deliver(queue, event)
+    
+    def _deliver(self, queue: asyncio.Queue, event: Any) -> None:
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Client troppo lento: sostituisce gli eventi in coda con un resync
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(event if event is _CLOSE else {"type": "resync"})
+            self.resyncs += 1
+    
+    def _broadcast_all(self, event: Any) -> None:
+        for queues in list(self._subscribers.values()):
+            for queue in list(queues):
+                self._deliver(queue, event)
+    
+    async def close(self) -> None:
+        """Chiude tutti gli stream e la connessione LISTEN (shutdown del server)"""
+        self._closed = True
+        self._broadcast_all(_CLOSE)
+        if self._wakeup is not None:
+            self._wakeup.set()
+        if self._listener_task is not None:
+            try:
+                await asyncio.wait_for(self._listener_task, timeout=5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            except Exception as e:
+                logger.warning(f"[EVENTS] Errore chiusura listener: {e}")
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "channel": self.channel,
+            "subscribers": self.subscriber_count,
+            "inventories": len(self._subscribers),
+            "listening": self._listener_task is not None and not self._listener_task.done(),
+            "notifications": self.notifications,
+            "resyncs": self.resyncs
+        }
+
+
+# Hub condiviso dal processo (vive nel loop che serve le richieste)
+_hub = InventoryEventHub(viewer_db.INVENTORY_NOTIFY_CHANNEL)
+
+
+def get_event_hub() -> InventoryEventHub:
+    return _hub
+
+
+def format_sse(event: Optional[Dict[str, Any]]) -> bytes:
+    """Codifica un evento nel formato text/event-stream (None = heartbeat)"""
+    if event is None:
+        return b": ping\n\n"
+    data = {key: value for key, value in event.items() if key != "type"}
+    return f"event: {event['type']}\ndata: {json.dumps(data)}\n\n".encode('utf-8')
@@ -0,0 +1,194 @@
+"""
+Serializzazione JSON delle risposte API.
+
+Usa orjson o msgspec se installati (più veloci, producono direttamente
+bytes UTF-8), altrimenti la libreria standard. Per gli snapshot grandi
+iter_json_document produce il documento a blocchi: l'array delle righe
+viene serializzato a gruppi di JSON_STREAM_CHUNK_ROWS e il JSON completo
+non esiste mai in memoria.
+
+to_columnar produce il formato colonnare opzionale dello snapshot
+(?format=columnar): nomi dei campi una sola volta e valori ripetuti
+codificati con un dizionario. Il viewer lo decodifica con
+decodeColumnarSnapshot (app.js).
+
+Il confronto tra i backend è in bench_serializers.py.
+"""
+import os
+import json
+import uuid
+import logging
+from datetime import date, time
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # orjson è opzionale
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec è opzionale
+    msgspec = None
+
+# Backend JSON: "auto" (orjson, poi msgspec, poi stdlib) oppure uno specifico
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").strip().lower()
+# Righe oltre le quali lo snapshot viene inviato in streaming
+JSON_STREAM_MIN_ROWS = int(os.getenv("JSON_STREAM_MIN_ROWS", 5000))
+# Righe serializzate per ogni blocco dello streaming
+JSON_STREAM_CHUNK_ROWS = int(os.getenv("JSON_STREAM_CHUNK_ROWS", 1000))
+
+# Media type con cui il client può chiedere lo snapshot colonnare (in alternativa a ?format=columnar)
+COLUMNAR_MEDIA_TYPE = 'application/vnd.vineinventory.columnar+json'
+# Campi a bassa cardinalità: i valori vengono sostituiti dall'indice nel dizionario della colonna
+COLUMNAR_DICTIONARY_FIELDS = ('type', 'winery', 'supplier', 'region', 'country', 'grape_variety', 'classification')
+
+
+def _default(obj: Any) -> Any:
+    """Tipi non JSON gestiti allo stesso modo da tutti i backend"""
+    # date copre anche datetime
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Tipo {type(obj).__name__} non serializzabile in JSON")
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    # Chiavi non stringa (es. annate nei facets) convertite come fa la libreria standard
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+_stdlib_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return _stdlib_encoder.encode(obj).encode('utf-8')
+
+
+def available_backends() -> Dict[str, Callable[[Any], bytes]]:
+    """Backend installati, in ordine di preferenza"""
+    backends: Dict[str, Callable[[Any], bytes]] = {}
+    if orjson is not None:
+        backends["orjson"] = _orjson_dumps
+    if msgspec is not None:
+        backends["msgspec"] = msgspec.json.Encoder(enc_hook=_default, decimal_format='number').encode
+    backends["stdlib"] = _stdlib_dumps
+    return backends
+
+
+def _select_backend(name: str) -> str:
+    backends = available_backends()
+    if name in backends:
+        return name
+    if name != "auto":
+        logger.warning(f"[JSON] Backend '{name}' non disponibile, uso {next(iter(backends))}")
+    return next(iter(backends))
+
+
+BACKEND = _select_backend(JSON_BACKEND)
+_dumps = available_backends()[BACKEND]
+
+
+def dumps(obj: Any) -> bytes:
+    """Serializza obj in JSON (bytes UTF-8) con il backend più veloce disponibile"""
+    return _dumps(obj)
+
+
+def iter_json_document(
+    document: Mapping[str, Any],
+    array_key: str,
+    chunk_rows: int = JSON_STREAM_CHUNK_ROWS
+) -> Iterator[bytes]:
+    """
+    Serializza un oggetto JSON a blocchi, un gruppo di elementi di array_key alla volta.
+    
+    Il risultato concatenato è equivalente a dumps(document) (stesso ordine delle chiavi).
+    
+    Args:
+        document: Oggetto da serializzare (es. snapshot con rows, facets, meta)
+        array_key: Chiave della lista da inviare a blocchi
+        chunk_rows: Elementi per blocco
+    
+    Yields:
+        Parti consecutive del documento JSON
+    """
+    yield b'{'
+    for index, (key, value) in enumerate(document.items()):
+        prefix = (b',' if index else b'') + dumps(key) + b':'
+        if key != array_key:
+            yield prefix + dumps(value)
+            continue
+        
+        yield prefix + b'['
+        for start in range(0, len(value), chunk_rows):
+            # L'array del blocco senza parentesi quadre: gli elementi si concatenano con ','
+            chunk = dumps(value[start:start + chunk_rows])[1:-1]
+            yield (b',' + chunk) if start else chunk
+        yield b']'
+    yield b'}'
+
+
+def wants_columnar(format_param: Optional[str], accept: Optional[str]) -> bool:
+    """
+    Decide se rispondere con lo snapshot colonnare.
+    
+    Args:
+        format_param: Valore di ?format= ("json" o "columnar"; ha la precedenza)
+        accept: Header Accept della richiesta
+    
+    Raises:
+        ValueError: Se format non è un valore supportato
+    """
+    if format_param:
+        value = format_param.strip().lower()
+        if value not in ('json', 'columnar'):
+            raise ValueError("format deve essere 'json' o 'columnar'")
+        return value == 'columnar'
+    return bool(accept) and COLUMNAR_MEDIA_TYPE in accept.lower()
+
+
+def to_columnar(
+    document: Mapping[str, Any],
+    array_key: str = "rows",
+    dictionary_fields: Sequence[str] = COLUMNAR_DICTIONARY_FIELDS
+) -> Dict[str, Any]:
+    """
+    Converte la lista di righe di un documento nel formato colonnare.
+    
+    Formato: {"format": "columnar", "columns": [...], "dictionaries": {campo: [valori]},
+    "values": [[valori colonna 0], [valori colonna 1], ...], ...altre chiavi invariate}.
+    Per i campi in dictionary_fields "values" contiene l'indice nel dizionario
+    (null resta null).
+    
+    Args:
+        document: Documento con la lista di righe (es. snapshot)
+        array_key: Chiave della lista di righe
+        dictionary_fields: Campi da codificare con dizionario
+    
+    Returns:
+        Nuovo documento (quello originale, condiviso con la cache, non viene modificato)
+    """
+    rows = document[array_key]
+    columns = list(rows[0].keys()) if rows else []
+    dictionaries: Dict[str, list] = {}
+    values = []
+    
+    for column in columns:
+        column_values = [row.get(column) for row in rows]
+        if column in dictionary_fields:
+            index: Dict[Any, int] = {}
+            column_values = [None if value is None else index.setdefault(value, len(index)) for value in column_values]
+            dictionaries[column] = list(index)
+        values.append(column_values)
+    
+    result: Dict[str, Any] = {"format": "columnar", "columns": columns, "dictionaries": dictionaries, "values": values}
+    for key, value in document.items():
+        if key != array_key:
+            result[key] = value
+    return result
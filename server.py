@@ -2,25 +2,103 @@
 """Server HTTP semplice per viewer statico"""
 import http.server
 import socketserver
+import html
 import os
 import sys
 import json
-import asyncio
+import signal
 import logging
-from urllib.parse import urlparse, parse_qs
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs, unquote
 from logging_config import setup_colored_logging
+from async_runner import run_async, iterate_async, shutdown_runner
+from compression import maybe_compress, is_compressible, stream_compressor
+from viewer_common import (
+    DIRECTORY, encode_csv_rows, csv_export_filename,
+    make_etag, http_date, is_not_modified, page_params_from_query, get_index_page
+)
+from static_assets import get_static_store, build_static_response, cache_control_for, INDEX_CACHE_CONTROL
+from serializers import dumps, iter_json_document, wants_columnar, JSON_STREAM_MIN_ROWS
+from cache_stats import CacheStatsLogger
 
 # Configurazione logging colorato
 setup_colored_logging("viewer")
 logger = logging.getLogger(__name__)
 
 PORT = int(os.getenv("PORT", 8080))
-DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Backend HTTP: "http" (http.server + Handler) oppure "aiohttp" (aiohttp_server, un unico event loop)
+SERVER_BACKEND = os.getenv("SERVER_BACKEND", "http").strip().lower()
+# Modalità server http: "threadpool" (worker fissi + coda limitata), "threaded" (un thread per richiesta), "single"
+SERVER_MODE = os.getenv("SERVER_MODE", "threadpool").strip().lower()
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 16))
+# Richieste accettate in attesa di un worker libero; oltre questo limite risponde 503
+SERVER_QUEUE_SIZE = int(os.getenv("SERVER_QUEUE_SIZE", 64))
+# Secondi concessi alle richieste in corso per completare durante lo shutdown
+SERVER_SHUTDOWN_TIMEOUT = float(os.getenv("SERVER_SHUTDOWN_TIMEOUT", 10))
+# Secondi di attesa della richiesta successiva su una connessione keep-alive
+SERVER_KEEPALIVE_TIMEOUT = float(os.getenv("SERVER_KEEPALIVE_TIMEOUT", 5))
+# Secondi massimi senza progressi in lettura/scrittura durante una richiesta
+SERVER_IO_TIMEOUT = float(os.getenv("SERVER_IO_TIMEOUT", 60))
 
 class Handler(http.server.SimpleHTTPRequestHandler):
+    # Connessioni persistenti: ogni risposta ha Content-Length oppure è chunked
+    protocol_version = "HTTP/1.1"
+    timeout = SERVER_KEEPALIVE_TIMEOUT
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=DIRECTORY, **kwargs)
     
+    def handle_one_request(self):
+        """Gestisce una richiesta della connessione (keep-alive: può essere una delle tante)"""
+        # Tra una richiesta e l'altra si attende al massimo SERVER_KEEPALIVE_TIMEOUT
+        self.connection.settimeout(SERVER_KEEPALIVE_TIMEOUT)
+        super().handle_one_request()
+        
+        # Pool saturo: le connessioni inattive non devono occupare i worker
+        saturated = getattr(self.server, 'saturated', None)
+        if saturated is not None and saturated():
+            self.close_connection = True
+    
+    def parse_request(self):
+        # Richiesta arrivata: timeout più ampio per header, body e invio della risposta
+        self.connection.settimeout(SERVER_IO_TIMEOUT)
+        self._request_parsed = False
+        self._request_parsed = super().parse_request()
+        return self._request_parsed
+    
+    def send_error(self, code, message=None, explain=None):
+        """
+        Invia un errore con body a lunghezza nota senza chiudere la connessione.
+        
+        Le richieste non interpretabili e le POST (il cui body potrebbe non essere
+        stato letto) chiudono la connessione come in http.server.
+        """
+        if not getattr(self, '_request_parsed', False) or code < 200 or code in (204, 304):
+            super().send_error(code, message, explain)
+            return
+        
+        shortmsg, longmsg = self.responses.get(code, ('???', '???'))
+        message = shortmsg if message is None else message
+        explain = longmsg if explain is None else explain
+        self.log_error("code %d, message %s", code, message)
+        
+        body = (self.error_message_format % {
+            'code': code,
+            'message': html.escape(message, quote=False),
+            'explain': html.escape(explain, quote=False)
+        }).encode('utf-8', 'replace')
+        
+        self.send_response(code, message)
+        if self.command == 'POST':
+            self.send_header('Connection', 'close')
+        self.send_header('Content-Type', self.error_content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+    
     def do_GET(self):
         """Gestisci richieste GET"""
         parsed_path = urlparse(self.path)
@@ -30,6 +108,26 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             self.handle_snapshot_endpoint()
             return
         
+        # Endpoint API pagina inventario (filtri, ricerca e ordinamento lato server)
+        if parsed_path.path == '/api/inventory/page':
+            self.handle_page_endpoint()
+            return
+        
+        # Endpoint API modifiche inventario dopo uno snapshot (delta)
+        if parsed_path.path == '/api/inventory/delta':
+            self.handle_delta_endpoint()
+            return
+        
+        # Endpoint API modifiche inventario in tempo reale (Server-Sent Events)
+        if parsed_path.path == '/api/inventory/events':
+            self.handle_events_endpoint()
+            return
+        
+        # Endpoint API facets inventario (solo aggregazioni per i filtri)
+        if parsed_path.path == '/api/inventory/facets':
+            self.handle_facets_endpoint()
+            return
+        
         # Endpoint API export CSV inventario
         if parsed_path.path == '/api/inventory/export.csv':
             self.handle_csv_export_endpoint()
@@ -40,6 +138,11 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             self.handle_movements_endpoint()
             return
         
+        # Endpoint API movimenti di più vini (una sola query)
+        if parsed_path.path == '/api/inventory/movements/batch':
+            self.handle_movements_batch_endpoint()
+            return
+        
         # Endpoint API per generazione viewer
         if parsed_path.path == '/api/generate':
             self.handle_generate_endpoint()
@@ -53,14 +156,23 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 self.serve_html_from_cache(view_id)
                 return
         
-        # Se richiesta root o index.html, serve index.html con configurazione iniettata
-        if self.path == '/' or self.path == '' or self.path == '/index.html':
+        # Se richiesta root o index.html (anche con ?token=), serve index.html con configurazione iniettata
+        if parsed_path.path in ('/', '', '/index.html'):
             self.serve_index_with_config()
             return
         
-        # Serve file statici
+        # Serve file statici dalla memoria (ETag, 304, Range, varianti compresse)
+        if self.serve_static_asset(parsed_path):
+            return
+        # File troppo grandi per la memoria: da disco
         return super().do_GET()
     
+    def do_HEAD(self):
+        """Gestisci richieste HEAD (file statici dalla memoria)"""
+        if self.serve_static_asset(urlparse(self.path)):
+            return
+        return super().do_HEAD()
+    
     def do_POST(self):
         """Gestisci richieste POST"""
         parsed_path = urlparse(self.path)
@@ -75,71 +187,144 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             self.handle_update_field_endpoint()
             return
         
+        # Endpoint API per aggiornare più campi/vini in una transazione
+        if parsed_path.path == '/api/inventory/update-fields':
+            self.handle_update_fields_endpoint()
+            return
+        
         self.send_error(404, "Not found")
     
+    def _send_body(self, status: int, body: bytes, content_type: str, headers: dict = None):
+        """Invia una risposta completa, compressa se il client lo supporta"""
+        encoding = None
+        if is_compressible(content_type):
+            body, encoding = maybe_compress(body, self.headers.get('Accept-Encoding'), content_type)
+        
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if is_compressible(content_type) and 'Vary' not in (headers or {}):
+            self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _send_stream(self, status: int, chunks, content_type: str, headers: dict = None):
+        """Invia una risposta generata a blocchi (chunked), compressa se il client lo supporta"""
+        compressor = stream_compressor(self.headers.get('Accept-Encoding'), content_type)
+        
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if compressor:
+            self.send_header('Content-Encoding', compressor.encoding)
+        if 'Vary' not in (headers or {}):
+            self.send_header('Vary', 'Accept-Encoding')
+        self._start_stream()
+        self.end_headers()
+        
+        try:
+            for chunk in chunks:
+                self._write_stream(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                self._write_stream(compressor.finish())
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.warning("[SERVER] Risposta in streaming interrotta: connessione chiusa dal client")
+            self.close_connection = True
+        except Exception as e:
+            # Header già inviati: si può solo troncare la risposta chiudendo la connessione
+            logger.error(f"[SERVER] Errore durante la risposta in streaming: {e}", exc_info=True)
+            self.close_connection = True
+    
+    def _start_stream(self) -> None:
+        """
+        Header di framing per una risposta di lunghezza non nota (da chiamare prima di end_headers).
+        
+        HTTP/1.1: chunked, la connessione resta utilizzabile; HTTP/1.0: fine data dalla chiusura.
+        """
+        self._chunked = self.request_version != 'HTTP/1.0'
+        if self._chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+    
+    def _write_stream(self, data: bytes) -> None:
+        """Scrive un blocco di una risposta in streaming"""
+        if not data:
+            return
+        if self._chunked:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        else:
+            self.wfile.write(data)
+    
+    def _end_stream(self) -> None:
+        if self._chunked:
+            self.wfile.write(b'0\r\n\r\n')
+    
+    def serve_static_asset(self, parsed_path) -> bool:
+        """Serve un file statico dalla memoria; False se va servito da disco (troppo grande)"""
+        store = get_static_store()
+        # Solo gli asset del viewer: sorgenti, file nascosti e directory rispondono 404
+        path = store.resolve(unquote(parsed_path.path))
+        if path is None:
+            self.send_error(404, "File not found")
+            return True
+        asset = store.get(path)
+        if asset is None:
+            return False
+        
+        version = parse_qs(parsed_path.query).get('v', [None])[0]
+        status, headers, body = build_static_response(asset, self.headers, version)
+        
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        return True
+    
     def serve_index_with_config(self):
-        """Serve index.html con configurazione API iniettata"""
+        """Serve index.html con configurazione API iniettata (precalcolato in memoria)"""
         try:
-            index_path = os.path.join(DIRECTORY, 'index.html')
-            if not os.path.exists(index_path):
-                logger.error(f"[SERVER] index.html non trovato in {index_path}")
+            page = get_index_page()
+            if page is None:
                 self.send_error(404, "File not found")
                 return
             
-            # Leggi index.html
-            with open(index_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Leggi API_BASE da variabile ambiente (default se non configurata)
-            def _normalize_url(url: str) -> str:
-                """Normalizza URL aggiungendo https:// se manca il protocollo"""
-                if not url:
-                    return 'https://gioia-processor-production.up.railway.app'
-                url = url.strip()
-                if not url.startswith(("http://", "https://")):
-                    url = f"https://{url}"
-                return url
-            
-            api_base_raw = os.getenv('API_BASE', 'https://gioia-processor-production.up.railway.app')
-            api_base = _normalize_url(api_base_raw)
-            
-            logger.info(f"[SERVER] Servendo index.html con apiBase={api_base}")
-            
-            # Inietta configurazione JavaScript prima della chiusura di </head>
-            # IMPORTANTE: Deve essere PRIMA di app.js per essere disponibile
-            config_script = f'''
-<script>
-    // Configurazione iniettata dal server (deve essere PRIMA di app.js)
-    window.VIEWER_CONFIG = {{
-        apiBase: "{api_base}"
-    }};
-    console.log("[VIEWER_CONFIG] Configurazione iniettata dal server:", window.VIEWER_CONFIG);
-    console.log("[VIEWER_CONFIG] API Base URL:", "{api_base}");
-</script>
-'''
-            
-            # Inserisci lo script prima di </head> (deve essere prima di app.js)
-            if '</head>' in content:
-                # Inserisci prima della chiusura di </head>
-                content = content.replace('</head>', config_script + '</head>')
-                logger.debug("[SERVER] Configurazione inserita prima di </head>")
-            elif '<script' in content:
-                # Se non c'è </head>, inserisci prima del primo script
-                first_script_pos = content.find('<script')
-                content = content[:first_script_pos] + config_script + content[first_script_pos:]
-                logger.debug("[SERVER] Configurazione inserita prima del primo <script>")
-            else:
-                # Ultimo fallback: prima di <body>
-                content = content.replace('<body>', config_script + '<body>')
-                logger.debug("[SERVER] Configurazione inserita prima di <body>")
+            body, encoding, etag = page.variant(self.headers.get('Accept-Encoding'))
+            headers = {'ETag': etag, 'Cache-Control': INDEX_CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+            if page.last_modified is not None:
+                headers['Last-Modified'] = http_date(page.last_modified)
             
-            logger.info(f"[SERVER] Configurazione iniettata con successo: apiBase={api_base}")
+            if is_not_modified(
+                self.headers.get('If-None-Match'),
+                self.headers.get('If-Modified-Since'),
+                etag,
+                page.last_modified
+            ):
+                self.send_response(304)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                return
             
-            # Invia risposta
             self.send_response(200)
             self.send_header('Content-Type', 'text/html; charset=utf-8')
+            for name, value in headers.items():
+                self.send_header(name, value)
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            self.wfile.write(body)
             
         except Exception as e:
             logger.error(f"[SERVER] Errore servendo index.html: {e}", exc_info=True)
@@ -174,25 +359,17 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             # Importa e esegui generazione
             from api_generate import generate_viewer_html
             
-            # Esegui async in modo sincrono (per HTTP server)
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                result = loop.run_until_complete(
-                    generate_viewer_html(telegram_id, business_name, correlation_id)
-                )
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(result).encode('utf-8'))
-                
-                logger.info(
-                    f"[VIEWER_API] Generazione completata: view_id={result.get('view_id')}, "
-                    f"telegram_id={telegram_id}, correlation_id={correlation_id}"
-                )
-            finally:
-                loop.close()
+            # Esegui sul loop persistente condiviso
+            result = run_async(
+                generate_viewer_html(telegram_id, business_name, correlation_id)
+            )
+            
+            self._send_body(200, dumps(result), 'application/json')
+            
+            logger.info(
+                f"[VIEWER_API] Generazione completata: view_id={result.get('view_id')}, "
+                f"telegram_id={telegram_id}, correlation_id={correlation_id}"
+            )
                 
         except Exception as e:
             logger.error(f"[VIEWER_API] Errore generazione: {e}", exc_info=True)
@@ -210,10 +387,8 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 self.send_error(404, "View non trovata o scaduta")
                 return
             
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html.encode('utf-8'))
+            # La pagina contiene i dati dell'inventario: niente cache condivise
+            self._send_body(200, html.encode('utf-8'), 'text/html; charset=utf-8', {'Cache-Control': 'private, no-cache'})
             
             logger.info(f"[VIEWER_CACHE] HTML servito per view_id={view_id}, length={len(html)}")
             
@@ -221,6 +396,36 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             logger.error(f"[VIEWER_CACHE] Errore servendo HTML: {e}", exc_info=True)
             self.send_error(500, f"Internal server error: {e}")
     
+    def send_response(self, code, message=None):
+        # Status usato da end_headers per il Cache-Control di default
+        self._response_status = code
+        super().send_response(code, message)
+    
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'cache-control':
+            self._cache_control_sent = True
+        super().send_header(keyword, value)
+    
+    def end_headers(self):
+        # Headers CORS se necessario (per chiamate API)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        # Cache-Control per route (se l'handler non ha già impostato una policy): API mai in cache
+        if not getattr(self, '_cache_control_sent', False):
+            self.send_header(
+                'Cache-Control',
+                cache_control_for(urlparse(self.path).path, getattr(self, '_response_status', 200))
+            )
+        self._cache_control_sent = False
+        super().end_headers()
+    
+    def do_OPTIONS(self):
+        """Gestisci preflight requests per CORS"""
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
     def handle_snapshot_endpoint(self):
         """Gestisci endpoint GET /api/inventory/snapshot"""
         try:
@@ -234,16 +439,22 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             
             logger.info(f"[VIEWER_API] Richiesta snapshot ricevuta, token_length={len(token)}")
             
+            # Formato colonnare opzionale: ?format=columnar oppure Accept
+            try:
+                columnar = wants_columnar(query_params.get('format', [None])[0], self.headers.get('Accept'))
+            except ValueError as e:
+                self._send_body(400, dumps({"detail": str(e)}), 'application/json')
+                return
+            
             # Importa e valida token
-            from viewer_db import validate_viewer_token, get_inventory_snapshot
+            from viewer_db import (
+                validate_viewer_token, get_inventory_snapshot, get_inventory_snapshot_columnar, get_inventory_version
+            )
             
             token_data = validate_viewer_token(token)
             if not token_data:
                 logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
-                self.send_response(401)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Token scaduto o non valido"}).encode('utf-8'))
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
                 return
             
             telegram_id = token_data["telegram_id"]
@@ -254,48 +465,60 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 f"business_name={business_name}"
             )
             
-            # Recupera snapshot dal database
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                snapshot_data = loop.run_until_complete(
-                    get_inventory_snapshot(telegram_id, business_name)
-                )
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
+            # Versione inventario con query aggregata: se il client ha già questa versione risponde 304
+            version_info = run_async(
+                get_inventory_version(telegram_id, business_name)
+            )
+            # Ogni formato ha il proprio ETag
+            etag_suffix = ":columnar" if columnar else ""
+            etag = make_etag(version_info["version"] + etag_suffix)
+            last_modified = version_info["last_updated_at"]
+            
+            if is_not_modified(
+                self.headers.get('If-None-Match'),
+                self.headers.get('If-Modified-Since'),
+                etag,
+                last_modified
+            ):
+                self.send_response(304)
+                for name, value in self._validator_headers(etag, last_modified).items():
+                    self.send_header(name, value)
+                self.send_header('Vary', 'Accept, Accept-Encoding')
                 self.end_headers()
-                self.wfile.write(json.dumps(snapshot_data).encode('utf-8'))
-                
-                logger.info(
-                    f"[VIEWER_API] Snapshot restituito con successo: rows={snapshot_data.get('meta', {}).get('total_rows', 0)}"
-                )
-            finally:
-                loop.close()
+                logger.info(f"[VIEWER_API] Snapshot non modificato (304): telegram_id={telegram_id}")
+                return
+            
+            # Recupera snapshot dal database (o dalla cache se ancora alla stessa versione)
+            fetch_snapshot = get_inventory_snapshot_columnar if columnar else get_inventory_snapshot
+            snapshot_data = run_async(
+                fetch_snapshot(telegram_id, business_name, version=version_info["version"])
+            )
+            if snapshot_data["meta"]["version"] != version_info["version"]:
+                # Inventario cambiato tra le due query: il body è più recente di last_modified
+                etag = make_etag(snapshot_data["meta"]["version"] + etag_suffix)
+                last_modified = None
+            
+            headers = self._validator_headers(etag, last_modified)
+            headers['Vary'] = 'Accept, Accept-Encoding'
+            if columnar:
+                self._send_body(200, dumps(snapshot_data), 'application/json', headers)
+            elif len(snapshot_data["rows"]) >= JSON_STREAM_MIN_ROWS:
+                # Inventario grande: righe serializzate e inviate a blocchi
+                self._send_stream(200, iter_json_document(snapshot_data, "rows"), 'application/json', headers)
+            else:
+                self._send_body(200, dumps(snapshot_data), 'application/json', headers)
+            
+            logger.info(
+                f"[VIEWER_API] Snapshot restituito con successo: rows={snapshot_data.get('meta', {}).get('total_rows', 0)}, "
+                f"format={'columnar' if columnar else 'json'}"
+            )
                 
         except Exception as e:
             logger.error(f"[VIEWER_API] Errore snapshot: {e}", exc_info=True)
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": f"Errore interno: {str(e)}"}).encode('utf-8'))
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
     
-    def end_headers(self):
-        # Headers CORS se necessario (per chiamate API)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        # Cache headers per static files
-        self.send_header('Cache-Control', 'public, max-age=3600')
-        super().end_headers()
-    
-    def do_OPTIONS(self):
-        """Gestisci preflight requests per CORS"""
-        self.send_response(200)
-        self.end_headers()
-    
-    def handle_snapshot_endpoint(self):
-        """Gestisci endpoint GET /api/inventory/snapshot"""
+    def handle_facets_endpoint(self):
+        """Gestisci endpoint GET /api/inventory/facets"""
         try:
             parsed_path = urlparse(self.path)
             query_params = parse_qs(parsed_path.query)
@@ -305,53 +528,240 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 self.send_error(400, "Token mancante")
                 return
             
-            logger.info(f"[VIEWER_API] Richiesta snapshot ricevuta, token_length={len(token)}")
-            
             # Importa e valida token
-            from viewer_db import validate_viewer_token, get_inventory_snapshot
+            from viewer_db import validate_viewer_token, get_inventory_facets, get_inventory_version
             
             token_data = validate_viewer_token(token)
             if not token_data:
                 logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
-                self.send_response(401)
-                self.send_header('Content-Type', 'application/json')
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
+                return
+            
+            telegram_id = token_data["telegram_id"]
+            business_name = token_data["business_name"]
+            
+            version_info = run_async(
+                get_inventory_version(telegram_id, business_name)
+            )
+            etag = make_etag(version_info["version"])
+            last_modified = version_info["last_updated_at"]
+            
+            if is_not_modified(
+                self.headers.get('If-None-Match'),
+                self.headers.get('If-Modified-Since'),
+                etag,
+                last_modified
+            ):
+                self.send_response(304)
+                for name, value in self._validator_headers(etag, last_modified).items():
+                    self.send_header(name, value)
+                self.send_header('Vary', 'Accept-Encoding')
                 self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Token scaduto o non valido"}).encode('utf-8'))
+                return
+            
+            facets_data = run_async(
+                get_inventory_facets(telegram_id, business_name, version=version_info["version"])
+            )
+            if facets_data["meta"]["version"] != version_info["version"]:
+                etag = make_etag(facets_data["meta"]["version"])
+                last_modified = None
+            
+            self._send_body(
+                200,
+                dumps(facets_data),
+                'application/json',
+                self._validator_headers(etag, last_modified)
+            )
+                
+        except Exception as e:
+            logger.error(f"[VIEWER_API] Errore facets: {e}", exc_info=True)
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
+    
+    def handle_page_endpoint(self):
+        """Gestisci endpoint GET /api/inventory/page"""
+        try:
+            parsed_path = urlparse(self.path)
+            query_params = {key: values[0] for key, values in parse_qs(parsed_path.query).items()}
+            token = query_params.get('token')
+            
+            if not token:
+                self.send_error(400, "Token mancante")
+                return
+            
+            # Importa e valida token
+            from viewer_db import validate_viewer_token, get_inventory_page
+            
+            token_data = validate_viewer_token(token)
+            if not token_data:
+                logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
                 return
             
             telegram_id = token_data["telegram_id"]
             business_name = token_data["business_name"]
             
+            try:
+                page_data = run_async(
+                    get_inventory_page(telegram_id, business_name, **page_params_from_query(query_params))
+                )
+            except ValueError as e:
+                # Parametri non validi (sort, limit, cursore, ...)
+                logger.warning(f"[VIEWER_API] Parametri pagina non validi: {e}")
+                self._send_body(400, dumps({"detail": str(e)}), 'application/json')
+                return
+            
+            self._send_body(
+                200,
+                dumps(page_data),
+                'application/json',
+                {'Cache-Control': 'private, no-cache'}
+            )
+            
             logger.info(
-                f"[VIEWER_API] Snapshot richiesto per telegram_id={telegram_id}, "
-                f"business_name={business_name}"
+                f"[VIEWER_API] Pagina inventario restituita: rows={len(page_data['rows'])}, "
+                f"filtered_rows={page_data['meta']['filtered_rows']}"
             )
+                
+        except Exception as e:
+            logger.error(f"[VIEWER_API] Errore pagina inventario: {e}", exc_info=True)
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
+    
+    def handle_delta_endpoint(self):
+        """Gestisci endpoint GET /api/inventory/delta"""
+        try:
+            parsed_path = urlparse(self.path)
+            query_params = {key: values[0] for key, values in parse_qs(parsed_path.query).items()}
+            token = query_params.get('token')
+            since = query_params.get('since')
+            
+            if not token:
+                self.send_error(400, "Token mancante")
+                return
+            
+            if not since:
+                self.send_error(400, "since mancante")
+                return
+            
+            # Importa e valida token
+            from viewer_db import validate_viewer_token, get_inventory_delta
+            
+            token_data = validate_viewer_token(token)
+            if not token_data:
+                logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
+                return
+            
+            telegram_id = token_data["telegram_id"]
+            business_name = token_data["business_name"]
             
-            # Recupera snapshot dal database
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             try:
-                snapshot_data = loop.run_until_complete(
-                    get_inventory_snapshot(telegram_id, business_name)
+                delta_data = run_async(
+                    get_inventory_delta(telegram_id, business_name, since, query_params.get('version'))
                 )
+            except ValueError as e:
+                logger.warning(f"[VIEWER_API] Parametri delta non validi: {e}")
+                self._send_body(400, dumps({"detail": str(e)}), 'application/json')
+                return
+            
+            self._send_body(
+                200,
+                dumps(delta_data),
+                'application/json',
+                {'Cache-Control': 'private, no-cache'}
+            )
+            
+            logger.info(
+                f"[VIEWER_API] Delta inventario restituito: rows={len(delta_data['rows'])}, "
+                f"deleted={len(delta_data['deleted_ids'])}, resync={delta_data['meta']['resync']}"
+            )
+                
+        except Exception as e:
+            logger.error(f"[VIEWER_API] Errore delta inventario: {e}", exc_info=True)
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
+    
+    def handle_events_endpoint(self):
+        """Gestisci endpoint GET /api/inventory/events (Server-Sent Events)"""
+        try:
+            parsed_path = urlparse(self.path)
+            query_params = parse_qs(parsed_path.query)
+            token = query_params.get('token', [None])[0]
+            
+            if not token:
+                self.send_error(400, "Token mancante")
+                return
+            
+            from viewer_db import validate_viewer_token
+            from inventory_events import get_event_hub, format_sse, TooManySubscribersError
+            
+            token_data = validate_viewer_token(token)
+            if not token_data:
+                logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto per stream eventi")
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
+                return
+            
+            hub = get_event_hub()
+            # Ogni stream occupa un worker: ne lasciamo almeno metà alle altre richieste
+            if SERVER_MODE == "threadpool" and hub.subscriber_count >= max(1, SERVER_WORKERS // 2):
+                self._send_body(503, dumps({"detail": "Troppi client collegati"}), 'application/json', {'Retry-After': '30'})
+                return
+            
+            # Nessun timeout per elemento: l'hub invia un heartbeat ogni SSE_HEARTBEAT_SECONDS
+            events = iterate_async(
+                hub.subscribe(token_data["telegram_id"], token_data["business_name"], token_data.get("exp")),
+                timeout=None
+            )
+            try:
+                try:
+                    next(events)  # {"type": "ready"}: iscrizione registrata
+                except TooManySubscribersError as e:
+                    self._send_body(503, dumps({"detail": str(e)}), 'application/json', {'Retry-After': '30'})
+                    return
+                except ValueError as e:
+                    self._send_body(404, dumps({"detail": str(e)}), 'application/json')
+                    return
                 
                 self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+                self.send_header('Cache-Control', 'no-store')
+                self.send_header('X-Accel-Buffering', 'no')
+                self._start_stream()
                 self.end_headers()
-                self.wfile.write(json.dumps(snapshot_data).encode('utf-8'))
+                # Lo stream occupa il worker: terminato lo stream si chiude anche la connessione
+                self.close_connection = True
                 
                 logger.info(
-                    f"[VIEWER_API] Snapshot restituito con successo: rows={snapshot_data.get('meta', {}).get('total_rows', 0)}"
+                    f"[VIEWER_API] Stream eventi aperto: telegram_id={token_data['telegram_id']}, "
+                    f"business_name={token_data['business_name']}, subscribers={hub.subscriber_count}"
                 )
+                
+                try:
+                    self._write_stream(b"retry: 5000\n" + format_sse({"type": "ready"}))
+                    self.wfile.flush()
+                    for event in events:
+                        self._write_stream(format_sse(event))
+                        self.wfile.flush()
+                    self._end_stream()
+                except (BrokenPipeError, ConnectionResetError):
+                    logger.debug("[VIEWER_API] Stream eventi chiuso dal client")
+                except Exception as e:
+                    # Header già inviati: si chiude lo stream, il client si riconnette
+                    logger.error(f"[VIEWER_API] Errore durante lo stream eventi: {e}", exc_info=True)
             finally:
-                loop.close()
+                events.close()
                 
         except Exception as e:
-            logger.error(f"[VIEWER_API] Errore snapshot: {e}", exc_info=True)
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": f"Errore interno: {str(e)}"}).encode('utf-8'))
+            logger.error(f"[VIEWER_API] Errore stream eventi: {e}", exc_info=True)
+            try:
+                self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
+            except Exception:
+                pass
+    
+    def _validator_headers(self, etag: str, last_modified) -> dict:
+        """Header per richieste condizionali: il client deve sempre rivalidare"""
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if last_modified is not None:
+            headers['Last-Modified'] = http_date(last_modified)
+        return headers
     
     def handle_movements_endpoint(self):
         """Gestisci endpoint GET /api/inventory/movements"""
@@ -360,6 +770,10 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             query_params = parse_qs(parsed_path.query)
             token = query_params.get('token', [None])[0]
             wine_name = query_params.get('wine_name', [None])[0]
+            # Serie aggregata (day/week/month) e intervallo date opzionali
+            bucket = query_params.get('bucket', [None])[0]
+            date_from = query_params.get('from', [None])[0]
+            date_to = query_params.get('to', [None])[0]
             
             if not token:
                 self.send_error(400, "Token mancante")
@@ -372,15 +786,12 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             logger.info(f"[VIEWER_API] Richiesta movimenti per vino '{wine_name}', token_length={len(token)}")
             
             # Importa e valida token
-            from viewer_db import validate_viewer_token, get_wine_movements
+            from viewer_db import validate_viewer_token, get_wine_movements, get_wine_movement_series
             
             token_data = validate_viewer_token(token)
             if not token_data:
                 logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
-                self.send_response(401)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Token scaduto o non valido"}).encode('utf-8'))
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
                 return
             
             telegram_id = token_data["telegram_id"]
@@ -391,31 +802,81 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 f"telegram_id={telegram_id}, business_name={business_name}"
             )
             
-            # Recupera movimenti dal database
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             try:
-                movements = loop.run_until_complete(
-                    get_wine_movements(telegram_id, business_name, wine_name)
-                )
-                
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"movements": movements}).encode('utf-8'))
+                if bucket:
+                    # Serie aggregata in SQL invece delle righe grezze
+                    series = run_async(
+                        get_wine_movement_series(telegram_id, business_name, wine_name, bucket, date_from, date_to)
+                    )
+                    payload = {"bucket": bucket, "series": series}
+                    count = len(series)
+                else:
+                    # Recupera movimenti dal database
+                    movements = run_async(
+                        get_wine_movements(telegram_id, business_name, wine_name, date_from, date_to)
+                    )
+                    payload = {"movements": movements}
+                    count = len(movements)
+            except ValueError as e:
+                logger.warning(f"[VIEWER_API] Parametri movimenti non validi: {e}")
+                self._send_body(400, dumps({"detail": str(e)}), 'application/json')
+                return
+            
+            self._send_body(200, dumps(payload), 'application/json')
+            
+            logger.info(
+                f"[VIEWER_API] Movimenti restituiti con successo: count={count}"
+            )
                 
-                logger.info(
-                    f"[VIEWER_API] Movimenti restituiti con successo: count={len(movements)}"
+        except Exception as e:
+            logger.error(f"[VIEWER_API] Errore movimenti: {e}", exc_info=True)
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
+    
+    def handle_movements_batch_endpoint(self):
+        """Gestisci endpoint GET /api/inventory/movements/batch"""
+        try:
+            parsed_path = urlparse(self.path)
+            query_params = parse_qs(parsed_path.query)
+            token = query_params.get('token', [None])[0]
+            wine_names = query_params.get('wine_name', [])
+            all_wines = query_params.get('all', [''])[0].lower() in ('1', 'true')
+            
+            if not token:
+                self.send_error(400, "Token mancante")
+                return
+            
+            if not wine_names and not all_wines:
+                self.send_error(400, "wine_name o all=1 richiesto")
+                return
+            
+            # Importa e valida token
+            from viewer_db import validate_viewer_token, get_wines_movements
+            
+            token_data = validate_viewer_token(token)
+            if not token_data:
+                logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto")
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
+                return
+            
+            telegram_id = token_data["telegram_id"]
+            business_name = token_data["business_name"]
+            
+            try:
+                movements = run_async(
+                    get_wines_movements(telegram_id, business_name, None if all_wines else wine_names)
                 )
-            finally:
-                loop.close()
+            except ValueError as e:
+                logger.warning(f"[VIEWER_API] Parametri movimenti non validi: {e}")
+                self._send_body(400, dumps({"detail": str(e)}), 'application/json')
+                return
+            
+            self._send_body(200, dumps({"movements": movements}), 'application/json')
+            
+            logger.info(f"[VIEWER_API] Movimenti in blocco restituiti: wines={len(movements)}")
                 
         except Exception as e:
-            logger.error(f"[VIEWER_API] Errore movimenti: {e}", exc_info=True)
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": f"Errore interno: {str(e)}"}).encode('utf-8'))
+            logger.error(f"[VIEWER_API] Errore movimenti in blocco: {e}", exc_info=True)
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
     
     def handle_csv_export_endpoint(self):
         """Gestisci endpoint GET /api/inventory/export.csv"""
@@ -431,15 +892,12 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             logger.info(f"[VIEWER_API] Richiesta export CSV ricevuta, token_length={len(token)}")
             
             # Importa e valida token
-            from viewer_db import validate_viewer_token, get_inventory_snapshot
+            from viewer_db import validate_viewer_token, iter_inventory_csv_rows
             
             token_data = validate_viewer_token(token)
             if not token_data:
                 logger.warning(f"[VIEWER_API] Token JWT non valido o scaduto per export CSV")
-                self.send_response(401)
-                self.send_header('Content-Type', 'text/plain; charset=utf-8')
-                self.end_headers()
-                self.wfile.write("Token scaduto o non valido".encode('utf-8'))
+                self._send_body(401, "Token scaduto o non valido".encode('utf-8'), 'text/plain; charset=utf-8')
                 return
             
             telegram_id = token_data["telegram_id"]
@@ -450,75 +908,63 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                 f"business_name={business_name}"
             )
             
-            # Recupera snapshot dal database e genera CSV
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            # Legge l'inventario a blocchi dal cursore e invia ogni blocco appena pronto
+            batches = iterate_async(iter_inventory_csv_rows(telegram_id, business_name))
             try:
-                snapshot_data = loop.run_until_complete(
-                    get_inventory_snapshot(telegram_id, business_name)
-                )
-                
-                # Genera CSV dai dati
-                csv_content = self.generate_csv_from_snapshot(snapshot_data)
+                # Il primo blocco viene letto prima degli header: se la query fallisce
+                # il client riceve ancora un 500
+                first_batch = next(batches, [])
                 
                 # Genera nome file con timestamp
-                from datetime import datetime
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f"inventario_{business_name.replace(' ', '_')}_{timestamp}.csv"
+                filename = csv_export_filename(business_name)
+                content_type = 'text/csv; charset=utf-8'
+                compressor = stream_compressor(self.headers.get('Accept-Encoding'), content_type)
                 
-                # Invia CSV come download
+                # Lunghezza non nota in anticipo: chunked (HTTP/1.1), la connessione resta aperta
                 self.send_response(200)
-                self.send_header('Content-Type', 'text/csv; charset=utf-8')
+                self.send_header('Content-Type', content_type)
                 self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+                if compressor:
+                    self.send_header('Content-Encoding', compressor.encoding)
+                self.send_header('Vary', 'Accept-Encoding')
+                self._start_stream()
                 self.end_headers()
-                self.wfile.write(csv_content.encode('utf-8'))
                 
-                logger.info(
-                    f"[VIEWER_API] CSV esportato con successo: rows={len(snapshot_data.get('rows', []))}, "
-                    f"filename={filename}"
-                )
+                total_rows = len(first_batch)
+                try:
+                    self._write_csv_chunk(encode_csv_rows(first_batch, include_headers=True), compressor)
+                    for batch in batches:
+                        total_rows += len(batch)
+                        self._write_csv_chunk(encode_csv_rows(batch), compressor)
+                    if compressor:
+                        self._write_stream(compressor.finish())
+                    self._end_stream()
+                except (BrokenPipeError, ConnectionResetError):
+                    logger.warning("[VIEWER_API] Export CSV interrotto: connessione chiusa dal client")
+                    self.close_connection = True
+                    return
+                except Exception as e:
+                    # Header già inviati: si può solo troncare la risposta chiudendo la connessione
+                    logger.error(f"[VIEWER_API] Errore durante lo streaming CSV: {e}", exc_info=True)
+                    self.close_connection = True
+                    return
             finally:
-                loop.close()
+                batches.close()
+            
+            logger.info(
+                f"[VIEWER_API] CSV esportato con successo: rows={total_rows}, "
+                f"filename={filename}"
+            )
                 
         except Exception as e:
             logger.error(f"[VIEWER_API] Errore export CSV: {e}", exc_info=True)
-            self.send_response(500)
-            self.send_header('Content-Type', 'text/plain; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(f"Errore interno: {str(e)}".encode('utf-8'))
+            self._send_body(500, f"Errore interno: {str(e)}".encode('utf-8'), 'text/plain; charset=utf-8')
     
-    def generate_csv_from_snapshot(self, snapshot_data):
-        """Genera contenuto CSV dallo snapshot"""
-        import csv
-        import io
-        
-        rows = snapshot_data.get('rows', [])
-        
-        # Headers CSV
-        headers = ['Nome', 'Cantina', 'Fornitore', 'Annata', 'Quantità', 'Prezzo (€)', 'Tipo', 'Scorta Critica']
-        
-        # Crea CSV in memoria
-        output = io.StringIO()
-        writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
-        
-        # Scrivi headers
-        writer.writerow(headers)
-        
-        # Scrivi righe dati
-        for row in rows:
-            csv_row = [
-                row.get('name', ''),
-                row.get('winery', ''),
-                row.get('supplier', ''),
-                row.get('vintage', ''),
-                row.get('qty', 0),
-                row.get('price', 0.0),
-                row.get('type', ''),
-                'Sì' if row.get('critical', False) else 'No'
-            ]
-            writer.writerow(csv_row)
-        
-        return output.getvalue()
+    def _write_csv_chunk(self, chunk: bytes, compressor):
+        """Scrive un blocco dell'export CSV (compresso se negoziato)"""
+        if compressor:
+            chunk = compressor.compress(chunk) + compressor.flush()
+        self._write_stream(chunk)
     
     def handle_update_field_endpoint(self):
         """Gestisci endpoint POST /api/inventory/update-field"""
@@ -536,6 +982,8 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             wine_id = data.get('wine_id')
             field = data.get('field')
             value = data.get('value')
+            # Versione della riga vista dal client (controllo di concorrenza, opzionale)
+            expected_updated_at = data.get('expected_updated_at')
             
             if not all([token, wine_id, field, value is not None]):
                 self.send_error(400, "Parametri mancanti: token, wine_id, field, value richiesti")
@@ -548,10 +996,7 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             token_data = validate_viewer_token(token)
             if not token_data:
                 logger.warning(f"[UPDATE_FIELD] Token JWT non valido o scaduto")
-                self.send_response(401)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Token scaduto o non valido"}).encode('utf-8'))
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
                 return
             
             telegram_id = token_data["telegram_id"]
@@ -563,7 +1008,7 @@ class Handler(http.server.SimpleHTTPRequestHandler):
             )
             
             # Aggiorna direttamente nel database (senza chiamare processor)
-            from viewer_db import update_wine_field
+            from viewer_db import update_wine_field, StaleWriteError
             
             async def update_directly():
                 return await update_wine_field(
@@ -571,53 +1016,254 @@ class Handler(http.server.SimpleHTTPRequestHandler):
                     business_name=business_name,
                     wine_id=wine_id,
                     field=field,
-                    value=str(value) if value is not None else ''
+                    value=str(value) if value is not None else '',
+                    expected_updated_at=expected_updated_at
                 )
             
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
             try:
-                result = loop.run_until_complete(update_directly())
+                result = run_async(update_directly())
                 
                 logger.info(f"[UPDATE_FIELD] Campo aggiornato con successo: {result}")
                 
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(result).encode('utf-8'))
+                self._send_body(200, dumps(result), 'application/json')
+            except StaleWriteError as e:
+                # Il vino è stato modificato dopo la versione vista dal client
+                logger.warning(f"[UPDATE_FIELD] Conflitto di versione: {e}")
+                current = e.current_updated_at.isoformat() if e.current_updated_at else None
+                self._send_body(409, dumps({"detail": str(e), "current_updated_at": current}), 'application/json')
             except ValueError as e:
                 # Errore di validazione (campo non supportato, valore non valido, etc.)
                 error_msg = str(e)
                 logger.warning(f"[UPDATE_FIELD] Errore validazione: {error_msg}")
-                self.send_response(400)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": error_msg}).encode('utf-8'))
+                self._send_body(400, dumps({"detail": error_msg}), 'application/json')
             except Exception as e:
                 error_msg = str(e)
                 logger.error(f"[UPDATE_FIELD] Errore aggiornamento database: {error_msg}", exc_info=True)
-                self.send_response(500)
-                self.send_header('Content-Type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": f"Errore durante l'aggiornamento: {error_msg}"}).encode('utf-8'))
-            finally:
-                loop.close()
+                self._send_body(500, dumps({"detail": f"Errore durante l'aggiornamento: {error_msg}"}), 'application/json')
                 
         except json.JSONDecodeError as e:
             logger.error(f"[UPDATE_FIELD] Errore parsing JSON: {e}")
             self.send_error(400, "JSON non valido")
         except Exception as e:
             logger.error(f"[UPDATE_FIELD] Errore generico: {e}", exc_info=True)
-            self.send_response(500)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"detail": f"Errore interno: {str(e)}"}).encode('utf-8'))
+            self._send_body(500, dumps({"detail": f"Errore interno: {str(e)}"}), 'application/json')
+    
+    def handle_update_fields_endpoint(self):
+        """Gestisci endpoint POST /api/inventory/update-fields (modifiche in blocco)"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            if content_length == 0:
+                self.send_error(400, "Body vuoto")
+                return
+            
+            body = self.rfile.read(content_length)
+            data = json.loads(body.decode('utf-8'))
+            
+            token = data.get('token')
+            changes = data.get('changes')
+            
+            if not token or not changes:
+                self.send_error(400, "Parametri mancanti: token e changes richiesti")
+                return
+            
+            from viewer_db import validate_viewer_token, update_wine_fields
+            token_data = validate_viewer_token(token)
+            if not token_data:
+                logger.warning(f"[UPDATE_FIELDS] Token JWT non valido o scaduto")
+                self._send_body(401, dumps({"detail": "Token scaduto o non valido"}), 'application/json')
+                return
+            
+            telegram_id = token_data["telegram_id"]
+            business_name = token_data["business_name"]
+            
+            logger.info(
+                f"[UPDATE_FIELDS] Update in blocco richiesto: changes={len(changes) if isinstance(changes, list) else '?'}, "
+                f"telegram_id={telegram_id}, business_name={business_name}"
+            )
+            
+            try:
+                result = run_async(update_wine_fields(telegram_id, business_name, changes))
+            except ValueError as e:
+                logger.warning(f"[UPDATE_FIELDS] Errore validazione: {e}")
+                self._send_body(400, dumps({"detail": str(e)}), 'application/json')
+                return
+            
+            self._send_body(
+                200,
+                dumps(result),
+                'application/json',
+                {'Cache-Control': 'no-store'}
+            )
+                
+        except json.JSONDecodeError as e:
+            logger.error(f"[UPDATE_FIELDS] Errore parsing JSON: {e}")
+            self.send_error(400, "JSON non valido")
+        except Exception as e:
+            logger.error(f"[UPDATE_FIELDS] Errore aggiornamento in blocco: {e}", exc_info=True)
+            self._send_body(500, dumps({"detail": f"Errore durante l'aggiornamento: {str(e)}"}), 'application/json')
     
     def log_message(self, format, *args):
         """Override per logging più pulito"""
         # Log usando logger invece di sys.stderr
         logger.debug(f"{self.address_string()} - {format % args}")
 
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    """
+    TCPServer che gestisce le richieste con un numero fisso di worker.
+    
+    Le connessioni accettate oltre workers + queue_size ricevono subito
+    503 invece di accumularsi, così un picco non esaurisce memoria e thread.
+    """
+    allow_reuse_address = True
+    
+    def __init__(self, server_address, handler_class, workers: int, queue_size: int):
+        # Backlog del socket dimensionato sulla coda applicativa
+        self.request_queue_size = max(queue_size, 5)
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="viewer-worker")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        # Connessioni accettate e non ancora chiuse (in corso o in coda)
+        self._connections = 0
+        self._connections_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+    
+    def saturated(self) -> bool:
+        """True se c'è una connessione in coda in attesa di un worker: le keep-alive vanno chiuse dopo la risposta"""
+        # _connections include quella corrente: con esattamente `workers` connessioni nessuna è in attesa
+        return self._connections > self.workers
+    
+    def process_request(self, request, client_address):
+        """Accoda la richiesta al pool di worker (o la rifiuta se la coda è piena)"""
+        if not self._slots.acquire(blocking=False):
+            logger.warning(f"[SERVER] Coda richieste piena, rifiuto connessione da {client_address[0]}")
+            self._reject_request(request)
+            return
+        
+        with self._connections_lock:
+            self._connections += 1
+        try:
+            self._executor.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # Executor già chiuso (shutdown in corso)
+            self._release_connection()
+            self.shutdown_request(request)
+    
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._release_connection()
+    
+    def _release_connection(self):
+        with self._connections_lock:
+            self._connections -= 1
+        self._slots.release()
+    
+    def _reject_request(self, request):
+        body = "Server occupato, riprova tra poco".encode('utf-8')
+        response = (
+            b"HTTP/1.0 503 Service Unavailable\r\n"
+            b"Content-Type: text/plain; charset=utf-8\r\n"
+            b"Retry-After: 1\r\n"
+            b"Connection: close\r\n"
+            b"Content-Length: " + str(len(body)).encode('ascii') + b"\r\n\r\n" + body
+        )
+        try:
+            request.sendall(response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+    
+    def server_close(self):
+        """Chiude il socket e attende il completamento delle richieste in corso"""
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """TCPServer con un thread per richiesta (nessun limite di concorrenza)"""
+    allow_reuse_address = True
+    daemon_threads = False
+    block_on_close = True
+
+
+def create_server(mode: str = SERVER_MODE) -> socketserver.TCPServer:
+    """
+    Crea il server HTTP nella modalità richiesta.
+    
+    Args:
+        mode: "threadpool", "threaded" oppure "single"
+        
+    Returns:
+        Istanza del server già in ascolto su PORT
+    """
+    address = ("0.0.0.0", PORT)
+    
+    if mode == "threadpool":
+        logger.info(
+            f"[SERVER] Modalità threadpool: workers={SERVER_WORKERS}, queue_size={SERVER_QUEUE_SIZE}"
+        )
+        return ThreadPoolHTTPServer(address, Handler, SERVER_WORKERS, SERVER_QUEUE_SIZE)
+    
+    if mode == "threaded":
+        logger.info("[SERVER] Modalità threaded: un thread per richiesta")
+        return ThreadedHTTPServer(address, Handler)
+    
+    if mode != "single":
+        logger.warning(f"[SERVER] SERVER_MODE sconosciuta '{mode}', uso 'single'")
+    
+    logger.info("[SERVER] Modalità single: una richiesta alla volta")
+    socketserver.TCPServer.allow_reuse_address = True
+    return socketserver.TCPServer(address, Handler)
+
+
+def install_shutdown_handlers(httpd: socketserver.TCPServer) -> None:
+    """Registra SIGTERM/SIGINT per uno shutdown graduale del server"""
+    def _handle_signal(signum, frame):
+        logger.info(f"[SERVER] Ricevuto segnale {signal.Signals(signum).name}, shutdown in corso...")
+        # shutdown() blocca finché serve_forever non termina: va chiamato da un altro thread
+        threading.Thread(target=httpd.shutdown, name="viewer-shutdown", daemon=True).start()
+    
+    signal.signal(signal.SIGTERM, _handle_signal)
+    signal.signal(signal.SIGINT, _handle_signal)
+
+
+def _close_server(httpd: socketserver.TCPServer) -> None:
+    """Chiude il server attendendo le richieste in corso al massimo SERVER_SHUTDOWN_TIMEOUT secondi"""
+    # Gli stream SSE non terminano da soli: vanno chiusi prima di attendere i worker
+    try:
+        from inventory_events import get_event_hub
+        run_async(get_event_hub().close(), timeout=SERVER_SHUTDOWN_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"[SERVER] Errore chiusura stream eventi: {e}")
+    
+    closer = threading.Thread(target=httpd.server_close, name="viewer-close", daemon=True)
+    closer.start()
+    closer.join(SERVER_SHUTDOWN_TIMEOUT)
+    if closer.is_alive():
+        logger.warning(
+            f"[SERVER] Richieste ancora in corso dopo {SERVER_SHUTDOWN_TIMEOUT}s, chiusura forzata"
+        )
+    else:
+        logger.info("[SERVER] Richieste in corso completate")
+
+
+def _shutdown_async_resources() -> None:
+    """Chiude il pool connessioni e arresta il loop persistente"""
+    try:
+        from viewer_db import close_pool
+        run_async(close_pool(), timeout=SERVER_SHUTDOWN_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"[SERVER] Errore chiusura pool connessioni: {e}")
+    from view_cache import get_view_cache
+    get_view_cache().close()
+    shutdown_runner()
+
+
 if __name__ == "__main__":
     logger.info(f"🍷 Vineinventory Viewer server avviato su porta {PORT}")
     logger.info(f"📁 Directory: {DIRECTORY}")
@@ -631,18 +1277,47 @@ if __name__ == "__main__":
     
     logger.info(f"✅ index.html trovato")
     
+    # File statici e pagina iniziale (config, fingerprint asset, gzip/br) pronti prima della prima richiesta
+    get_static_store().preload()
+    get_index_page()
+    
+    if SERVER_BACKEND == "aiohttp":
+        from aiohttp_server import run as run_aiohttp
+        try:
+            logger.info(f"🚀 In ascolto su porta {PORT} (backend aiohttp)...")
+            run_aiohttp(PORT)
+        except OSError as e:
+            logger.error(f"❌ Errore porta {PORT}: {e}", exc_info=True)
+            sys.exit(1)
+        logger.info("👋 Server arrestato")
+        sys.exit(0)
+    
+    if SERVER_BACKEND != "http":
+        logger.warning(f"[SERVER] SERVER_BACKEND sconosciuto '{SERVER_BACKEND}', uso 'http'")
+    
     try:
-        # Permetti riuso indirizzo per evitare "Address already in use"
-        socketserver.TCPServer.allow_reuse_address = True
-        
-        with socketserver.TCPServer(("0.0.0.0", PORT), Handler) as httpd:
-            logger.info(f"✅ Server pronto su http://0.0.0.0:{PORT}")
-            logger.info(f"🚀 In ascolto su porta {PORT}...")
-            httpd.serve_forever()
+        httpd = create_server(SERVER_MODE)
     except OSError as e:
         logger.error(f"❌ Errore porta {PORT}: {e}", exc_info=True)
         sys.exit(1)
     except Exception as e:
         logger.error(f"❌ Errore avvio server: {e}", exc_info=True)
         sys.exit(1)
-
+    
+    install_shutdown_handlers(httpd)
+    # Hit rate delle cache nei log, periodicamente e allo shutdown
+    stats_logger = CacheStatsLogger()
+    stats_logger.start()
+    
+    try:
+        logger.info(f"✅ Server pronto su http://0.0.0.0:{PORT}")
+        logger.info(f"🚀 In ascolto su porta {PORT}...")
+        httpd.serve_forever()
+    except Exception as e:
+        logger.error(f"❌ Errore server: {e}", exc_info=True)
+        sys.exit(1)
+    finally:
+        _close_server(httpd)
+        stats_logger.stop()
+        _shutdown_async_resources()
+        logger.info("👋 Server arrestato")
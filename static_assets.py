@@ -0,0 +1,343 @@
+"""
+File statici serviti dalla memoria (app.js, styles.css, assets/, immagini/).
+
+I file vengono caricati all'avvio (preload) insieme alle varianti compresse
+e a un hash del contenuto, usato sia come ETag sia come fingerprint ?v=
+negli URL di index.html. Su disco si controlla solo se il file è cambiato
+(al massimo ogni STATIC_RECHECK_SECONDS). Le risposte supportano richieste
+condizionali (304) e Range; la policy Cache-Control dipende dalla route.
+"""
+import os
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from compression import COMPRESSION_MIN_SIZE, compress, choose_encoding, is_compressible, supported_encodings
+from viewer_common import DIRECTORY, http_date, is_not_modified, etag_matches
+
+logger = logging.getLogger(__name__)
+
+# max-age dei file statici senza fingerprint
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 3600))
+# File più grandi vengono letti da disco a ogni richiesta
+STATIC_MAX_FILE_BYTES = int(os.getenv("STATIC_MAX_FILE_BYTES", 8 * 1024 * 1024))
+# Byte massimi tenuti in memoria (somma dei file e delle varianti compresse)
+STATIC_MAX_BYTES = int(os.getenv("STATIC_MAX_BYTES", 64 * 1024 * 1024))
+# Ogni quanti secondi verificare se un file è cambiato su disco
+STATIC_RECHECK_SECONDS = float(os.getenv("STATIC_RECHECK_SECONDS", 2))
+
+# Estensioni servite come file statici (e caricate all'avvio): codice e dati del server restano esclusi
+STATIC_PRELOAD_EXTENSIONS = ('.js', '.css', '.html', '.png', '.jpg', '.jpeg', '.svg', '.ico', '.webp', '.woff2')
+
+# Cache-Control per route
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STATIC_CACHE_CONTROL = f'public, max-age={STATIC_MAX_AGE}'
+# index.html viene sempre rivalidato (ETag), così i nuovi fingerprint arrivano subito
+INDEX_CACHE_CONTROL = 'no-cache'
+# Le API contengono dati dell'inventario: nessuna cache intermedia né del browser
+API_CACHE_CONTROL = 'no-store'
+
+
+def cache_control_for(path: str, status: int = 200) -> str:
+    """Cache-Control di default per una route (se l'handler non ne imposta uno)"""
+    # Gli errori (es. 404 di un asset mancante) non devono restare in cache nei proxy
+    if path.startswith('/api/') or status >= 400:
+        return API_CACHE_CONTROL
+    return STATIC_CACHE_CONTROL
+
+
+class RangeNotSatisfiable(Exception):
+    """Header Range fuori dalla dimensione del file (416)"""
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Interpreta un header Range a intervallo singolo (bytes=a-b, bytes=a-, bytes=-n).
+    
+    Args:
+        range_header: Valore dell'header Range
+        size: Dimensione del file
+    
+    Returns:
+        (inizio, fine) inclusivi, None se l'header va ignorato (assente,
+        malformato o con più intervalli: si risponde con il file intero)
+    
+    Raises:
+        RangeNotSatisfiable: Se l'intervallo è fuori dal file
+    """
+    if not range_header:
+        return None
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    
+    first, dash, last = spec.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if first == '':
+            # Ultimi n byte (un file vuoto non ha intervalli soddisfacibili)
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable(range_header)
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    
+    if start >= size:
+        raise RangeNotSatisfiable(range_header)
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+def is_static_asset_path(relative_path: str) -> bool:
+    """True se il path (relativo alla directory del viewer) è un asset pubblicabile"""
+    parts = relative_path.replace(os.sep, '/').split('/')
+    # Niente file o directory nascosti (.git, .env) né interni (__pycache__)
+    if any(part.startswith(('.', '__')) for part in parts):
+        return False
+    return parts[-1].lower().endswith(STATIC_PRELOAD_EXTENSIONS)
+
+
+class StaticAsset:
+    """Contenuto di un file statico in memoria, con varianti compresse ed ETag"""
+    
+    def __init__(self, path: str, body: bytes, signature: Tuple[int, int]):
+        self.path = path
+        self.body = body
+        self.signature = signature
+        self.checked_at = time.monotonic()
+        self.fingerprint = hashlib.sha256(body).hexdigest()[:12]
+        self.last_modified = datetime.fromtimestamp(signature[0] / 1e9, tz=timezone.utc)
+        
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type == 'application/javascript':
+            content_type = f"{content_type}; charset=utf-8"
+        self.content_type = content_type
+        
+        # Una variante (e un ETag forte) per codifica; solo se conviene comprimere
+        self._variants: Dict[Optional[str], Tuple[bytes, str]] = {None: (body, f'"{self.fingerprint}"')}
+        if is_compressible(content_type) and len(body) >= COMPRESSION_MIN_SIZE:
+            for encoding in supported_encodings():
+                compressed = compress(body, encoding, best=True)
+                if len(compressed) < len(body):
+                    self._variants[encoding] = (compressed, f'"{self.fingerprint}-{encoding}"')
+        
+        self.weight = sum(len(variant) for variant, _ in self._variants.values())
+    
+    @property
+    def compressible(self) -> bool:
+        return len(self._variants) > 1
+    
+    @property
+    def etag(self) -> str:
+        """ETag della variante non compressa"""
+        return self._variants[None][1]
+    
+    def variant(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str], str]:
+        """(body, codifica o None, ETag) per il client"""
+        encoding = choose_encoding(accept_encoding) if self.compressible else None
+        if encoding not in self._variants:
+            encoding = None
+        body, etag = self._variants[encoding]
+        return body, encoding, etag
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int]]:
+    """(mtime_ns, dimensione) del file, None se non esiste: cambia quando il file viene modificato"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class StaticAssetStore:
+    """Cache in memoria dei file statici di una directory"""
+    
+    def __init__(self, directory: str):
+        self.directory = os.path.realpath(directory)
+        self._assets: Dict[str, StaticAsset] = {}
+        self._lock = threading.Lock()
+        self.weight = 0
+        self.hits = 0
+        self.reloads = 0
+    
+    def resolve(self, url_path: str) -> Optional[str]:
+        """
+        Path assoluto di un asset della directory.
+        
+        Returns:
+            None se il path è fuori dalla directory, non esiste o non è un asset
+            (estensione non in STATIC_PRELOAD_EXTENSIONS, file nascosti o interni)
+        """
+        path = os.path.realpath(os.path.join(self.directory, url_path.lstrip('/')))
+        if not path.startswith(self.directory + os.sep) or not os.path.isfile(path):
+            return None
+        if not is_static_asset_path(os.path.relpath(path, self.directory)):
+            return None
+        return path
+    
+    def get(self, path: str, revalidate: bool = False) -> Optional[StaticAsset]:
+        """
+        Restituisce il file dalla memoria, ricaricandolo se è cambiato su disco.
+        
+        Args:
+            path: Path assoluto (da resolve)
+            revalidate: Se True controlla il file su disco anche entro STATIC_RECHECK_SECONDS
+        
+        Returns:
+            StaticAsset, None se il file non esiste o va servito da disco (troppo grande)
+        """
+        asset = self._assets.get(path)
+        now = time.monotonic()
+        if asset is not None and not revalidate and now - asset.checked_at < STATIC_RECHECK_SECONDS:
+            self.hits += 1
+            return asset
+        
+        signature = file_signature(path)
+        if asset is not None and signature == asset.signature:
+            asset.checked_at = now
+            self.hits += 1
+            return asset
+        
+        with self._lock:
+            current = self._assets.get(path)
+            if current is not None and current.signature == signature:
+                # Già ricaricato da un'altra richiesta
+                return current
+            if current is not None:
+                self._remove_locked(path)
+            if signature is None or signature[1] > STATIC_MAX_FILE_BYTES:
+                return None
+            return self._load_locked(path, signature, reload=current is not None)
+    
+    def _load_locked(self, path: str, signature: Tuple[int, int], reload: bool = False) -> Optional[StaticAsset]:
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except OSError as e:
+            logger.warning(f"[STATIC] Impossibile leggere {path}: {e}")
+            return None
+        
+        asset = StaticAsset(path, body, signature)
+        if self.weight + asset.weight > STATIC_MAX_BYTES:
+            logger.warning(f"[STATIC] Limite STATIC_MAX_BYTES raggiunto, {os.path.basename(path)} servito da disco")
+            return None
+        
+        self._assets[path] = asset
+        self.weight += asset.weight
+        if reload:
+            self.reloads += 1
+            logger.info(f"[STATIC] {os.path.relpath(path, self.directory)} ricaricato (modificato su disco)")
+        return asset
+    
+    def _remove_locked(self, path: str) -> None:
+        asset = self._assets.pop(path, None)
+        if asset is not None:
+            self.weight -= asset.weight
+    
+    def preload(self) -> int:
+        """Carica in memoria i file con estensione STATIC_PRELOAD_EXTENSIONS; restituisce quanti"""
+        loaded = 0
+        for root, dirs, files in os.walk(self.directory):
+            dirs[:] = [name for name in dirs if not name.startswith(('.', '__'))]
+            for name in files:
+                if not is_static_asset_path(name):
+                    continue
+                if self.get(os.path.join(root, name)) is not None:
+                    loaded += 1
+        logger.info(f"[STATIC] {loaded} file statici in memoria ({self.weight} byte con varianti compresse)")
+        return loaded
+    
+    def stats(self) -> Dict[str, Any]:
+        return {"files": len(self._assets), "bytes": self.weight, "hits": self.hits, "reloads": self.reloads}
+
+
+def build_static_response(
+    asset: StaticAsset,
+    request_headers: Mapping[str, str],
+    version: Optional[str] = None
+) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Prepara la risposta per un file statico (comune ai due backend HTTP).
+    
+    Args:
+        asset: File da servire
+        request_headers: Header della richiesta
+        version: Valore di ?v= nell'URL; se coincide col fingerprint la risposta è immutable
+    
+    Returns:
+        (status, header, body): 200, 206, 304 oppure 416
+    """
+    cache_control = IMMUTABLE_CACHE_CONTROL if version and version == asset.fingerprint else STATIC_CACHE_CONTROL
+    headers = {
+        'Cache-Control': cache_control,
+        'Last-Modified': http_date(asset.last_modified),
+        'Accept-Ranges': 'bytes'
+    }
+    if asset.compressible:
+        headers['Vary'] = 'Accept-Encoding'
+    
+    # Range vale solo sulla variante non compressa e, con If-Range, solo se il file non è cambiato
+    range_header = request_headers.get('Range')
+    if_range = request_headers.get('If-Range')
+    if range_header and if_range:
+        if if_range.strip().startswith(('"', 'W/')):
+            if not etag_matches(if_range, asset.etag):
+                range_header = None
+        elif if_range.strip() != headers['Last-Modified']:
+            range_header = None
+    
+    if range_header:
+        body, encoding, etag = asset.body, None, asset.etag
+    else:
+        body, encoding, etag = asset.variant(request_headers.get('Accept-Encoding'))
+    headers['ETag'] = etag
+    
+    if is_not_modified(
+        request_headers.get('If-None-Match'),
+        request_headers.get('If-Modified-Since'),
+        etag,
+        asset.last_modified
+    ):
+        return 304, headers, b''
+    
+    headers['Content-Type'] = asset.content_type
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    
+    try:
+        byte_range = parse_range(range_header, len(body))
+    except RangeNotSatisfiable:
+        headers['Content-Range'] = f'bytes */{len(body)}'
+        headers['Cache-Control'] = cache_control_for('', 416)
+        return 416, headers, b''
+    
+    if byte_range is not None:
+        start, end = byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{len(body)}'
+        return 206, headers, body[start:end + 1]
+    
+    return 200, headers, body
+
+
+_store: Optional[StaticAssetStore] = None
+_store_lock = threading.Lock()
+
+
+def get_static_store() -> StaticAssetStore:
+    """Store condiviso dal processo (directory del viewer)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = StaticAssetStore(DIRECTORY)
+    return _store
@@ -0,0 +1,154 @@
+"""
+Test di serializers: streaming a blocchi e formato colonnare dello snapshot.
+
+Uso:
+    python -m pytest -q test_serializers.py
+"""
+import json
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+import serializers
+from serializers import dumps, iter_json_document, to_columnar, wants_columnar, COLUMNAR_MEDIA_TYPE
+
+
+def _snapshot(rows: int):
+    return {
+        "rows": [
+            {"id": i + 1, "name": f"Vino {i}", "vintage": 2000 + i % 3, "qty": i, "price": 10.5, "critical": i % 2 == 0}
+            for i in range(rows)
+        ],
+        "facets": {"type": {"Rosso": rows}, "vintage": {2000: 1, 2001: 2}},
+        "meta": {"total_rows": rows, "version": f"{rows}:test"}
+    }
+
+
+def _streamed(document, chunk_rows):
+    return b''.join(iter_json_document(document, "rows", chunk_rows))
+
+
+@pytest.mark.parametrize("rows", [0, 1, 4, 5, 6, 23])
+@pytest.mark.parametrize("chunk_rows", [1, 5, 1000])
+def test_iter_json_document_equals_dumps(rows, chunk_rows):
+    # Righe vuote, confini di blocco esatti e blocchi parziali
+    document = _snapshot(rows)
+    assert _streamed(document, chunk_rows) == dumps(document)
+
+
+def test_iter_json_document_int_facet_keys():
+    # Chiavi intere (annate) serializzate come stringhe, come in dumps
+    document = {"facets": {"vintage": {2017: 3}}, "rows": [{"id": 1}], "meta": {}}
+    body = _streamed(document, 1)
+    assert body == dumps(document)
+    assert b'"2017":3' in body
+
+
+def test_iter_json_document_rows_not_first():
+    # L'ordine delle chiavi del documento è mantenuto
+    document = {"meta": {"total_rows": 2}, "rows": [{"id": 1}, {"id": 2}], "facets": {}}
+    assert _streamed(document, 1) == dumps(document)
+
+
+@pytest.mark.parametrize("backend", list(serializers.available_backends()))
+def test_backends_produce_same_json(backend):
+    # Tutti i backend installati sono intercambiabili (stesso JSON compatto)
+    document = _snapshot(7)
+    encoded = serializers.available_backends()[backend](document)
+    assert json.loads(encoded) == json.loads(dumps(document))
+
+
+@pytest.mark.parametrize("backend", list(serializers.available_backends()))
+def test_backends_handle_db_types(backend):
+    # datetime, date, Decimal e UUID (valori asyncpg) producono lo stesso JSON su ogni backend
+    document = {
+        "updated_at": datetime(2024, 1, 2, 10, 30, 0, 123),
+        "updated_utc": datetime(2024, 1, 2, 10, 30, tzinfo=timezone.utc),
+        "day": date(2024, 1, 2),
+        "price": Decimal("49.90"),
+        "ref": uuid.UUID(int=1)
+    }
+    encoded = serializers.available_backends()[backend](document)
+    assert json.loads(encoded) == {
+        "updated_at": "2024-01-02T10:30:00.000123",
+        "updated_utc": "2024-01-02T10:30:00+00:00",
+        "day": "2024-01-02",
+        "price": 49.9,
+        "ref": "00000000-0000-0000-0000-000000000001"
+    }
+
+
+def test_unsupported_type_raises():
+    with pytest.raises(TypeError):
+        dumps({"value": object()})
+
+
+def _decode_columnar(document):
+    # Stessa logica di decodeColumnarSnapshot (app.js)
+    columns = document["columns"]
+    count = len(document["values"][0]) if columns else 0
+    rows = []
+    for i in range(count):
+        row = {}
+        for index, column in enumerate(columns):
+            value = document["values"][index][i]
+            dictionary = document["dictionaries"].get(column)
+            row[column] = dictionary[value] if dictionary is not None and value is not None else value
+        rows.append(row)
+    return rows
+
+
+def test_to_columnar_round_trip():
+    rows = [
+        {"id": 1, "name": "Barolo", "winery": "Gaja", "type": "Rosso", "classification": None,
+         "updated_at": "2024-01-01T10:00:00"},
+        {"id": 2, "name": "Soave", "winery": None, "type": "Bianco", "classification": "DOC",
+         "updated_at": "2024-01-02T10:00:00"},
+        {"id": 3, "name": "Barbaresco", "winery": "Gaja", "type": "Rosso", "classification": None,
+         "updated_at": None}
+    ]
+    document = {"rows": rows, "facets": {"type": {"Rosso": 2, "Bianco": 1}}, "meta": {"total_rows": 3}}
+    columnar = to_columnar(document)
+    
+    assert columnar["format"] == "columnar"
+    # id e updated_at restano colonne normali (non nel dizionario)
+    assert "id" in columnar["columns"] and "updated_at" in columnar["columns"]
+    assert "id" not in columnar["dictionaries"] and "updated_at" not in columnar["dictionaries"]
+    assert columnar["dictionaries"]["winery"] == ["Gaja"]
+    # None resta null, non diventa un indice del dizionario
+    winery = columnar["values"][columnar["columns"].index("winery")]
+    assert winery == [0, None, 0]
+    assert None not in columnar["dictionaries"]["classification"]
+    
+    assert columnar["facets"] == document["facets"] and columnar["meta"] == document["meta"]
+    assert "rows" not in columnar
+    assert _decode_columnar(columnar) == rows
+    # Il documento originale (condiviso con la cache) non viene modificato
+    assert document["rows"] is rows and rows[0]["winery"] == "Gaja"
+
+
+def test_to_columnar_empty_rows():
+    columnar = to_columnar({"rows": [], "facets": {}, "meta": {"total_rows": 0}})
+    assert columnar["columns"] == [] and columnar["values"] == [] and columnar["dictionaries"] == {}
+    assert columnar["meta"] == {"total_rows": 0}
+    assert _decode_columnar(columnar) == []
+    assert dumps(columnar)
+
+
+@pytest.mark.parametrize("format_param, accept, expected", [
+    (None, None, False),
+    (None, "application/json", False),
+    (None, COLUMNAR_MEDIA_TYPE, True),
+    ("columnar", None, True),
+    ("COLUMNAR", "application/json", True),
+    ("json", COLUMNAR_MEDIA_TYPE, False)
+])
+def test_wants_columnar(format_param, accept, expected):
+    assert wants_columnar(format_param, accept) is expected
+
+
+def test_wants_columnar_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        wants_columnar("xml", None)
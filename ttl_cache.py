@@ -0,0 +1,137 @@
+"""
+Cache LRU in memoria con scadenza (TTL) e limite di dimensione
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Cache LRU thread-safe con TTL per voce.
+    
+    Le voci vengono rimosse quando scadono, quando si supera max_entries
+    (eviction della meno usata di recente) oppure quando la somma dei pesi
+    supera max_weight (es. righe o byte occupati).
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        max_entries: int,
+        ttl: float,
+        max_weight: Optional[int] = None
+    ):
+        """
+        Args:
+            name: Nome della cache (usato nelle statistiche)
+            max_entries: Numero massimo di voci
+            ttl: Secondi di validità di default (0 = cache disabilitata)
+            max_weight: Peso totale massimo (None = nessun limite)
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = OrderedDict()
+        self._weight = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Restituisce il valore se presente e non scaduto, altrimenti default"""
+        if not self.enabled:
+            return default
+        
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            
+            value, expires_at, weight = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None, weight: int = 1) -> None:
+        """
+        Inserisce o sostituisce una voce.
+        
+        Args:
+            key: Chiave
+            value: Valore da memorizzare
+            ttl: Secondi di validità (default: ttl della cache)
+            weight: Peso della voce ai fini di max_weight
+        """
+        if not self.enabled:
+            return
+        
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        
+        if self.max_weight is not None and weight > self.max_weight:
+            # Voce più grande dell'intera cache: non memorizzarla
+            return
+        
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            
+            self._data[key] = (value, time.monotonic() + ttl, weight)
+            self._weight += weight
+            
+            while len(self._data) > self.max_entries or (
+                self.max_weight is not None and self._weight > self.max_weight
+            ):
+                oldest_key = next(iter(self._data))
+                self._remove(oldest_key)
+                self.evictions += 1
+    
+    def invalidate(self, key: Hashable) -> bool:
+        """Rimuove una voce; restituisce True se era presente"""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                return True
+            return False
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche della cache (hit rate, dimensione, eviction)"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._data),
+                "weight": self._weight,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0
+            }
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def _remove(self, key: Hashable) -> None:
+        # Da chiamare con il lock acquisito
+        _, _, weight = self._data.pop(key)
+        self._weight -= weight
@@ -0,0 +1,230 @@
+"""
+Archivio delle pagine viewer generate (view_id -> HTML).
+
+Le pagine restano in memoria in una cache LRU limitata in byte e con
+scadenza (TTL). Se VIEW_CACHE_DB_PATH è configurato vengono salvate anche
+in un file SQLite: dopo un deploy o un riavvio i link view_id già inviati
+dal bot continuano a funzionare finché non scadono.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Validità di una pagina generata (secondi)
+VIEW_CACHE_TTL = float(os.getenv("VIEW_CACHE_TTL", 86400))
+# Byte massimi delle pagine tenute in memoria (somma dell'HTML UTF-8)
+VIEW_CACHE_MAX_BYTES = int(os.getenv("VIEW_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+VIEW_CACHE_MAX_ENTRIES = int(os.getenv("VIEW_CACHE_MAX_ENTRIES", 10000))
+# File SQLite per conservare le pagine tra un riavvio e l'altro (vuoto = solo memoria)
+VIEW_CACHE_DB_PATH = os.getenv("VIEW_CACHE_DB_PATH", "")
+# Byte massimi su disco: oltre vengono eliminate le pagine più vecchie
+VIEW_CACHE_DISK_MAX_BYTES = int(os.getenv("VIEW_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024))
+# Ogni quante scritture ripulire il disco dalle pagine scadute
+_PURGE_EVERY = 100
+
+
+class ViewCache:
+    """
+    Cache delle pagine generate: memoria (LRU a byte) più SQLite opzionale.
+    
+    Le scritture vanno sempre anche su disco (se abilitato); le letture
+    provano prima la memoria e, se la pagina non c'è più, il disco, da cui
+    la pagina viene ricaricata in memoria per le richieste successive.
+    """
+    
+    def __init__(
+        self,
+        ttl: float = VIEW_CACHE_TTL,
+        max_bytes: int = VIEW_CACHE_MAX_BYTES,
+        max_entries: int = VIEW_CACHE_MAX_ENTRIES,
+        db_path: str = VIEW_CACHE_DB_PATH,
+        disk_max_bytes: int = VIEW_CACHE_DISK_MAX_BYTES
+    ):
+        self.ttl = ttl
+        self.db_path = db_path
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = TTLCache("views", max_entries=max_entries, ttl=ttl, max_weight=max_bytes)
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._writes = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        
+        if db_path:
+            self._open_db()
+    
+    def _open_db(self) -> None:
+        try:
+            directory = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS views ("
+                " view_id TEXT PRIMARY KEY,"
+                " html BLOB NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS views_expires_at ON views (expires_at)")
+            logger.info(f"[VIEW_CACHE] Archivio su disco attivo: {self.db_path}")
+        except sqlite3.Error as e:
+            # Senza disco la cache funziona comunque in memoria
+            logger.error(f"[VIEW_CACHE] Impossibile aprire {self.db_path}, uso solo memoria: {e}")
+            self._db = None
+    
+    def put(self, view_id: str, html: str, ttl: Optional[float] = None) -> float:
+        """
+        Salva una pagina generata.
+        
+        Args:
+            view_id: Identificativo della pagina
+            html: HTML completo
+            ttl: Secondi di validità (default VIEW_CACHE_TTL)
+        
+        Returns:
+            Timestamp (epoch) di scadenza
+        """
+        ttl = self.ttl if ttl is None else ttl
+        body = html.encode('utf-8')
+        now = time.time()
+        expires_at = now + ttl
+        
+        self._memory.set(view_id, body, ttl=ttl, weight=len(body))
+        
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO views (view_id, html, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                        (view_id, body, now, expires_at)
+                    )
+                    self._writes += 1
+                    if self._writes % _PURGE_EVERY == 0:
+                        self._purge_locked(now)
+            except sqlite3.Error as e:
+                logger.error(f"[VIEW_CACHE] Errore scrittura su disco per view_id={view_id}: {e}")
+        
+        return expires_at
+    
+    def get(self, view_id: str) -> Optional[str]:
+        """Restituisce l'HTML della pagina, None se sconosciuta o scaduta"""
+        body = self._memory.get(view_id)
+        if body is not None:
+            return body.decode('utf-8')
+        
+        if self._db is None:
+            return None
+        
+        now = time.time()
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT html, expires_at FROM views WHERE view_id = ? AND expires_at > ?",
+                    (view_id, now)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"[VIEW_CACHE] Errore lettura da disco per view_id={view_id}: {e}")
+            return None
+        
+        if row is None:
+            self.disk_misses += 1
+            return None
+        
+        self.disk_hits += 1
+        body, expires_at = bytes(row[0]), row[1]
+        # Ricarica in memoria per il tempo di validità rimanente
+        self._memory.set(view_id, body, ttl=expires_at - now, weight=len(body))
+        return body.decode('utf-8')
+    
+    def invalidate(self, view_id: str) -> None:
+        self._memory.invalidate(view_id)
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    self._db.execute("DELETE FROM views WHERE view_id = ?", (view_id,))
+            except sqlite3.Error as e:
+                logger.error(f"[VIEW_CACHE] Errore eliminazione view_id={view_id}: {e}")
+    
+    def purge(self) -> int:
+        """Elimina dal disco le pagine scadute e quelle oltre disk_max_bytes; restituisce quante"""
+        if self._db is None:
+            return 0
+        try:
+            with self._db_lock:
+                return self._purge_locked(time.time())
+        except sqlite3.Error as e:
+            logger.error(f"[VIEW_CACHE] Errore pulizia archivio su disco: {e}")
+            return 0
+    
+    def _purge_locked(self, now: float) -> int:
+        # Da chiamare con _db_lock acquisito
+        removed = self._db.execute("DELETE FROM views WHERE expires_at <= ?", (now,)).rowcount
+        
+        total = self._db.execute("SELECT COALESCE(SUM(length(html)), 0) FROM views").fetchone()[0]
+        if total > self.disk_max_bytes:
+            # Elimina le pagine più vecchie fino a rientrare nel limite
+            excess = total - self.disk_max_bytes
+            freed = 0
+            oldest = self._db.execute("SELECT view_id, length(html) FROM views ORDER BY created_at").fetchall()
+            stale_ids = []
+            for view_id, size in oldest:
+                if freed >= excess:
+                    break
+                stale_ids.append((view_id,))
+                freed += size
+            self._db.executemany("DELETE FROM views WHERE view_id = ?", stale_ids)
+            removed += len(stale_ids)
+        
+        if removed:
+            logger.info(f"[VIEW_CACHE] Pulizia archivio su disco: {removed} pagine eliminate")
+        return removed
+    
+    def stats(self) -> Dict[str, Any]:
+        """Statistiche: memoria (hit rate, byte, eviction) e disco"""
+        memory = self._memory.stats()
+        result: Dict[str, Any] = {"memory": memory, "disk_enabled": self._db is not None}
+        
+        if self._db is not None:
+            try:
+                with self._db_lock:
+                    entries, size = self._db.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(length(html)), 0) FROM views"
+                    ).fetchone()
+                result.update(disk_entries=entries, disk_bytes=size)
+            except sqlite3.Error:
+                pass
+            result.update(disk_hits=self.disk_hits, disk_misses=self.disk_misses)
+        
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.disk_hits
+        result["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return result
+    
+    def close(self) -> None:
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+                self._db = None
+
+
+_view_cache: Optional[ViewCache] = None
+_view_cache_lock = threading.Lock()
+
+
+def get_view_cache() -> ViewCache:
+    """Cache condivisa dal processo (creata alla prima richiesta)"""
+    global _view_cache
+    if _view_cache is None:
+        with _view_cache_lock:
+            if _view_cache is None:
+                _view_cache = ViewCache()
+    return _view_cache
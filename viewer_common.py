@@ -0,0 +1,361 @@
+"""
+Funzioni condivise dai front end HTTP del viewer (http.server e aiohttp)
+"""
+import os
+import re
+import csv
+import io
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import TYPE_CHECKING, Optional, List, Mapping, Dict, Any, Tuple
+
+from compression import compress, choose_encoding, supported_encodings
+
+if TYPE_CHECKING:  # static_assets importa questo modulo
+    from static_assets import StaticAsset
+
+logger = logging.getLogger(__name__)
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+INDEX_PATH = os.path.join(DIRECTORY, 'index.html')
+DEFAULT_API_BASE = 'https://gioia-processor-production.up.railway.app'
+
+# Attributi src/href verso file locali (esclusi URL assoluti, data: e ancore)
+_LOCAL_ASSET_RE = re.compile(r'\b(src|href)="(?!https?:|//|data:|mailto:|#)([^"?#]+)"')
+
+# Headers CSV export
+CSV_HEADERS = ['Nome', 'Cantina', 'Fornitore', 'Annata', 'Quantità', 'Prezzo (€)', 'Tipo', 'Scorta Critica']
+
+
+def normalize_api_base(url: str) -> str:
+    """Normalizza URL aggiungendo https:// se manca il protocollo"""
+    if not url:
+        return DEFAULT_API_BASE
+    url = url.strip()
+    if not url.startswith(("http://", "https://")):
+        url = f"https://{url}"
+    return url
+
+
+def get_api_base() -> str:
+    """Legge API_BASE da variabile ambiente (default se non configurata)"""
+    return normalize_api_base(os.getenv('API_BASE', DEFAULT_API_BASE))
+
+
+def inject_viewer_config(content: str, api_base: str) -> str:
+    """
+    Inietta window.VIEWER_CONFIG nell'HTML di index.html.
+    
+    IMPORTANTE: lo script deve essere PRIMA di app.js per essere disponibile.
+    
+    Args:
+        content: HTML originale
+        api_base: URL base API da esporre al frontend
+    
+    Returns:
+        HTML con configurazione iniettata
+    """
+    config_script = f'''
+<script>
+    // Configurazione iniettata dal server (deve essere PRIMA di app.js)
+    window.VIEWER_CONFIG = {{
+        apiBase: "{api_base}"
+    }};
+    console.log("[VIEWER_CONFIG] Configurazione iniettata dal server:", window.VIEWER_CONFIG);
+    console.log("[VIEWER_CONFIG] API Base URL:", "{api_base}");
+</script>
+'''
+
+    # Inserisci lo script prima di </head> (deve essere prima di app.js)
+    if '</head>' in content:
+        # Inserisci prima della chiusura di </head>
+        content = content.replace('</head>', config_script + '</head>')
+        logger.debug("[SERVER] Configurazione inserita prima di </head>")
+    elif '<script' in content:
+        # Se non c'è </head>, inserisci prima del primo script
+        first_script_pos = content.find('<script')
+        content = content[:first_script_pos] + config_script + content[first_script_pos:]
+        logger.debug("[SERVER] Configurazione inserita prima del primo <script>")
+    else:
+        # Ultimo fallback: prima di <body>
+        content = content.replace('<body>', config_script + '<body>')
+        logger.debug("[SERVER] Configurazione inserita prima di <body>")
+    
+    return content
+
+
+def inject_snapshot_data(content: str, snapshot: Dict[str, Any]) -> str:
+    """
+    Inietta lo snapshot inventario (window.VIEWER_SNAPSHOT) in una pagina generata.
+    
+    Usato per le pagine servite tramite view_id, che non hanno un token nell'URL.
+    
+    Args:
+        content: HTML con configurazione già iniettata
+        snapshot: Snapshot (righe o formato colonnare di serializers.to_columnar)
+    
+    Returns:
+        HTML con i dati inclusi
+    """
+    # "</" non deve chiudere il tag <script> se compare nei dati
+    data = json.dumps(snapshot).replace('</', '<\\/')
+    snapshot_script = f'<script>window.VIEWER_SNAPSHOT = {data};</script>\n'
+    
+    if '</head>' in content:
+        return content.replace('</head>', snapshot_script + '</head>', 1)
+    return snapshot_script + content
+
+
+def build_index_html() -> Optional[str]:
+    """
+    Legge index.html e inietta la configurazione API.
+    
+    Returns:
+        HTML pronto da servire, None se index.html non esiste
+    """
+    if not os.path.exists(INDEX_PATH):
+        logger.error(f"[SERVER] index.html non trovato in {INDEX_PATH}")
+        return None
+    
+    # Leggi index.html
+    with open(INDEX_PATH, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    api_base = get_api_base()
+    content = inject_viewer_config(content, api_base)
+    logger.debug(f"[SERVER] Configurazione iniettata in index.html: apiBase={api_base}")
+    
+    return content
+
+
+def fingerprint_asset_urls(content: str) -> Tuple[str, List['StaticAsset']]:
+    """
+    Aggiunge ?v=<hash> agli asset locali referenziati dall'HTML (app.js, styles.css, ...).
+    
+    Returns:
+        (HTML riscritto, asset versionati)
+    """
+    from static_assets import get_static_store
+    store = get_static_store()
+    assets: List['StaticAsset'] = []
+    
+    def _rewrite(match: 're.Match') -> str:
+        attribute, url = match.group(1), match.group(2)
+        path = store.resolve(url)
+        # Controllo su disco forzato: l'hash deve corrispondere al file attuale
+        asset = store.get(path, revalidate=True) if path is not None else None
+        if asset is None:
+            return match.group(0)
+        assets.append(asset)
+        return f'{attribute}="{url}?v={asset.fingerprint}"'
+    
+    return _LOCAL_ASSET_RE.sub(_rewrite, content), assets
+
+
+class IndexPage:
+    """
+    index.html pronto da servire: configurazione iniettata, asset versionati e
+    varianti compresse calcolate una sola volta.
+    """
+    
+    def __init__(self, html: str, sources: Dict[str, Optional[Tuple[int, int]]]):
+        self.html = html
+        self.sources = sources
+        body = html.encode('utf-8')
+        digest = hashlib.sha256(body).hexdigest()[:20]
+        
+        # Una variante (e un ETag forte) per codifica
+        self._variants: Dict[Optional[str], Tuple[bytes, str]] = {None: (body, f'"{digest}"')}
+        for encoding in supported_encodings():
+            self._variants[encoding] = (compress(body, encoding, best=True), f'"{digest}-{encoding}"')
+        
+        mtimes = [signature[0] for signature in sources.values() if signature is not None]
+        self.last_modified = datetime.fromtimestamp(max(mtimes) / 1e9, tz=timezone.utc) if mtimes else None
+    
+    def is_stale(self) -> bool:
+        """True se index.html o uno degli asset referenziati è cambiato su disco"""
+        from static_assets import file_signature
+        return any(file_signature(path) != signature for path, signature in self.sources.items())
+    
+    def variant(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str], str]:
+        """(body, codifica o None, ETag) per il client"""
+        encoding = choose_encoding(accept_encoding)
+        body, etag = self._variants.get(encoding) or self._variants[None]
+        return body, encoding if encoding in self._variants else None, etag
+
+
+_index_page: Optional[IndexPage] = None
+_index_lock = threading.Lock()
+
+
+def get_index_page() -> Optional[IndexPage]:
+    """
+    index.html precalcolato, ricostruito solo quando i file cambiano.
+    
+    Returns:
+        Pagina pronta da servire, None se index.html non esiste
+    """
+    global _index_page
+    page = _index_page
+    if page is not None and not page.is_stale():
+        return page
+    
+    with _index_lock:
+        if _index_page is not None and not _index_page.is_stale():
+            return _index_page
+        
+        from static_assets import file_signature
+        # Firma letta prima del contenuto: una modifica durante la lettura forza un nuovo rebuild
+        index_signature = file_signature(INDEX_PATH)
+        content = build_index_html()
+        if content is None:
+            return None
+        
+        content, assets = fingerprint_asset_urls(content)
+        sources = {INDEX_PATH: index_signature}
+        for asset in assets:
+            # Firma del contenuto usato per l'hash: se il file cambia dopo, la pagina viene ricostruita
+            sources[asset.path] = asset.signature
+        
+        _index_page = IndexPage(content, sources)
+        logger.info(
+            f"[SERVER] index.html preparato: apiBase={get_api_base()}, {len(content)} caratteri, "
+            f"asset versionati={[os.path.basename(asset.path) for asset in assets]}"
+        )
+        return _index_page
+
+
+def encode_csv_rows(rows: List[list], include_headers: bool = False) -> bytes:
+    """
+    Codifica un blocco di righe CSV (già nell'ordine di CSV_HEADERS).
+    
+    Usata dall'export in streaming: ogni blocco letto dal database viene
+    codificato e inviato subito, senza costruire l'intero file in memoria.
+    
+    Args:
+        rows: Righe da codificare
+        include_headers: Se True antepone la riga di intestazione (primo blocco)
+    
+    Returns:
+        Blocco CSV codificato UTF-8
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, quoting=csv.QUOTE_MINIMAL)
+    
+    if include_headers:
+        writer.writerow(CSV_HEADERS)
+    
+    writer.writerows(rows)
+    return output.getvalue().encode('utf-8')
+
+
+def csv_export_filename(business_name: str) -> str:
+    """Genera nome file CSV con timestamp"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"inventario_{business_name.replace(' ', '_')}_{timestamp}.csv"
+
+
+def _optional_int(query: Mapping[str, str], name: str) -> Optional[int]:
+    value = query.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} deve essere un numero intero")
+
+
+def page_params_from_query(query: Mapping[str, str]) -> Dict[str, Any]:
+    """
+    Estrae i parametri di /api/inventory/page dalla query string.
+    
+    Args:
+        query: Parametri della richiesta (un valore per chiave)
+    
+    Returns:
+        Argomenti keyword per viewer_db.get_inventory_page
+    
+    Raises:
+        ValueError: Se limit o page non sono numeri interi
+    """
+    return {
+        "limit": _optional_int(query, 'limit'),
+        "page": _optional_int(query, 'page'),
+        "cursor": query.get('cursor') or None,
+        "sort": query.get('sort') or 'name',
+        "order": query.get('order') or 'asc',
+        "filters": {
+            "type": query.get('type'),
+            "vintage": query.get('vintage'),
+            "winery": query.get('winery'),
+            "supplier": query.get('supplier')
+        },
+        "search": query.get('search') or None
+    }
+
+
+def make_etag(version: str) -> str:
+    """ETag (weak) derivato dalla versione dell'inventario"""
+    digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Verifica If-None-Match (confronto weak, supporta liste e *)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    
+    def _opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith('W/') else tag
+    
+    target = _opaque(etag)
+    return any(_opaque(candidate) == target for candidate in if_none_match.split(','))
+
+
+def _as_utc(value: datetime) -> datetime:
+    # updated_at è salvato senza timezone: lo consideriamo UTC
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def http_date(value: datetime) -> str:
+    """Formatta una data per gli header HTTP (Last-Modified)"""
+    return format_datetime(_as_utc(value).replace(microsecond=0), usegmt=True)
+
+
+def not_modified_since(if_modified_since: Optional[str], last_modified: Optional[datetime]) -> bool:
+    """Verifica If-Modified-Since (precisione al secondo, come gli header HTTP)"""
+    if not if_modified_since or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since is None:
+        return False
+    return _as_utc(last_modified).replace(microsecond=0) <= _as_utc(since)
+
+
+def is_not_modified(
+    if_none_match: Optional[str],
+    if_modified_since: Optional[str],
+    etag: str,
+    last_modified: Optional[datetime]
+) -> bool:
+    """
+    Decide se rispondere 304 Not Modified.
+    
+    If-None-Match ha la precedenza: If-Modified-Since viene considerato solo
+    se il client non ha inviato un ETag (RFC 9110 §13.2.2).
+    """
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    return not_modified_since(if_modified_since, last_modified)
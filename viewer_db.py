@@ -3,10 +3,20 @@ Database utilities per viewer - chiamata diretta al database senza processor
 """
 import os
 import jwt
+import json
+import time
+import base64
+import hashlib
+import functools
+import asyncio
 import logging
 import asyncpg
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from ttl_cache import TTLCache
+from serializers import to_columnar
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +27,392 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ALGORITHM = "HS256"
 
+# Configurazione pool connessioni (condiviso da tutte le richieste del processo)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+# Secondi di inattività dopo cui una connessione del pool viene chiusa e ricreata
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300))
+# Numero di query dopo cui una connessione viene riciclata (0 = illimitato)
+DB_POOL_MAX_QUERIES = int(os.getenv("DB_POOL_MAX_QUERIES", 50000))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 30))
+# Prepared statement tenuti in cache per connessione (asyncpg) e loro durata massima in secondi
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 256))
+DB_STATEMENT_CACHE_LIFETIME = float(os.getenv("DB_STATEMENT_CACHE_LIFETIME", 1800))
+# Dopo questo periodo di inattività del pool la connessione viene verificata prima dell'uso
+DB_POOL_HEALTHCHECK_INTERVAL = float(os.getenv("DB_POOL_HEALTHCHECK_INTERVAL", 30))
+
+# Cache snapshot inventario in memoria (TTL in secondi, 0 = disabilitata)
+SNAPSHOT_CACHE_TTL = float(os.getenv("SNAPSHOT_CACHE_TTL", 30))
+SNAPSHOT_CACHE_MAX_ENTRIES = int(os.getenv("SNAPSHOT_CACHE_MAX_ENTRIES", 200))
+# Righe totali massime tenute in cache (somma su tutti gli inventari)
+SNAPSHOT_CACHE_MAX_ROWS = int(os.getenv("SNAPSHOT_CACHE_MAX_ROWS", 200000))
+
+# Delta inventario (/api/inventory/delta): per quanto tempo si ricordano gli id
+# presenti in ogni versione (servono a calcolare le righe eliminate)
+INVENTORY_ID_SET_TTL = float(os.getenv("INVENTORY_ID_SET_TTL", 3600))
+# Margine (secondi) sottratto a "since": copre le transazioni iniziate prima
+# dell'ultimo snapshot ma confermate dopo (updated_at = inizio transazione)
+INVENTORY_DELTA_OVERLAP_SECONDS = float(os.getenv("INVENTORY_DELTA_OVERLAP_SECONDS", 5))
+
+# Cache token JWT validati (chiave: sha256 del token, scadenza al più tardi a exp)
+JWT_CACHE_MAX_ENTRIES = int(os.getenv("JWT_CACHE_MAX_ENTRIES", 1000))
+JWT_CACHE_MAX_TTL = float(os.getenv("JWT_CACHE_MAX_TTL", 300))
+# Secondi per cui un token rifiutato non viene ridecodificato (0 = disabilitata)
+JWT_NEGATIVE_CACHE_TTL = float(os.getenv("JWT_NEGATIVE_CACHE_TTL", 60))
+
+# Cache telegram_id -> users.id (secondi, 0 = disabilitata)
+USER_ID_CACHE_TTL = float(os.getenv("USER_ID_CACHE_TTL", 600))
+USER_ID_CACHE_MAX_ENTRIES = int(os.getenv("USER_ID_CACHE_MAX_ENTRIES", 5000))
+
+# Righe lette dal cursore server-side per ogni blocco dell'export CSV in streaming
+CSV_EXPORT_BATCH_SIZE = int(os.getenv("CSV_EXPORT_BATCH_SIZE", 500))
+
+# Paginazione lato server (/api/inventory/page)
+INVENTORY_PAGE_DEFAULT_LIMIT = int(os.getenv("INVENTORY_PAGE_DEFAULT_LIMIT", 50))
+INVENTORY_PAGE_MAX_LIMIT = int(os.getenv("INVENTORY_PAGE_MAX_LIMIT", 500))
+
+# Canale Postgres NOTIFY per le modifiche all'inventario (vuoto = notifiche disattivate)
+INVENTORY_NOTIFY_CHANNEL = os.getenv("INVENTORY_NOTIFY_CHANNEL", "viewer_inventory_changes")
+
+# Numero massimo di vini per richiesta a /api/inventory/movements/batch
+MOVEMENTS_BATCH_MAX_WINES = int(os.getenv("MOVEMENTS_BATCH_MAX_WINES", 200))
+
+
+def _sql_trim(column: str) -> str:
+    # Come str.strip() di Python: rimuove spazi, tab e a capo
+    return f"btrim({column}, E' \\t\\n\\r')"
+
+
+def _sql_label(column: str) -> str:
+    # Stessa normalizzazione di winery/supplier nelle righe snapshot: vuoto, "null" o "none" -> "-"
+    trimmed = _sql_trim(f"COALESCE({column}, '')")
+    return f"CASE WHEN {trimmed} = '' OR lower({trimmed}) IN ('null', 'none') THEN '-' ELSE {trimmed} END"
+
+
+# Espressioni SQL equivalenti alla normalizzazione Python di get_inventory_snapshot
+_WINE_TYPE_TRIMMED = _sql_trim("COALESCE(wine_type, '')")
+SQL_WINE_TYPE = (
+    f"CASE WHEN {_WINE_TYPE_TRIMMED} = '' THEN 'Altro' "
+    f"ELSE upper(left({_WINE_TYPE_TRIMMED}, 1)) || lower(substr({_WINE_TYPE_TRIMMED}, 2)) END"
+)
+SQL_WINERY = _sql_label('producer')
+SQL_SUPPLIER = _sql_label('supplier')
+
+# Chiavi facet cantina/fornitore: valore con trim, NULL se vuoto o segnaposto
+# (a differenza delle righe il confronto con "null"/"None" è case-sensitive, come in origine)
+_FACET_EXCLUDED = "('-', '', 'null', 'None')"
+SQL_FACET_WINERY = f"CASE WHEN {_sql_trim('producer')} NOT IN {_FACET_EXCLUDED} THEN {_sql_trim('producer')} END"
+SQL_FACET_SUPPLIER = f"CASE WHEN {_sql_trim('supplier')} NOT IN {_FACET_EXCLUDED} THEN {_sql_trim('supplier')} END"
+
+# GROUPING(type, vintage, winery, supplier) -> facet del grouping set
+_FACET_GROUPING = {0b0111: "type", 0b1011: "vintage", 0b1101: "winery", 0b1110: "supplier"}
+
+# Ordinamenti consentiti per la paginazione: campo -> (espressione SQL mai NULL, tipo del valore nel cursore)
+PAGE_SORT_FIELDS = {
+    "name": ("COALESCE(NULLIF(name, ''), '-')", str),
+    "winery": (SQL_WINERY, str),
+    "supplier": (SQL_SUPPLIER, str),
+    "type": (SQL_WINE_TYPE, str),
+    "vintage": ("COALESCE(vintage, 0)", int),
+    "qty": ("COALESCE(quantity, 0)", int),
+    "price": ("COALESCE(selling_price, 0)", Decimal),
+    "updated_at": ("COALESCE(updated_at, 'epoch'::timestamp)", datetime.fromisoformat),
+}
+
+# Colonne lette per le righe del viewer (vedi _format_wine_row)
+WINE_COLUMNS = """
+                id,
+                name,
+                producer,
+                supplier,
+                vintage,
+                quantity,
+                selling_price,
+                cost_price,
+                wine_type,
+                grape_variety,
+                region,
+                country,
+                classification,
+                alcohol_content,
+                description,
+                notes,
+                min_quantity,
+                updated_at"""
+
+# Campi modificabili dal viewer (stesso set del processor): campo -> colonna
+ALLOWED_FIELDS = {
+    'producer': 'producer',
+    'supplier': 'supplier',
+    'vintage': 'vintage',
+    'grape_variety': 'grape_variety',
+    'classification': 'classification',
+    'selling_price': 'selling_price',
+    'cost_price': 'cost_price',
+    'alcohol_content': 'alcohol_content',
+    'description': 'description',
+    'notes': 'notes',
+}
+# Tipo SQL delle colonne non testuali (per gli array degli aggiornamenti in blocco)
+FIELD_SQL_TYPES = {
+    'vintage': 'integer',
+    'selling_price': 'numeric',
+    'cost_price': 'numeric',
+    'alcohol_content': 'numeric',
+}
+
+# Massimo numero di modifiche accettate da una singola richiesta update-fields
+BULK_UPDATE_MAX_CHANGES = int(os.getenv("BULK_UPDATE_MAX_CHANGES", 1000))
+
+
+def cast_field_value(field: str, value: Optional[str]):
+    """
+    Normalizza il valore di un campo modificabile (stessa logica del processor).
+    
+    Raises:
+        ValueError: Se il valore non è valido per il campo
+    """
+    if field == 'vintage':
+        try:
+            parsed = int(value)
+            if parsed < 1800 or parsed > 2100:
+                raise ValueError(f"Anno non valido: {parsed}")
+            return parsed
+        except (ValueError, TypeError):
+            raise ValueError(f"Anno non valido per {field}: '{value}'")
+    if field in ('selling_price', 'cost_price', 'alcohol_content'):
+        try:
+            parsed = float(str(value).replace(',', '.'))
+            if field == 'alcohol_content' and (parsed < 0 or parsed > 100):
+                raise ValueError(f"Gradazione alcolica non valida: {parsed}%")
+            if field in ('selling_price', 'cost_price') and parsed < 0:
+                raise ValueError(f"Prezzo non può essere negativo: {parsed}")
+            return parsed
+        except (ValueError, TypeError):
+            raise ValueError(f"Numero non valido per {field}: '{value}'")
+    # Per stringhe, rimuovi spazi eccessivi
+    return str(value).strip() if value else None
+
+
+class StaleWriteError(Exception):
+    """Il vino è stato modificato dopo la versione (updated_at) vista dal client"""
+    
+    def __init__(self, wine_id: int, current_updated_at: Optional[datetime]):
+        self.wine_id = wine_id
+        self.current_updated_at = current_updated_at
+        super().__init__(f"Vino con id {wine_id} modificato nel frattempo da un altro dispositivo")
+
+
+def parse_expected_updated_at(value: Any) -> Optional[datetime]:
+    """Converte l'updated_at inviato dal client (ISO 8601) per il controllo di concorrenza"""
+    if value in (None, ''):
+        return None
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value))
+        except ValueError:
+            raise ValueError(f"expected_updated_at non valido: '{value}'")
+    # updated_at è salvato senza timezone (UTC)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Query sulle tabelle per-tenant ("{telegram_id}/{business_name} ..."), per tipo.
+# Il testo SQL generato è identico a ogni richiesta dello stesso tenant, così
+# asyncpg riusa il prepared statement già pianificato sulla connessione invece
+# di ripreparare (e ripianificare) la query.
+_TENANT_QUERIES = {
+    "snapshot_rows": """
+        SELECT {columns}
+        FROM {inventory}
+        WHERE user_id = $1
+        ORDER BY name, vintage
+    """,
+    "delta_rows": """
+        SELECT {columns}
+        FROM {inventory}
+        WHERE user_id = $1
+        AND updated_at >= $2
+        ORDER BY name, vintage
+    """,
+    "row_ids": """
+        SELECT id FROM {inventory}
+        WHERE user_id = $1
+    """,
+    "version": """
+        SELECT COUNT(*) AS row_count, MAX(updated_at) AS last_updated_at
+        FROM {inventory}
+        WHERE user_id = $1
+    """,
+    "facets": """
+        WITH w AS (
+            SELECT
+                {wine_type} AS type,
+                vintage::text AS vintage,
+                {facet_winery} AS winery,
+                {facet_supplier} AS supplier,
+                updated_at
+            FROM {inventory}
+            WHERE user_id = $1
+        )
+        SELECT
+            GROUPING(type, vintage, winery, supplier) AS grouping_id,
+            COALESCE(type, vintage, winery, supplier) AS facet_key,
+            COUNT(*) AS count,
+            MAX(updated_at) AS last_updated_at
+        FROM w
+        GROUP BY GROUPING SETS ((type), (vintage), (winery), (supplier), ())
+        ORDER BY grouping_id, count DESC, facet_key
+    """,
+    "csv_rows": """
+        SELECT
+            COALESCE(NULLIF(name, ''), '-') AS name,
+            {winery} AS winery,
+            {supplier} AS supplier,
+            vintage,
+            COALESCE(quantity, 0) AS qty,
+            COALESCE(selling_price, 0)::float8 AS price,
+            {wine_type} AS wine_type,
+            (quantity IS NOT NULL AND min_quantity IS NOT NULL AND quantity <= min_quantity) AS critical
+        FROM {inventory}
+        WHERE user_id = $1
+        ORDER BY name, vintage
+    """,
+    "movements": """
+        SELECT 
+            movement_type,
+            quantity_change,
+            quantity_before,
+            quantity_after,
+            movement_date
+        FROM {movements}
+        WHERE user_id = $1
+        AND wine_name = $2
+        AND ($3::timestamp IS NULL OR movement_date >= $3::timestamp)
+        AND ($4::timestamp IS NULL OR movement_date < $4::timestamp)
+        ORDER BY movement_date ASC
+    """,
+    "movement_series": """
+        WITH bucketed AS (
+            SELECT
+                date_trunc($3, movement_date) AS bucket,
+                movement_type,
+                quantity_change,
+                quantity_before,
+                quantity_after,
+                row_number() OVER (
+                    PARTITION BY date_trunc($3, movement_date) ORDER BY movement_date ASC
+                ) AS first_in_bucket,
+                row_number() OVER (
+                    PARTITION BY date_trunc($3, movement_date) ORDER BY movement_date DESC
+                ) AS last_in_bucket
+            FROM {movements}
+            WHERE user_id = $1
+            AND wine_name = $2
+            AND movement_date IS NOT NULL
+            AND ($4::timestamp IS NULL OR movement_date >= $4::timestamp)
+            AND ($5::timestamp IS NULL OR movement_date < $5::timestamp)
+        )
+        SELECT
+            bucket,
+            COUNT(*) AS movements,
+            COALESCE(SUM(abs(quantity_change)) FILTER (WHERE movement_type = 'consumo'), 0) AS consumed,
+            COALESCE(SUM(abs(quantity_change)) FILTER (WHERE movement_type <> 'consumo'), 0) AS restocked,
+            MAX(quantity_before) FILTER (WHERE first_in_bucket = 1) AS quantity_start,
+            MAX(quantity_after) FILTER (WHERE last_in_bucket = 1) AS quantity_end
+        FROM bucketed
+        GROUP BY bucket
+        ORDER BY bucket ASC
+    """,
+    "movements_batch": """
+        SELECT 
+            wine_name,
+            movement_type,
+            quantity_change,
+            quantity_before,
+            quantity_after,
+            movement_date
+        FROM {movements}
+        WHERE user_id = $1
+        AND wine_name = ANY($2::text[])
+        ORDER BY wine_name, movement_date ASC
+    """,
+    "movements_all": """
+        SELECT 
+            wine_name,
+            movement_type,
+            quantity_change,
+            quantity_before,
+            quantity_after,
+            movement_date
+        FROM {movements}
+        WHERE user_id = $1
+        ORDER BY wine_name, movement_date ASC
+    """,
+    "update_field": """
+        WITH target AS (
+            SELECT id, updated_at FROM {inventory}
+            WHERE id = $2 AND user_id = $3
+        ), updated AS (
+            UPDATE {inventory}
+            SET {column} = $1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = $2 AND user_id = $3
+            AND ($4::timestamp IS NULL OR updated_at = $4::timestamp)
+            RETURNING id, updated_at
+        )
+        SELECT
+            target.updated_at AS current_updated_at,
+            updated.id IS NOT NULL AS applied,
+            updated.updated_at AS new_updated_at,
+            CASE WHEN updated.id IS NOT NULL AND $5::text <> '' THEN pg_notify($5, $6) END AS notified
+        FROM target
+        LEFT JOIN updated ON updated.id = target.id
+    """,
+    "lock_versions": """
+        SELECT id, updated_at FROM {inventory}
+        WHERE id = ANY($1::integer[]) AND user_id = $2
+        FOR UPDATE
+    """,
+    "bulk_update_field": """
+        UPDATE {inventory} AS t
+        SET {column} = v.value, updated_at = CURRENT_TIMESTAMP
+        FROM unnest($1::integer[], $2::{column_type}[]) AS v(id, value)
+        WHERE t.id = v.id AND t.user_id = $3
+        RETURNING t.id, t.updated_at
+    """,
+}
+
+
+def _inventory_table(telegram_id: int, business_name: str) -> str:
+    return f'"{telegram_id}/{business_name} INVENTARIO"'
+
+
+def _movements_table(telegram_id: int, business_name: str) -> str:
+    return f'"{telegram_id}/{business_name} Consumi e rifornimenti"'
+
+
+@functools.lru_cache(maxsize=4096)
+def _tenant_query(kind: str, telegram_id: int, business_name: str, column: str = "") -> str:
+    """
+    Testo SQL della query kind per il tenant, costruito una sola volta.
+    
+    column è usato solo dalle query che aggiornano una colonna (già validata
+    contro i campi consentiti).
+    """
+    return _TENANT_QUERIES[kind].format(
+        inventory=_inventory_table(telegram_id, business_name),
+        movements=_movements_table(telegram_id, business_name),
+        columns=WINE_COLUMNS,
+        wine_type=SQL_WINE_TYPE,
+        winery=SQL_WINERY,
+        supplier=SQL_SUPPLIER,
+        facet_winery=SQL_FACET_WINERY,
+        facet_supplier=SQL_FACET_SUPPLIER,
+        column=column,
+        column_type=FIELD_SQL_TYPES.get(column, 'text')
+    )
+
 # Verifica configurazione all'avvio
 if not DATABASE_URL:
     logger.error("[VIEWER_DB] ❌ DATABASE_URL non configurata! Il viewer non funzionerà.")
@@ -31,27 +427,317 @@ else:
     logger.info("[VIEWER_DB] ✅ JWT_SECRET_KEY configurata correttamente")
 
 
+# Pool asyncpg condiviso (creato in modo lazy alla prima richiesta)
+_pool: Optional[asyncpg.Pool] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+_pool_lock: Optional[asyncio.Lock] = None
+_pool_last_used: float = 0.0
+
+# Snapshot per inventario, chiave (telegram_id, business_name)
+_snapshot_cache = TTLCache(
+    "snapshot",
+    max_entries=SNAPSHOT_CACHE_MAX_ENTRIES,
+    ttl=SNAPSHOT_CACHE_TTL,
+    max_weight=SNAPSHOT_CACHE_MAX_ROWS
+)
+# Facets per inventario (stessa chiave), aggiornabili indipendentemente dalle righe
+_facets_cache = TTLCache(
+    "facets",
+    max_entries=SNAPSHOT_CACHE_MAX_ENTRIES,
+    ttl=SNAPSHOT_CACHE_TTL
+)
+# Snapshot in formato colonnare (stessa chiave), riusato finché la versione non cambia
+_columnar_cache = TTLCache(
+    "columnar",
+    max_entries=SNAPSHOT_CACHE_MAX_ENTRIES,
+    ttl=SNAPSHOT_CACHE_TTL,
+    max_weight=SNAPSHOT_CACHE_MAX_ROWS
+)
+# users.id per telegram_id: evita la query sugli utenti a ogni richiesta
+_user_id_cache = TTLCache("user_id", max_entries=USER_ID_CACHE_MAX_ENTRIES, ttl=USER_ID_CACHE_TTL)
+# Token JWT già validati e token rifiutati di recente
+_jwt_cache = TTLCache("jwt", max_entries=JWT_CACHE_MAX_ENTRIES, ttl=JWT_CACHE_MAX_TTL)
+_jwt_rejected_cache = TTLCache("jwt_rejected", max_entries=JWT_CACHE_MAX_ENTRIES, ttl=JWT_NEGATIVE_CACHE_TTL)
+# Id delle righe per versione inventario, chiave (telegram_id, business_name, version)
+_id_set_cache = TTLCache(
+    "id_sets",
+    max_entries=SNAPSHOT_CACHE_MAX_ENTRIES * 4,
+    ttl=INVENTORY_ID_SET_TTL,
+    max_weight=SNAPSHOT_CACHE_MAX_ROWS
+)
+# Generazione per inventario: incrementata a ogni invalidazione, evita che uno
+# snapshot letto prima di una scrittura venga salvato in cache dopo di essa
+_inventory_generations: Dict[tuple, int] = {}
+
+
+async def _create_pool() -> asyncpg.Pool:
+    """Crea il pool asyncpg con i parametri configurati da variabili ambiente"""
+    pool = await asyncpg.create_pool(
+        DATABASE_URL,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+        max_queries=DB_POOL_MAX_QUERIES,
+        command_timeout=DB_COMMAND_TIMEOUT,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_cached_statement_lifetime=DB_STATEMENT_CACHE_LIFETIME,
+    )
+    logger.info(
+        f"[VIEWER_DB] ✅ Pool connessioni creato: min_size={DB_POOL_MIN_SIZE}, "
+        f"max_size={DB_POOL_MAX_SIZE}, max_inactive_lifetime={DB_POOL_MAX_INACTIVE_LIFETIME}s"
+    )
+    return pool
+
+
+async def get_pool() -> Optional[asyncpg.Pool]:
+    """
+    Restituisce il pool condiviso, creandolo alla prima chiamata.
+    
+    Il pool è legato all'event loop in cui è stato creato: se il loop
+    proprietario è stato chiuso il pool viene scartato e ricreato; se
+    invece appartiene a un altro loop ancora attivo restituisce None e
+    il chiamante usa una connessione diretta.
+    
+    Returns:
+        Pool asyncpg utilizzabile nel loop corrente, oppure None
+    """
+    global _pool, _pool_loop, _pool_lock
+    
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    loop = asyncio.get_running_loop()
+    
+    if _pool is not None and _pool_loop is loop:
+        return _pool
+    
+    if _pool is not None and _pool_loop is not None and not _pool_loop.is_closed():
+        return None
+    
+    if _pool is not None:
+        logger.debug("[VIEWER_DB] Event loop del pool chiuso, ricreo il pool connessioni")
+        try:
+            _pool.terminate()
+        except Exception as e:
+            logger.debug(f"[VIEWER_DB] Errore terminando il vecchio pool: {e}")
+        _pool = None
+        _pool_loop = None
+        _pool_lock = None
+    
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    lock = _pool_lock
+    
+    async with lock:
+        if _pool is None:
+            _pool = await _create_pool()
+            _pool_loop = loop
+    
+    return _pool if _pool_loop is loop else None
+
+
+async def close_pool() -> None:
+    """Chiude il pool condiviso (da chiamare allo shutdown del server)"""
+    global _pool, _pool_loop, _pool_lock
+    
+    pool = _pool
+    _pool = None
+    _pool_loop = None
+    _pool_lock = None
+    
+    if pool is not None:
+        await pool.close()
+        logger.info("[VIEWER_DB] Pool connessioni chiuso")
+
+
+@asynccontextmanager
+async def _acquire() -> AsyncIterator[asyncpg.Connection]:
+    """
+    Acquisisce una connessione dal pool condiviso.
+    
+    Se il pool è rimasto inattivo più di DB_POOL_HEALTHCHECK_INTERVAL secondi
+    la connessione viene verificata con SELECT 1 prima dell'uso: se il server
+    l'ha chiusa (restart Postgres, timeout proxy) il pool viene svuotato e
+    viene acquisita una connessione nuova.
+    """
+    global _pool_last_used
+    
+    pool = await get_pool()
+    
+    if pool is None:
+        # Pool legato a un altro event loop: fallback a connessione diretta
+        conn = await asyncpg.connect(
+            DATABASE_URL,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            max_cached_statement_lifetime=DB_STATEMENT_CACHE_LIFETIME
+        )
+        try:
+            yield conn
+        finally:
+            await conn.close()
+        return
+    
+    conn = await pool.acquire()
+    try:
+        idle_for = time.monotonic() - _pool_last_used
+        if conn.is_closed() or idle_for > DB_POOL_HEALTHCHECK_INTERVAL:
+            try:
+                await conn.fetchval("SELECT 1")
+            except (asyncpg.exceptions.ConnectionDoesNotExistError, asyncpg.exceptions.InterfaceError, OSError) as e:
+                logger.warning(f"[VIEWER_DB] Connessione del pool non valida, la sostituisco: {e}")
+                await pool.release(conn)
+                conn = None
+                await pool.expire_connections()
+                conn = await pool.acquire()
+        yield conn
+    finally:
+        _pool_last_used = time.monotonic()
+        if conn is not None:
+            await pool.release(conn)
+
+
+def _inventory_cache_key(telegram_id: int, business_name: str) -> tuple:
+    return (str(telegram_id), business_name)
+
+
+def inventory_change_payload(telegram_id: int, business_name: str, wine_ids: List[int]) -> str:
+    """
+    Payload JSON della notifica (pg_notify) per le righe modificate di un inventario.
+    
+    Il payload NOTIFY è limitato a 8000 byte: oltre, gli id vengono omessi
+    (i client ricaricano comunque le modifiche tramite delta).
+    """
+    payload = json.dumps({"telegram_id": str(telegram_id), "business_name": business_name, "ids": wine_ids})
+    if len(payload.encode('utf-8')) > 7900:
+        payload = json.dumps({"telegram_id": str(telegram_id), "business_name": business_name, "ids": None})
+    return payload
+
+
+def invalidate_inventory_cache(telegram_id: int, business_name: str) -> None:
+    """Invalida lo snapshot in cache di un inventario (da chiamare dopo ogni scrittura)"""
+    key = _inventory_cache_key(telegram_id, business_name)
+    _inventory_generations[key] = _inventory_generations.get(key, 0) + 1
+    _facets_cache.invalidate(key)
+    _columnar_cache.invalidate(key)
+    if _snapshot_cache.invalidate(key):
+        logger.debug(
+            f"[VIEWER_DB] Cache snapshot invalidata per telegram_id={telegram_id}, "
+            f"business_name={business_name}"
+        )
+
+
+async def _resolve_user_id(conn, telegram_id: int) -> Optional[int]:
+    """Restituisce users.id per telegram_id (dalla cache se possibile), None se l'utente non esiste"""
+    user_id = _user_id_cache.get(telegram_id)
+    if user_id is not None:
+        return user_id
+    
+    user_id = await conn.fetchval("SELECT id FROM users WHERE telegram_id = $1", telegram_id)
+    if user_id is not None:
+        _user_id_cache.set(telegram_id, user_id)
+    return user_id
+
+
+def invalidate_user_id_cache(telegram_id: Optional[int] = None) -> None:
+    """Invalida la risoluzione telegram_id -> user_id (tutta la cache se telegram_id è None)"""
+    if telegram_id is None:
+        _user_id_cache.clear()
+    else:
+        _user_id_cache.invalidate(telegram_id)
+
+
+async def _revalidate_user_id(conn, telegram_id: int, user_id: int) -> Optional[int]:
+    """
+    Riverifica un user_id che non ha trovato righe dell'inventario.
+    
+    Se l'utente è stato eliminato o ricreato (nuovo users.id) la voce in cache
+    non corrisponde più: viene invalidata invece di attendere la scadenza TTL.
+    
+    Returns:
+        user_id attuale, None se l'utente non esiste più
+    """
+    current = await conn.fetchval("SELECT id FROM users WHERE telegram_id = $1", telegram_id)
+    if current != user_id:
+        invalidate_user_id_cache(telegram_id)
+        logger.info(
+            f"[VIEWER_DB] user_id in cache non più valido per telegram_id={telegram_id}: "
+            f"{user_id} -> {current}"
+        )
+        if current is not None:
+            _user_id_cache.set(telegram_id, current)
+    return current
+
+
+def _inventory_version(row_count: int, last_updated_at: Optional[datetime]) -> str:
+    """Versione inventario: cambia se cambia il numero di righe o l'ultimo updated_at"""
+    return f"{row_count}-{last_updated_at.isoformat() if last_updated_at else '0'}"
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Statistiche delle cache in memoria di viewer_db"""
+    return {
+        "snapshot": _snapshot_cache.stats(),
+        "columnar": _columnar_cache.stats(),
+        "facets": _facets_cache.stats(),
+        "user_id": _user_id_cache.stats(),
+        "jwt": _jwt_cache.stats(),
+        "jwt_rejected": _jwt_rejected_cache.stats(),
+        "id_sets": _id_set_cache.stats()
+    }
+
+
+def _token_cache_key(token: str) -> str:
+    # Il token non viene tenuto in memoria in chiaro
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
 def validate_viewer_token(token: str) -> Optional[Dict[str, Any]]:
     """
     Valida token JWT per viewer.
     
+    I token validi restano in cache fino a exp (al massimo JWT_CACHE_MAX_TTL
+    secondi), quelli rifiutati per JWT_NEGATIVE_CACHE_TTL secondi: una
+    sessione del viewer riusa lo stesso token per molte richieste e viene
+    decodificato una sola volta.
+    
     Args:
         token: Token JWT da validare
         
     Returns:
         Dict con telegram_id e business_name se valido, None se non valido o scaduto
     """
+    if not token:
+        logger.warning("[JWT_VALIDATE] Token vuoto")
+        return None
+    
+    cache_key = _token_cache_key(token)
+    cached = _jwt_cache.get(cache_key)
+    if cached is not None:
+        return dict(cached)
+    if _jwt_rejected_cache.get(cache_key) is not None:
+        logger.debug("[JWT_VALIDATE] Token già rifiutato di recente (cache)")
+        return None
+    
+    token_data = _decode_viewer_token(token)
+    if token_data is None:
+        _jwt_rejected_cache.set(cache_key, True)
+        return None
+    
+    exp = token_data.pop("exp", None)
+    ttl = JWT_CACHE_MAX_TTL
+    if exp is not None:
+        ttl = min(ttl, float(exp) - time.time())
+    _jwt_cache.set(cache_key, token_data, ttl=ttl)
+    return dict(token_data)
+
+
+def _decode_viewer_token(token: str) -> Optional[Dict[str, Any]]:
+    """Decodifica e verifica il token JWT (senza cache); include exp se presente"""
     try:
-        if not token:
-            logger.warning("[JWT_VALIDATE] Token vuoto")
-            return None
-        
         # Log dettagliato per debug
-        logger.info(f"[JWT_VALIDATE] Inizio validazione token, length={len(token)}")
-        logger.debug(f"[JWT_VALIDATE] Token (primi 50 char): {token[:50]}...")
+        logger.debug(f"[JWT_VALIDATE] Inizio validazione token, length={len(token)}")
         logger.debug(f"[JWT_VALIDATE] JWT_SECRET_KEY configurata: {bool(JWT_SECRET_KEY)}")
-        logger.debug(f"[JWT_VALIDATE] JWT_SECRET_KEY length: {len(JWT_SECRET_KEY) if JWT_SECRET_KEY else 0}")
-        logger.debug(f"[JWT_VALIDATE] JWT_SECRET_KEY (primi 20 char): {JWT_SECRET_KEY[:20] if JWT_SECRET_KEY else 'None'}...")
         logger.debug(f"[JWT_VALIDATE] JWT_ALGORITHM: {JWT_ALGORITHM}")
         
         # Decodifica e valida token
@@ -79,7 +765,8 @@ def validate_viewer_token(token: str) -> Optional[Dict[str, Any]]:
         
         return {
             "telegram_id": telegram_id,
-            "business_name": business_name
+            "business_name": business_name,
+            "exp": payload.get("exp")
         }
         
     except jwt.ExpiredSignatureError as e:
@@ -105,161 +792,215 @@ def validate_viewer_token(token: str) -> Optional[Dict[str, Any]]:
         return None
 
 
-async def get_inventory_snapshot(telegram_id: int, business_name: str) -> Dict[str, Any]:
+def _format_wine_row(wine) -> Dict[str, Any]:
+    """Converte una riga della tabella INVENTARIO nel formato restituito al viewer"""
+    # Normalizza tipo vino per consistenza (come nei facets)
+    wine_type = wine['wine_type'] or "Altro"
+    wine_type_normalized = wine_type.strip()
+    if wine_type_normalized:
+        wine_type_normalized = wine_type_normalized[0].upper() + wine_type_normalized[1:].lower()
+    else:
+        wine_type_normalized = "Altro"
+    
+    # Normalizza winery (producer) - escludi valori vuoti/null
+    winery_value = wine['producer']
+    if winery_value:
+        winery_normalized = winery_value.strip()
+        if not winery_normalized or winery_normalized.lower() in ("null", "none"):
+            winery_normalized = "-"
+    else:
+        winery_normalized = "-"
+    
+    # Normalizza supplier (escludi valori vuoti/null)
+    supplier_value = wine['supplier']
+    if supplier_value:
+        supplier_normalized = supplier_value.strip()
+        if not supplier_normalized or supplier_normalized.lower() in ("null", "none"):
+            supplier_normalized = "-"
+    else:
+        supplier_normalized = "-"
+    
+    return {
+        "id": wine['id'],  # ID necessario per editing
+        "name": wine['name'] or "-",
+        "winery": winery_normalized,
+        "supplier": supplier_normalized,
+        "vintage": wine['vintage'],
+        "qty": wine['quantity'] or 0,
+        "price": float(wine['selling_price']) if wine['selling_price'] else 0.0,
+        "cost_price": float(wine['cost_price']) if wine.get('cost_price') else None,
+        "type": wine_type_normalized,
+        "grape_variety": wine.get('grape_variety'),
+        "region": wine.get('region'),
+        "country": wine.get('country'),
+        "classification": wine.get('classification'),
+        "alcohol_content": float(wine['alcohol_content']) if wine.get('alcohol_content') else None,
+        "description": wine.get('description'),
+        "notes": wine.get('notes'),
+        "min_quantity": wine.get('min_quantity'),
+        # Versione della riga per il controllo di concorrenza nelle modifiche
+        "updated_at": wine['updated_at'].isoformat() if wine.get('updated_at') else None,
+        "critical": wine['quantity']
+         is not None and wine['min_quantity'] is not None and wine['quantity'] <= wine['min_quantity']
+    }
+
+
+async def _query_facets(conn, telegram_id: int, business_name: str, user_id: int) -> tuple:
     """
-    Recupera snapshot inventario direttamente dal database.
+    Calcola i facets (type, vintage, winery, supplier) con una sola query GROUPING SETS.
+    
+    Stesse regole della sidebar filtri: type normalizzato come nelle righe,
+    annate NULL escluse, cantine/fornitori vuoti o segnaposto esclusi.
+    
+    Returns:
+        (facets, numero righe, ultimo updated_at)
+    """
+    facet_rows = await conn.fetch(_tenant_query("facets", telegram_id, business_name), user_id)
+    
+    facets = {"type": {}, "vintage": {}, "winery": {}, "supplier": {}}
+    row_count = 0
+    last_updated_at = None
+    for row in facet_rows:
+        facet = _FACET_GROUPING.get(row['grouping_id'])
+        if facet is None:
+            # Grouping set vuoto (): totale dell'inventario
+            row_count = row['count']
+            last_updated_at = row['last_updated_at']
+        elif row['facet_key'] is not None:
+            facets[facet][row['facet_key']] = row['count']
+    
+    return facets, row_count, last_updated_at
+
+
+async def get_inventory_facets(
+    telegram_id: int,
+    business_name: str,
+    version: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Recupera solo i facets dell'inventario, senza leggere le righe.
     
     Args:
         telegram_id: Telegram ID dell'utente
         business_name: Nome del business
+        version: Versione corrente dell'inventario; se indicata, facets in cache
+            con versione diversa vengono ricalcolati
         
     Returns:
-        Dict con rows, facets e meta
+        Dict con facets e meta (total_rows, version)
     """
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL non configurata")
     
-    conn = None
-    try:
-        # Connetti al database
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Nome tabella inventario
-        table_name = f'"{telegram_id}/{business_name} INVENTARIO"'
-        
-        # Verifica che utente esista
-        user_query = "SELECT id FROM users WHERE telegram_id = $1"
-        user_row = await conn.fetchrow(user_query, telegram_id)
+    cache_key = _inventory_cache_key(telegram_id, business_name)
+    cached = _facets_cache.get(cache_key)
+    if cached is not None:
+        if version is None or cached['meta']['version'] == version:
+            return cached
+        _facets_cache.invalidate(cache_key)
+    
+    generation = _inventory_generations.get(cache_key, 0)
+    
+    async with _acquire() as conn:
+        user_id = await _resolve_user_id(conn, telegram_id)
         
-        if not user_row:
+        if user_id is None:
             raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
         
-        user_id = user_row['id']
+        facets, row_count, last_updated_at = await _query_facets(conn, telegram_id, business_name, user_id)
+    
+    response = {
+        "facets": facets,
+        "meta": {
+            "total_rows": row_count,
+            "version": _inventory_version(row_count, last_updated_at)
+        }
+    }
+    
+    logger.info(
+        f"[VIEWER_DB] Facets recuperati: telegram_id={telegram_id}, business_name={business_name}, "
+        f"type={len(facets['type'])}, vintage={len(facets['vintage'])}, "
+        f"winery={len(facets['winery'])}, supplier={len(facets['supplier'])}"
+    )
+    
+    if _inventory_generations.get(cache_key, 0) == generation:
+        _facets_cache.set(cache_key, response)
+    
+    return response
+
+
+async def get_inventory_snapshot(
+    telegram_id: int,
+    business_name: str,
+    version: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Recupera snapshot inventario direttamente dal database.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        version: Versione corrente dell'inventario (da get_inventory_version);
+            se indicata, uno snapshot in cache con versione diversa viene scartato
         
+    Returns:
+        Dict con rows, facets e meta (condiviso con la cache: non modificarlo)
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    cache_key = _inventory_cache_key(telegram_id, business_name)
+    cached = _snapshot_cache.get(cache_key)
+    if cached is not None:
+        logger.debug(
+            f"[VIEWER_DB] Snapshot trovato in cache: rows={cached['meta']['total_rows']}, "
+            f"telegram_id={telegram_id}, business_name={business_name}"
+        )
+        if version is None or cached['meta'].get('version') == version:
+            if _id_set_cache.get(cache_key + (cached['meta']['version'],)) is None:
+                _remember_row_ids(telegram_id, business_name, cached['meta']['version'], (row['id'] for row in cached['rows']))
+            return cached
+        # Il database è cambiato dopo il caching (es. consumo registrato dal bot)
+        _snapshot_cache.invalidate(cache_key)
+    
+    generation = _inventory_generations.get(cache_key, 0)
+    
+    try:
         # Recupera tutti i vini con tutti i campi disponibili
-        wines_query = f"""
-            SELECT 
-                id,
-                name,
-                producer,
-                supplier,
-                vintage,
-                quantity,
-                selling_price,
-                cost_price,
-                wine_type,
-                grape_variety,
-                region,
-                country,
-                classification,
-                alcohol_content,
-                description,
-                notes,
-                min_quantity,
-                updated_at
-            FROM {table_name}
-            WHERE user_id = $1
-            ORDER BY name, vintage
-        """
-        
-        wines_rows = await conn.fetch(wines_query, user_id)
+        wines_query = _tenant_query("snapshot_rows", telegram_id, business_name)
         
-        # Formatta vini per risposta
-        rows = []
-        for wine in wines_rows:
-            # Normalizza tipo vino per consistenza (come nei facets)
-            wine_type = wine['wine_type'] or "Altro"
-            wine_type_normalized = wine_type.strip()
-            if wine_type_normalized:
-                wine_type_normalized = wine_type_normalized[0].upper() + wine_type_normalized[1:].lower()
-            else:
-                wine_type_normalized = "Altro"
+        # Connessione dal pool condiviso, rilasciata prima della formattazione
+        async with _acquire() as conn:
+            # Verifica che utente esista (user_id in cache tra le richieste)
+            user_id = await _resolve_user_id(conn, telegram_id)
             
-            # Normalizza winery (producer) - escludi valori vuoti/null
-            winery_value = wine['producer']
-            if winery_value:
-                winery_normalized = winery_value.strip()
-                if not winery_normalized or winery_normalized.lower() in ("null", "none"):
-                    winery_normalized = "-"
-            else:
-                winery_normalized = "-"
+            if user_id is None:
+                raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
             
-            # Normalizza supplier (escludi valori vuoti/null)
-            supplier_value = wine['supplier']
-            if supplier_value:
-                supplier_normalized = supplier_value.strip()
-                if not supplier_normalized or supplier_normalized.lower() in ("null", "none"):
-                    supplier_normalized = "-"
-            else:
-                supplier_normalized = "-"
+            wines_rows = await conn.fetch(wines_query, user_id)
+            if not wines_rows:
+                # Nessuna riga: il user_id in cache potrebbe non corrispondere più all'utente
+                current_user_id = await _revalidate_user_id(conn, telegram_id, user_id)
+                if current_user_id is None:
+                    raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+                if current_user_id != user_id:
+                    user_id = current_user_id
+                    wines_rows = await conn.fetch(wines_query, user_id)
             
-            rows.append({
-                "id": wine['id'],  # ID necessario per editing
-                "name": wine['name'] or "-",
-                "winery": winery_normalized,
-                "supplier": supplier_normalized,
-                "vintage": wine['vintage'],
-                "qty": wine['quantity'] or 0,
-                "price": float(wine['selling_price']) if wine['selling_price'] else 0.0,
-                "cost_price": float(wine['cost_price']) if wine.get('cost_price') else None,
-                "type": wine_type_normalized,
-                "grape_variety": wine.get('grape_variety'),
-                "region": wine.get('region'),
-                "country": wine.get('country'),
-                "classification": wine.get('classification'),
-                "alcohol_content": float(wine['alcohol_content']) if wine.get('alcohol_content') else None,
-                "description": wine.get('description'),
-                "notes": wine.get('notes'),
-                "min_quantity": wine.get('min_quantity'),
-                "critical": wine['quantity']
-                 is not None and wine['min_quantity'] is not None and wine['quantity'] <= wine['min_quantity']
-            })
-        
-        # Calcola facets (aggregazioni per filtri)
-        facets = {
-            "type": {},
-            "vintage": {},
-            "winery": {},
-            "supplier": {}
-        }
+            # Facets aggregati in Postgres sulla stessa connessione
+            facets, _, _ = await _query_facets(conn, telegram_id, business_name, user_id)
         
-        for wine in wines_rows:
-            # Tipo - normalizza per evitare duplicati (trim + capitalize)
-            wine_type = wine['wine_type'] or "Altro"
-            wine_type_normalized = wine_type.strip()
-            # Capitalizza prima lettera per consistenza (es. "spumante" -> "Spumante")
-            if wine_type_normalized:
-                wine_type_normalized = wine_type_normalized[0].upper() + wine_type_normalized[1:].lower()
-            else:
-                wine_type_normalized = "Altro"
-            facets["type"][wine_type_normalized] = facets["type"].get(wine_type_normalized, 0) + 1
-            
-            # Annata - normalizza come stringa per matching consistente
-            if wine['vintage'] is not None:
-                vintage_str = str(wine['vintage']).strip()
-                if vintage_str:  # Solo se non vuoto dopo strip
-                    facets["vintage"][vintage_str] = facets["vintage"].get(vintage_str, 0) + 1
-            
-            # Cantina (producer) - normalizza per matching case-insensitive
-            if wine['producer']:
-                producer_normalized = wine['producer'].strip()
-                # Escludi valori vuoti o placeholder
-                if producer_normalized and producer_normalized not in ("-", "", "null", "None"):
-                    facets["winery"][producer_normalized] = facets["winery"].get(producer_normalized, 0) + 1
-            
-            # Fornitore (supplier) - normalizza per evitare duplicati
-            if wine['supplier']:
-                supplier_normalized = wine['supplier'].strip()
-                # Escludi valori vuoti o placeholder
-                if supplier_normalized and supplier_normalized not in ("-", "", "null", "None"):
-                    facets["supplier"][supplier_normalized] = facets["supplier"].get(supplier_normalized, 0) + 1
+        # Formatta vini per risposta
+        rows = [_format_wine_row(wine) for wine in wines_rows]
         
         # Meta info
         last_update = None
+        last_updated_at = None
         if wines_rows:
             # Trova ultimo updated_at
             last_update_row = max(wines_rows, key=lambda w: w['updated_at'] if w['updated_at'] else datetime.min)
-            last_update = last_update_row['updated_at'].isoformat() if last_update_row['updated_at'] else datetime.utcnow().isoformat()
+            last_updated_at = last_update_row['updated_at']
+            last_update = last_updated_at.isoformat() if last_updated_at else datetime.utcnow().isoformat()
         else:
             last_update = datetime.utcnow().isoformat()
         
@@ -268,10 +1009,14 @@ async def get_inventory_snapshot(telegram_id: int, business_name: str) -> Dict[s
             "facets": facets,
             "meta": {
                 "total_rows": len(rows),
-                "last_update": last_update
+                "last_update": last_update,
+                "version": _inventory_version(len(wines_rows), last_updated_at)
             }
         }
         
+        # Id presenti in questa versione: base per i delta richiesti dal client
+        _remember_row_ids(telegram_id, business_name, response["meta"]["version"], (wine['id'] for wine in wines_rows))
+        
         logger.info(
             f"[VIEWER_DB] Snapshot recuperato: rows={len(rows)}, "
             f"telegram_id={telegram_id}, business_name={business_name}, "
@@ -280,78 +1025,548 @@ async def get_inventory_snapshot(telegram_id: int, business_name: str) -> Dict[s
             f"facets_winery_count={len(facets.get('winery', {}))}"
         )
         
+        if _inventory_generations.get(cache_key, 0) == generation:
+            _snapshot_cache.set(cache_key, response, weight=max(len(rows), 1))
+            _facets_cache.set(cache_key, {"facets": facets, "meta": {
+                "total_rows": len(rows),
+                "version": response["meta"]["version"]
+            }})
+        
         return response
         
     except Exception as e:
         logger.error(f"[VIEWER_DB] Errore recupero snapshot: {e}", exc_info=True)
         raise
-    finally:
-        if conn:
-            await conn.close()
 
 
-async def get_wine_movements(telegram_id: int, business_name: str, wine_name: str) -> List[Dict[str, Any]]:
+async def get_inventory_snapshot_columnar(
+    telegram_id: int,
+    business_name: str,
+    version: Optional[str] = None
+) -> Dict[str, Any]:
     """
-    Recupera movimenti (consumi e rifornimenti) per un vino specifico.
+    Snapshot in formato colonnare (serializers.to_columnar) per ?format=columnar.
+    
+    La conversione viene rifatta solo quando cambia la versione dell'inventario.
     
     Args:
-        telegram_id: ID Telegram utente
-        business_name: Nome business
-        wine_name: Nome del vino
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        version: Versione corrente dell'inventario (come per get_inventory_snapshot)
         
     Returns:
-        Lista di movimenti con date e quantità
+        Dict con columns, dictionaries, values, facets e meta (condiviso con la cache: non modificarlo)
     """
-    conn = None
+    snapshot = await get_inventory_snapshot(telegram_id, business_name, version=version)
+    
+    cache_key = _inventory_cache_key(telegram_id, business_name)
+    cached = _columnar_cache.get(cache_key)
+    if cached is not None and cached["meta"]["version"] == snapshot["meta"]["version"]:
+        return cached
+    
+    columnar = to_columnar(snapshot, "rows")
+    _columnar_cache.set(cache_key, columnar, weight=max(len(snapshot["rows"]), 1))
+    return columnar
+
+
+def _remember_row_ids(telegram_id: int, business_name: str, version: str, ids) -> frozenset:
+    row_ids = frozenset(ids)
+    _id_set_cache.set(
+        _inventory_cache_key(telegram_id, business_name) + (version,),
+        row_ids,
+        weight=max(len(row_ids), 1)
+    )
+    return row_ids
+
+
+async def get_inventory_delta(
+    telegram_id: int,
+    business_name: str,
+    since: str,
+    version: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Restituisce solo le modifiche all'inventario successive a uno snapshot.
+    
+    Le righe modificate sono quelle con updated_at >= since (meno
+    INVENTORY_DELTA_OVERLAP_SECONDS; il client le sostituisce per id, quindi
+    i duplicati sono innocui). Le righe eliminate si ricavano confrontando
+    gli id attuali con quelli della versione del client, ricordati quando è
+    stato servito lo snapshot o il delta precedente. Se quella versione non è
+    più nota la risposta ha meta.resync = true e il client deve ricaricare lo
+    snapshot completo.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        since: meta.last_update dello snapshot (o delta) del client
+        version: meta.version dello snapshot (o delta) del client
+    
+    Returns:
+        Dict con rows (modificate o nuove), deleted_ids, facets aggiornati e meta
+    
+    Raises:
+        ValueError: Se since non è una data valida o l'utente non esiste
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
     try:
-        if not DATABASE_URL:
-            raise ValueError("DATABASE_URL non configurata")
+        since_at = datetime.fromisoformat(since)
+    except (TypeError, ValueError):
+        raise ValueError(f"since non valido: '{since}'")
+    if since_at.tzinfo is not None:
+        since_at = since_at.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    cache_key = _inventory_cache_key(telegram_id, business_name)
+    known_ids = _id_set_cache.get(cache_key + (version,)) if version else None
+    
+    try:
+        async with _acquire() as conn:
+            user_id = await _resolve_user_id(conn, telegram_id)
+            
+            if user_id is None:
+                raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+            
+            # Facets, numero righe e ultimo updated_at in una query: danno la versione attuale
+            facets, row_count, last_updated_at = await _query_facets(conn, telegram_id, business_name, user_id)
+            current_version = _inventory_version(row_count, last_updated_at)
+            
+            changed_rows = []
+            current_ids = None
+            if current_version != version and known_ids is not None:
+                changed_rows = await conn.fetch(
+                    _tenant_query("delta_rows", telegram_id, business_name),
+                    user_id,
+                    since_at - timedelta(seconds=INVENTORY_DELTA_OVERLAP_SECONDS)
+                )
+                current_ids = [row['id'] for row in await conn.fetch(
+                    _tenant_query("row_ids", telegram_id, business_name),
+                    user_id
+                )]
         
-        conn = await asyncpg.connect(DATABASE_URL)
+        resync = current_version != version and known_ids is None
+        deleted_ids = []
+        if current_ids is not None:
+            deleted_ids = sorted(known_ids - _remember_row_ids(telegram_id, business_name, current_version, current_ids))
         
-        # Trova user_id
-        user_row = await conn.fetchrow(
-            "SELECT id FROM users WHERE telegram_id = $1",
-            telegram_id
+        response = {
+            "rows": [_format_wine_row(wine) for wine in changed_rows],
+            "deleted_ids": deleted_ids,
+            "facets": facets,
+            "meta": {
+                "total_rows": row_count,
+                "last_update": last_updated_at.isoformat() if last_updated_at else since_at.isoformat(),
+                "version": current_version,
+                "since": since,
+                "resync": resync
+            }
+        }
+        
+        logger.info(
+            f"[VIEWER_DB] Delta inventario: changed={len(changed_rows)}, deleted={len(deleted_ids)}, "
+            f"resync={resync}, telegram_id={telegram_id}, business_name={business_name}"
         )
         
-        if not user_row:
-            logger.warning(f"[VIEWER_DB] Utente {telegram_id} non trovato")
-            return []
+        return response
+        
+    except Exception as e:
+        logger.error(f"[VIEWER_DB] Errore delta inventario: {e}", exc_info=True)
+        raise
+
+
+def _encode_page_cursor(sort: str, order: str, sort_value: Any, wine_id: int) -> str:
+    """Cursore opaco (base64 url-safe) con la posizione dell'ultima riga restituita"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    elif isinstance(sort_value, Decimal):
+        sort_value = str(sort_value)
+    payload = json.dumps([sort, order, sort_value, wine_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_page_cursor(cursor: str, sort: str, order: str) -> tuple:
+    """Decodifica il cursore; ValueError se non valido o creato con un altro ordinamento"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, cursor_order, sort_value, wine_id = json.loads(base64.urlsafe_b64decode(padded))
+        value_type = PAGE_SORT_FIELDS[cursor_sort][1]
+        sort_value = value_type(sort_value)
+        wine_id = int(wine_id)
+    except Exception:
+        raise ValueError("Cursore non valido")
+    
+    if cursor_sort != sort or cursor_order != order:
+        raise ValueError("Il cursore appartiene a un ordinamento diverso")
+    return sort_value, wine_id
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+async def get_inventory_page(
+    telegram_id: int,
+    business_name: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    page: Optional[int] = None,
+    sort: str = "name",
+    order: str = "asc",
+    filters: Optional[Dict[str, Optional[str]]] = None,
+    search: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Recupera una sola pagina dell'inventario con filtri, ricerca e ordinamento in SQL.
+    
+    Stessa semantica di applyFilters in app.js: i filtri type/winery/supplier
+    confrontano i valori normalizzati senza distinzione maiuscole/minuscole,
+    vintage confronta la stringa dell'annata e search cerca (case-insensitive)
+    in nome, cantina, fornitore e annata.
+    
+    La paginazione è keyset su (campo di ordinamento, id) tramite cursor
+    (meta.next_cursor della pagina precedente); in alternativa page usa OFFSET
+    per saltare direttamente a una pagina numerata.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        limit: Righe per pagina (default INVENTORY_PAGE_DEFAULT_LIMIT, max INVENTORY_PAGE_MAX_LIMIT)
+        cursor: Cursore restituito dalla pagina precedente
+        page: Numero di pagina (1-based), ignorato se è presente cursor
+        sort: Campo di ordinamento (chiavi di PAGE_SORT_FIELDS)
+        order: "asc" o "desc"
+        filters: Dict con type, vintage, winery, supplier (valori None ignorati)
+        search: Testo da cercare
+        
+    Returns:
+        Dict con rows e meta (totali, paginazione, versione inventario)
+        
+    Raises:
+        ValueError: Parametri non validi o utente non trovato
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    if sort not in PAGE_SORT_FIELDS:
+        raise ValueError(f"Ordinamento non supportato: {sort}. Valori ammessi: {', '.join(PAGE_SORT_FIELDS)}")
+    order = (order or "asc").lower()
+    if order not in ("asc", "desc"):
+        raise ValueError("order deve essere 'asc' o 'desc'")
+    
+    limit = INVENTORY_PAGE_DEFAULT_LIMIT if limit is None else limit
+    if limit < 1 or limit > INVENTORY_PAGE_MAX_LIMIT:
+        raise ValueError(f"limit deve essere tra 1 e {INVENTORY_PAGE_MAX_LIMIT}")
+    if page is not None and page < 1:
+        raise ValueError("page deve essere >= 1")
+    
+    table_name = _inventory_table(telegram_id, business_name)
+    sort_expr = PAGE_SORT_FIELDS[sort][0]
+    
+    async with _acquire() as conn:
+        user_id = await _resolve_user_id(conn, telegram_id)
+        
+        if user_id is None:
+            raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+        
+        # Condizioni filtri/ricerca ($1 = user_id)
+        params: List[Any] = [user_id]
+        
+        def _param(value: Any) -> str:
+            params.append(value)
+            return f"${len(params)}"
+        
+        conditions = []
+        filters = filters or {}
+        for field, expr in (("type", SQL_WINE_TYPE), ("winery", SQL_WINERY), ("supplier", SQL_SUPPLIER)):
+            value = (filters.get(field) or "").strip()
+            if value:
+                conditions.append(f"lower({expr}) = lower({_param(value)})")
         
-        user_id = user_row['id']
+        vintage = (filters.get("vintage") or "").strip()
+        if vintage:
+            conditions.append(f"vintage::text = {_param(vintage)}")
+        
+        if search:
+            pattern = _param(f"%{_escape_like(search.strip())}%")
+            conditions.append(
+                f"(COALESCE(name, '') ILIKE {pattern} OR {SQL_WINERY} ILIKE {pattern} "
+                f"OR {SQL_SUPPLIER} ILIKE {pattern} OR vintage::text ILIKE {pattern})"
+            )
         
-        # Nome tabella consumi
-        table_consumi = f'"{telegram_id}/{business_name} Consumi e rifornimenti"'
+        filter_sql = " AND ".join(conditions) if conditions else "TRUE"
         
-        # Query movimenti per questo vino
-        movements_rows = await conn.fetch(
+        totals = await conn.fetchrow(
             f"""
-            SELECT 
-                movement_type,
-                quantity_change,
-                quantity_before,
-                quantity_after,
-                movement_date
-            FROM {table_consumi}
+            SELECT
+                COUNT(*) AS total_rows,
+                COUNT(*) FILTER (WHERE {filter_sql}) AS filtered_rows,
+                MAX(updated_at) AS last_updated_at
+            FROM {table_name}
             WHERE user_id = $1
-            AND wine_name = $2
-            ORDER BY movement_date ASC
             """,
-            user_id,
-            wine_name
+            *params
         )
         
+        # Keyset: righe successive alla posizione del cursore
+        page_conditions = list(conditions)
+        offset_sql = ""
+        if cursor:
+            sort_value, last_id = _decode_page_cursor(cursor, sort, order)
+            comparison = ">" if order == "asc" else "<"
+            page_conditions.append(f"({sort_expr}, id) {comparison} ({_param(sort_value)}, {_param(last_id)})")
+            page = None
+        elif page is not None and page > 1:
+            offset_sql = f"OFFSET {_param((page - 1) * limit)}"
+        
+        direction = "ASC" if order == "asc" else "DESC"
+        page_query = f"""
+            SELECT {WINE_COLUMNS},
+                {sort_expr} AS sort_key
+            FROM {table_name}
+            WHERE user_id = $1{''.join(' AND ' + c for c in page_conditions)}
+            ORDER BY sort_key {direction}, id {direction}
+            LIMIT {_param(limit + 1)}
+            {offset_sql}
+        """
+        wines_rows = await conn.fetch(page_query, *params)
+    
+    # Una riga in più indica che esiste una pagina successiva
+    has_more = len(wines_rows) > limit
+    wines_rows = wines_rows[:limit]
+    
+    next_cursor = None
+    if has_more:
+        last = wines_rows[-1]
+        next_cursor = _encode_page_cursor(sort, order, last['sort_key'], last['id'])
+    
+    filtered_rows = totals['filtered_rows']
+    last_updated_at = totals['last_updated_at']
+    
+    logger.info(
+        f"[VIEWER_DB] Pagina inventario recuperata: rows={len(wines_rows)}, "
+        f"filtered_rows={filtered_rows}, sort={sort} {order}, "
+        f"telegram_id={telegram_id}, business_name={business_name}"
+    )
+    
+    return {
+        "rows": [_format_wine_row(wine) for wine in wines_rows],
+        "meta": {
+            "total_rows": totals['total_rows'],
+            "filtered_rows": filtered_rows,
+            "limit": limit,
+            "page": page if page is not None else (None if cursor else 1),
+            "total_pages": (filtered_rows + limit - 1) // limit,
+            "has_more": has_more,
+            "next_cursor": next_cursor,
+            "sort": sort,
+            "order": order,
+            "last_update": last_updated_at.isoformat() if last_updated_at else None,
+            "version": _inventory_version(totals['total_rows'], last_updated_at)
+        }
+    }
+
+
+async def get_inventory_version(telegram_id: int, business_name: str) -> Dict[str, Any]:
+    """
+    Recupera la versione corrente dell'inventario con una sola query aggregata.
+    
+    Usata per le richieste condizionali (ETag / If-None-Match) senza leggere
+    tutte le righe.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        
+    Returns:
+        Dict con version, row_count e last_updated_at (datetime o None)
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    async with _acquire() as conn:
+        user_id = await _resolve_user_id(conn, telegram_id)
+        
+        if user_id is None:
+            raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+        
+        version_query = _tenant_query("version", telegram_id, business_name)
+        version_row = await conn.fetchrow(version_query, user_id)
+        if version_row['row_count'] == 0:
+            # Inventario vuoto: il user_id in cache potrebbe non corrispondere più all'utente
+            current_user_id = await _revalidate_user_id(conn, telegram_id, user_id)
+            if current_user_id is None:
+                raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+            if current_user_id != user_id:
+                version_row = await conn.fetchrow(version_query, current_user_id)
+    
+    row_count = version_row['row_count']
+    last_updated_at = version_row['last_updated_at']
+    
+    return {
+        "version": _inventory_version(row_count, last_updated_at),
+        "row_count": row_count,
+        "last_updated_at": last_updated_at
+    }
+
+
+async def iter_inventory_csv_rows(
+    telegram_id: int,
+    business_name: str,
+    batch_size: int = CSV_EXPORT_BATCH_SIZE
+) -> AsyncIterator[List[list]]:
+    """
+    Legge l'inventario per l'export CSV con un cursore server-side.
+    
+    Restituisce blocchi di righe già nel formato delle colonne CSV (stesso
+    ordine di viewer_common.CSV_HEADERS) senza caricare l'intero inventario
+    in memoria: la normalizzazione di tipo, cantina e fornitore è fatta in SQL
+    e facets/meta non vengono calcolati.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        batch_size: Righe per blocco
+        
+    Yields:
+        Liste di righe [nome, cantina, fornitore, annata, quantità, prezzo, tipo, scorta critica]
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    csv_query = _tenant_query("csv_rows", telegram_id, business_name)
+    
+    async with _acquire() as conn:
+        user_id = await _resolve_user_id(conn, telegram_id)
+        
+        if user_id is None:
+            raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+        
+        yielded = False
+        for attempt in (1, 2):
+            try:
+                # I cursori server-side richiedono una transazione
+                async with conn.transaction(readonly=True):
+                    batch = []
+                    async for record in conn.cursor(csv_query, user_id, prefetch=batch_size):
+                        batch.append([
+                            record['name'],
+                            record['winery'],
+                            record['supplier'],
+                            record['vintage'],
+                            record['qty'],
+                            record['price'],
+                            record['wine_type'],
+                            'Sì' if record['critical'] else 'No'
+                        ])
+                        if len(batch) >= batch_size:
+                            yielded = True
+                            yield batch
+                            batch = []
+                    
+                    if batch:
+                        yielded = True
+                        yield batch
+                return
+            except asyncpg.InvalidCachedStatementError:
+                # Tabella alterata dopo la preparazione: il cursore non passa dal retry
+                # automatico di asyncpg, svuotiamo le cache statement e riproviamo
+                if yielded or attempt == 2:
+                    raise
+                await conn.reload_schema_state()
+                logger.info("[VIEWER_DB] Prepared statement CSV invalidato (schema cambiato), nuovo tentativo")
+
+
+def _format_movement(mov) -> Dict[str, Any]:
+    return {
+        "date": mov['movement_date'].isoformat() if mov['movement_date'] else None,
+        "type": mov['movement_type'],  # 'consumo' o 'rifornimento'
+        "quantity_change": mov['quantity_change'],
+        "quantity_before": mov['quantity_before'],
+        "quantity_after": mov['quantity_after']
+    }
+
+
+# Granularità supportate per la serie aggregata dei movimenti (date_trunc)
+MOVEMENT_BUCKETS = ('day', 'week', 'month')
+
+
+def parse_movement_range(date_from: Optional[str], date_to: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Converte l'intervallo from/to (ISO 8601) nei limiti [inizio, fine) della query.
+    
+    Una data senza ora in date_to include l'intero giorno.
+    
+    Raises:
+        ValueError: Se una data non è valida o l'intervallo è vuoto
+    """
+    bounds = []
+    for name, value in (('from', date_from), ('to', date_to)):
+        if value in (None, ''):
+            bounds.append(None)
+            continue
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"{name} non valido: '{value}' (formato YYYY-MM-DD o ISO 8601)")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        if name == 'to' and len(value) == 10:
+            parsed += timedelta(days=1)
+        bounds.append(parsed)
+    
+    start, end = bounds
+    if start is not None and end is not None and start >= end:
+        raise ValueError("Intervallo date vuoto: from deve precedere to")
+    return start, end
+
+
+async def get_wine_movements(
+    telegram_id: int,
+    business_name: str,
+    wine_name: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Recupera movimenti (consumi e rifornimenti) per un vino specifico.
+    
+    Args:
+        telegram_id: ID Telegram utente
+        business_name: Nome business
+        wine_name: Nome del vino
+        date_from: Inizio intervallo (ISO 8601, opzionale)
+        date_to: Fine intervallo (ISO 8601, opzionale)
+        
+    Returns:
+        Lista di movimenti con date e quantità
+    """
+    start, end = parse_movement_range(date_from, date_to)
+    
+    try:
+        if not DATABASE_URL:
+            raise ValueError("DATABASE_URL non configurata")
+        
+        # Connessione dal pool condiviso
+        async with _acquire() as conn:
+            # Trova user_id
+            user_id = await _resolve_user_id(conn, telegram_id)
+            
+            if user_id is None:
+                logger.warning(f"[VIEWER_DB] Utente {telegram_id} non trovato")
+                return []
+            
+            # Query movimenti per questo vino
+            movements_rows = await conn.fetch(
+                _tenant_query("movements", telegram_id, business_name),
+                user_id,
+                wine_name,
+                start,
+                end
+            )
+        
         # Formatta movimenti
-        movements = []
-        for mov in movements_rows:
-            movements.append({
-                "date": mov['movement_date'].isoformat() if mov['movement_date'] else None,
-                "type": mov['movement_type'],  # 'consumo' o 'rifornimento'
-                "quantity_change": mov['quantity_change'],
-                "quantity_before": mov['quantity_before'],
-                "quantity_after": mov['quantity_after']
-            })
+        movements = [_format_movement(mov) for mov in movements_rows]
         
         logger.info(
             f"[VIEWER_DB] Movimenti recuperati per vino '{wine_name}': "
@@ -363,9 +1578,154 @@ async def get_wine_movements(telegram_id: int, business_name: str, wine_name: st
     except Exception as e:
         logger.error(f"[VIEWER_DB] Errore recupero movimenti: {e}", exc_info=True)
         raise
-    finally:
-        if conn:
-            await conn.close()
+
+
+async def get_wine_movement_series(
+    telegram_id: int,
+    business_name: str,
+    wine_name: str,
+    bucket: str,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Serie dei movimenti di un vino aggregata per giorno, settimana o mese.
+    
+    L'aggregazione è fatta in SQL (date_trunc + window function): per ogni
+    intervallo restituisce totale consumato, totale rifornito e giacenza a
+    inizio/fine intervallo, invece di tutte le righe grezze.
+    
+    Args:
+        telegram_id: ID Telegram utente
+        business_name: Nome business
+        wine_name: Nome del vino
+        bucket: Granularità ('day', 'week' o 'month'; le settimane iniziano il lunedì)
+        date_from: Inizio intervallo (ISO 8601, opzionale)
+        date_to: Fine intervallo (ISO 8601, opzionale)
+        
+    Returns:
+        Lista di punti ordinati per data (solo intervalli con movimenti)
+        
+    Raises:
+        ValueError: Se bucket o date non sono validi
+    """
+    if bucket not in MOVEMENT_BUCKETS:
+        raise ValueError(f"bucket non valido: '{bucket}'. Valori ammessi: {', '.join(MOVEMENT_BUCKETS)}")
+    
+    start, end = parse_movement_range(date_from, date_to)
+    
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    try:
+        async with _acquire() as conn:
+            user_id = await _resolve_user_id(conn, telegram_id)
+            
+            if user_id is None:
+                logger.warning(f"[VIEWER_DB] Utente {telegram_id} non trovato")
+                return []
+            
+            series_rows = await conn.fetch(
+                _tenant_query("movement_series", telegram_id, business_name),
+                user_id,
+                wine_name,
+                bucket,
+                start,
+                end
+            )
+        
+        series = [
+            {
+                "bucket": row['bucket'].isoformat(),
+                "movements": row['movements'],
+                "consumed": row['consumed'],
+                "restocked": row['restocked'],
+                "net_change": row['restocked'] - row['consumed'],
+                "quantity_start": row['quantity_start'],
+                "quantity_end": row['quantity_end']
+            }
+            for row in series_rows
+        ]
+        
+        logger.info(
+            f"[VIEWER_DB] Serie movimenti per vino '{wine_name}': bucket={bucket}, "
+            f"points={len(series)}, telegram_id={telegram_id}"
+        )
+        
+        return series
+        
+    except Exception as e:
+        logger.error(f"[VIEWER_DB] Errore serie movimenti: {e}", exc_info=True)
+        raise
+
+
+async def get_wines_movements(
+    telegram_id: int,
+    business_name: str,
+    wine_names: Optional[List[str]] = None
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Recupera i movimenti di più vini con una sola query, raggruppati per vino.
+    
+    Evita N richieste (e N connessioni) quando servono i movimenti di più
+    vini insieme, ad esempio per confronti o dashboard.
+    
+    Args:
+        telegram_id: ID Telegram utente
+        business_name: Nome business
+        wine_names: Nomi dei vini (None = tutti i vini con movimenti)
+        
+    Returns:
+        Dict nome vino -> lista di movimenti (vuota per i vini richiesti senza movimenti)
+        
+    Raises:
+        ValueError: Se la lista è vuota o supera MOVEMENTS_BATCH_MAX_WINES
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    if wine_names is not None:
+        # Deduplica mantenendo l'ordine richiesto
+        wine_names = list(dict.fromkeys(name for name in wine_names if name))
+        if not wine_names:
+            raise ValueError("wine_name mancante")
+        if len(wine_names) > MOVEMENTS_BATCH_MAX_WINES:
+            raise ValueError(f"Troppi vini in una richiesta (max {MOVEMENTS_BATCH_MAX_WINES})")
+    
+    try:
+        async with _acquire() as conn:
+            user_id = await _resolve_user_id(conn, telegram_id)
+            
+            if user_id is None:
+                logger.warning(f"[VIEWER_DB] Utente {telegram_id} non trovato")
+                return {name: [] for name in wine_names or []}
+            
+            if wine_names is None:
+                movements_rows = await conn.fetch(
+                    _tenant_query("movements_all", telegram_id, business_name),
+                    user_id
+                )
+            else:
+                movements_rows = await conn.fetch(
+                    _tenant_query("movements_batch", telegram_id, business_name),
+                    user_id,
+                    wine_names
+                )
+        
+        grouped: Dict[str, List[Dict[str, Any]]] = {name: [] for name in wine_names or []}
+        for mov in movements_rows:
+            grouped.setdefault(mov['wine_name'], []).append(_format_movement(mov))
+        
+        logger.info(
+            f"[VIEWER_DB] Movimenti recuperati in blocco: wines={len(grouped)}, "
+            f"count={len(movements_rows)}, telegram_id={telegram_id}"
+        )
+        
+        return grouped
+        
+    except Exception as e:
+        logger.error(f"[VIEWER_DB] Errore recupero movimenti in blocco: {e}", exc_info=True)
+        raise
 
 
 async def update_wine_field(
@@ -373,113 +1733,72 @@ async def update_wine_field(
     business_name: str,
     wine_id: int,
     field: str,
-    value: str
+    value: str,
+    expected_updated_at: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Aggiorna un singolo campo per un vino dell'inventario direttamente nel database.
     
+    Verifica di esistenza e UPDATE sono un solo statement. Con
+    expected_updated_at (l'updated_at della riga visto dal client) la modifica
+    viene applicata solo se nel frattempo nessun altro ha modificato il vino.
+    
     Args:
         telegram_id: Telegram ID dell'utente
         business_name: Nome del business
         wine_id: ID del vino da aggiornare
         field: Nome del campo da aggiornare
         value: Nuovo valore (come stringa, verrà convertito in base al campo)
+        expected_updated_at: updated_at ISO della riga visto dal client (None = nessun controllo)
         
     Returns:
-        Dict con risultato aggiornamento
+        Dict con risultato aggiornamento e nuovo updated_at
         
     Raises:
-        ValueError: Se campo non supportato o valore non valido
-        Exception: Se vino non trovato o errore database
+        ValueError: Se campo non supportato, valore non valido o vino non trovato
+        StaleWriteError: Se il vino è stato modificato dopo expected_updated_at
+        Exception: Errore database
     """
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL non configurata")
     
-    # Campi supportati (stesso set del processor)
-    allowed_fields = {
-        'producer': 'producer',
-        'supplier': 'supplier',
-        'vintage': 'vintage',
-        'grape_variety': 'grape_variety',
-        'classification': 'classification',
-        'selling_price': 'selling_price',
-        'cost_price': 'cost_price',
-        'alcohol_content': 'alcohol_content',
-        'description': 'description',
-        'notes': 'notes',
-    }
-    
-    if field not in allowed_fields:
+    if field not in ALLOWED_FIELDS:
         raise ValueError(
             f"Campo non consentito: {field}. "
-            f"Campi supportati: {', '.join(allowed_fields.keys())}"
+            f"Campi supportati: {', '.join(ALLOWED_FIELDS.keys())}"
         )
     
-    # Normalizza tipi per alcuni campi (stessa logica del processor)
-    def cast_value(f: str, v: str):
-        if f == 'vintage':
-            try:
-                parsed = int(v)
-                if parsed < 1800 or parsed > 2100:
-                    raise ValueError(f"Anno non valido: {parsed}")
-                return parsed
-            except (ValueError, TypeError):
-                raise ValueError(f"Anno non valido per {f}: '{v}'")
-        if f in ('selling_price', 'cost_price', 'alcohol_content'):
-            try:
-                parsed = float(str(v).replace(',', '.'))
-                if f == 'alcohol_content' and (parsed < 0 or parsed > 100):
-                    raise ValueError(f"Gradazione alcolica non valida: {parsed}%")
-                if f in ('selling_price', 'cost_price') and parsed < 0:
-                    raise ValueError(f"Prezzo non può essere negativo: {parsed}")
-                return parsed
-            except (ValueError, TypeError):
-                raise ValueError(f"Numero non valido per {f}: '{v}'")
-        # Per stringhe, rimuovi spazi eccessivi
-        return str(v).strip() if v else None
-    
-    column = allowed_fields[field]
-    new_value = cast_value(field, value)
-    
-    conn = None
+    column = ALLOWED_FIELDS[field]
+    new_value = cast_field_value(field, value)
+    expected_version = parse_expected_updated_at(expected_updated_at)
+    
     try:
-        # Connetti al database
-        conn = await asyncpg.connect(DATABASE_URL)
-        
-        # Verifica che utente esista
-        user_query = "SELECT id FROM users WHERE telegram_id = $1"
-        user_row = await conn.fetchrow(user_query, telegram_id)
-        
-        if not user_row:
-            raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
-        
-        user_id = user_row['id']
-        
-        # Nome tabella inventario
-        table_name = f'"{telegram_id}/{business_name} INVENTARIO"'
-        
-        # Verifica che il vino esista
-        check_query = f"""
-            SELECT id FROM {table_name}
-            WHERE id = $1 AND user_id = $2
-        """
-        wine_check = await conn.fetchrow(check_query, wine_id, user_id)
+        # Connessione dal pool condiviso
+        async with _acquire() as conn:
+            # Verifica che utente esista (user_id in cache tra le richieste)
+            user_id = await _resolve_user_id(conn, telegram_id)
+            
+            if user_id is None:
+                raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+            
+            # Esistenza, controllo versione e aggiornamento in un solo round trip
+            update_query = _tenant_query("update_field", telegram_id, business_name, column)
+            
+            # La notifica parte solo se l'UPDATE è stato applicato (consegnata al commit)
+            updated_row = await conn.fetchrow(
+                update_query, new_value, wine_id, user_id, expected_version,
+                INVENTORY_NOTIFY_CHANNEL,
+                inventory_change_payload(telegram_id, business_name, [wine_id])
+            )
         
-        if not wine_check:
+        if not updated_row:
             raise ValueError(f"Vino con id {wine_id} non trovato")
         
-        # Aggiorna campo
-        update_query = f"""
-            UPDATE {table_name}
-            SET {column} = $1, updated_at = CURRENT_TIMESTAMP
-            WHERE id = $2 AND user_id = $3
-            RETURNING id, {column}
-        """
+        if not updated_row['applied']:
+            raise StaleWriteError(wine_id, updated_row['current_updated_at'])
         
-        updated_row = await conn.fetchrow(update_query, new_value, wine_id, user_id)
-        
-        if not updated_row:
-            raise ValueError("Vino non trovato dopo aggiornamento")
+        # Lo snapshot in cache non riflette più il database
+        invalidate_inventory_cache(telegram_id, business_name)
         
         logger.info(
             f"[VIEWER_DB] Campo aggiornato: {field} = {new_value} per wine_id={wine_id}, "
@@ -491,16 +1810,184 @@ async def update_wine_field(
             "wine_id": wine_id,
             "field": field,
             "value": new_value,
+            "updated_at": updated_row['new_updated_at'].isoformat(),
             "message": f"Campo {field} aggiornato con successo"
         }
         
+    except StaleWriteError as e:
+        logger.warning(f"[VIEWER_DB] Modifica rifiutata (versione superata): {e}")
+        raise
     except Exception as e:
         logger.error(
             f"[VIEWER_DB] Errore aggiornamento campo: {e}",
             exc_info=True
         )
         raise
-    finally:
-        if conn:
-            await conn.close()
 
+
+async def update_wine_fields(
+    telegram_id: int,
+    business_name: str,
+    changes: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """
+    Aggiorna in blocco più campi di più vini in un'unica transazione.
+    
+    Ogni modifica è validata con le stesse regole di update_wine_field; le
+    modifiche non valide vengono segnalate nel risultato senza bloccare le
+    altre. Se una modifica include expected_updated_at e il vino è stato
+    modificato nel frattempo, tutte le modifiche a quel vino vengono rifiutate
+    con status "conflict". Le modifiche valide sono raggruppate per colonna e applicate con un
+    solo UPDATE ... FROM unnest(...) per colonna. Se più modifiche toccano lo
+    stesso campo dello stesso vino vale l'ultima.
+    
+    Args:
+        telegram_id: Telegram ID dell'utente
+        business_name: Nome del business
+        changes: Lista di dict con wine_id, field, value ed eventuale expected_updated_at
+        
+    Returns:
+        Dict con status, updated, failed e results (un esito per modifica, stesso ordine)
+        
+    Raises:
+        ValueError: Se changes non è una lista valida o l'utente non esiste
+    """
+    if not DATABASE_URL:
+        raise ValueError("DATABASE_URL non configurata")
+    
+    if not isinstance(changes, list) or not changes:
+        raise ValueError("changes deve essere una lista non vuota")
+    if len(changes) > BULK_UPDATE_MAX_CHANGES:
+        raise ValueError(f"Troppe modifiche in una richiesta (max {BULK_UPDATE_MAX_CHANGES})")
+    
+    results: List[Dict[str, Any]] = []
+    # colonna -> {wine_id: (indice risultato, valore)}
+    by_column: Dict[str, Dict[int, tuple]] = {}
+    # wine_id -> updated_at atteso dal client
+    expected_versions: Dict[int, datetime] = {}
+    
+    for index, change in enumerate(changes):
+        result = {"index": index}
+        results.append(result)
+        try:
+            if not isinstance(change, dict):
+                raise ValueError("Modifica non valida: atteso un oggetto con wine_id, field, value")
+            
+            field = change.get('field')
+            result["field"] = field
+            try:
+                wine_id = int(change.get('wine_id'))
+            except (TypeError, ValueError):
+                raise ValueError(f"wine_id non valido: {change.get('wine_id')!r}")
+            result["wine_id"] = wine_id
+            
+            if field not in ALLOWED_FIELDS:
+                raise ValueError(
+                    f"Campo non consentito: {field}. "
+                    f"Campi supportati: {', '.join(ALLOWED_FIELDS.keys())}"
+                )
+            
+            value = change.get('value')
+            new_value = cast_field_value(field, str(value) if value is not None else '')
+            expected_updated_at = parse_expected_updated_at(change.get('expected_updated_at'))
+        except ValueError as e:
+            result.update(status="error", detail=str(e))
+            continue
+        
+        column_changes = by_column.setdefault(ALLOWED_FIELDS[field], {})
+        previous = column_changes.get(wine_id)
+        if previous is not None:
+            results[previous[0]].update(
+                status="skipped",
+                detail="Sostituita da una modifica successiva allo stesso campo"
+            )
+        column_changes[wine_id] = (index, new_value)
+        result["value"] = new_value
+        if expected_updated_at is not None:
+            expected_versions.setdefault(wine_id, expected_updated_at)
+    
+    if by_column:
+        try:
+            async with _acquire() as conn:
+                user_id = await _resolve_user_id(conn, telegram_id)
+                
+                if user_id is None:
+                    raise ValueError(f"Utente con telegram_id {telegram_id} non trovato")
+                
+                async with conn.transaction():
+                    if expected_versions:
+                        # Blocca le righe e confronta le versioni prima di scrivere
+                        current_rows = await conn.fetch(
+                            _tenant_query("lock_versions", telegram_id, business_name),
+                            list(expected_versions),
+                            user_id
+                        )
+                        for row in current_rows:
+                            if row['updated_at'] == expected_versions[row['id']]:
+                                continue
+                            current_updated_at = row['updated_at'].isoformat() if row['updated_at'] else None
+                            for column_changes in by_column.values():
+                                stale = column_changes.pop(row['id'], None)
+                                if stale is not None:
+                                    results[stale[0]].update(
+                                        status="conflict",
+                                        detail="Vino modificato nel frattempo da un altro dispositivo",
+                                        current_updated_at=current_updated_at
+                                    )
+                    
+                    for column, column_changes in by_column.items():
+                        if not column_changes:
+                            continue
+                        wine_ids = list(column_changes)
+                        values = [column_changes[wine_id][1] for wine_id in wine_ids]
+                        updated_rows = await conn.fetch(
+                            _tenant_query("bulk_update_field", telegram_id, business_name, column),
+                            wine_ids,
+                            values,
+                            user_id
+                        )
+                        updated_versions = {row['id']: row['updated_at'] for row in updated_rows}
+                        
+                        for wine_id, (index, _) in column_changes.items():
+                            if wine_id in updated_versions:
+                                results[index].update(
+                                    status="success",
+                                    updated_at=updated_versions[wine_id].isoformat()
+                                )
+                            else:
+                                results[index].update(status="error", detail=f"Vino con id {wine_id} non trovato")
+                    
+                    changed_ids = sorted({
+                        result["wine_id"] for result in results if result.get("status") == "success"
+                    })
+                    if changed_ids and INVENTORY_NOTIFY_CHANNEL:
+                        # Consegnata ai listener solo al commit della transazione
+                        await conn.execute(
+                            "SELECT pg_notify($1, $2)",
+                            INVENTORY_NOTIFY_CHANNEL,
+                            inventory_change_payload(telegram_id, business_name, changed_ids)
+                        )
+        except Exception as e:
+            logger.error(f"[VIEWER_DB] Errore aggiornamento in blocco: {e}", exc_info=True)
+            raise
+    
+    updated = sum(1 for result in results if result.get("status") == "success")
+    failed = sum(1 for result in results if result.get("status") in ("error", "conflict"))
+    conflicts = sum(1 for result in results if result.get("status") == "conflict")
+    
+    if updated:
+        # Lo snapshot in cache non riflette più il database
+        invalidate_inventory_cache(telegram_id, business_name)
+    
+    logger.info(
+        f"[VIEWER_DB] Aggiornamento in blocco: changes={len(changes)}, updated={updated}, "
+        f"failed={failed}, conflicts={conflicts}, telegram_id={telegram_id}, business_name={business_name}"
+    )
+    
+    return {
+        "status": "success" if not failed else ("partial" if updated else "error"),
+        "updated": updated,
+        "failed": failed,
+        "conflicts": conflicts,
+        "results": results
+    }